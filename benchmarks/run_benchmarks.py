@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the MIEZE reduction on synthetic scans.
+
+Writes synthetic NICOS/CASCADE scans (see `ndatautils.synthetic´) of
+several sizes to a temporary directory and times loading, metadata parsing,
+ROI sums, mask sums, fits, bootstrap and the full scan analysis. The results
+are compared against a stored baseline to detect regressions.
+
+Usage
+-----
+    python benchmarks/run_benchmarks.py                     # run and compare with baseline.json
+    python benchmarks/run_benchmarks.py --sizes 1 4 --only load fit_linear
+    python benchmarks/run_benchmarks.py --check             # exit code 1 on regressions
+    python benchmarks/run_benchmarks.py --save-baseline     # store the results as new baseline
+    python benchmarks/run_benchmarks.py --profile prof.json # per-stage timings of the runs
+
+Baselines are machine dependent, regenerate them with --save-baseline
+before comparing on another machine.
+"""
+
+### Imports
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+import platform
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from ndatautils import profiling
+from ndatautils.datapath import DataPath
+from ndatautils.fileloader import CascadeLoader
+from ndatautils.instrumentloader import RESEDALoader
+from ndatautils.masks import Sector_Mask, mask_matrix
+from ndatautils.miezefitter.dreduction import Reduction, ReductionStructure
+from ndatautils.synthetic import write_scan
+###
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+PROPOSAL = 14891
+SCAN_FNUM = 1
+FOILS = (0, 1, 2, 3)
+LRBT = [58, 71, 56, 73]
+CENTER = (64.0, 64.0)
+
+#-----------------------------------------------------------------------------
+
+class ScanContext:
+    """
+    Synthetic scan of nfiles files with lazily created loaders and Reductions
+    """
+
+    def __init__(self, root, nfiles):
+        self.root = root
+        self.nfiles = nfiles
+        self.scan = write_scan(root, PROPOSAL, SCAN_FNUM, range(1, nfiles + 1), contrast=0.6, phase=1.3, center=CENTER)
+        self.fnums = self.scan["fnums"]
+        self._reductions = {}
+
+    def loader(self, rawdata=True):
+        return CascadeLoader(DataPath("RESEDA", PROPOSAL, self.root, ".tof"),
+                             RESEDALoader("TOF", rawdata=rawdata, foils=FOILS))
+
+    def reductions(self, backend="linear"):
+        """
+        Loaded Reductions of all files, read once per backend.
+        """
+        if backend not in self._reductions:
+            self._reductions[backend] = [Reduction(self.loader(), fnum, backend=backend) for fnum in self.fnums]
+        return self._reductions[backend]
+
+####################################################################################################
+####################################################################################################
+####################################################################################################
+
+def bench_load(ctx):
+    loader = ctx.loader()
+    for fnum in ctx.fnums:
+        loader.read_out_data(fnum)
+
+def bench_metadata(ctx):
+    loader = ctx.loader(rawdata=False)
+    for fnum in ctx.fnums:
+        loader.read_out_data(fnum)
+
+def bench_roi_sums(ctx):
+    for red in ctx.reductions():
+        red.integral_image = None
+        red.prepare_fit_data(lrbt=LRBT)
+
+def bench_mask_sums(ctx):
+    sectors = [Sector_Mask(128, CENTER, 0, 8, (angle, angle + 90), "RESEDA") for angle in (0, 90, 180, 270)]
+    stacked = mask_matrix(sectors)
+    for red in ctx.reductions():
+        red.mask_sums(sectors[0])
+        red.mask_sums(stacked)
+
+def fit_bench(backend):
+    def bench(ctx):
+        for red in ctx.reductions(backend):
+            red.run_reduction("simple_fit", lrbt=LRBT)
+    return bench
+
+def bench_bootstrap(ctx):
+    for red in ctx.reductions():
+        red.run_reduction("bootstrap", steps=200, chunk_size=50, seed=0)
+
+def bench_analyze(ctx):
+    structure = ReductionStructure(ctx.loader(), *ctx.fnums, backend="linear")
+    structure.analyze("simple_fit", {"lrbt" : LRBT}, {"T_value" : "T"})
+
+BENCHMARKS = {
+    "load" : bench_load,
+    "metadata" : bench_metadata,
+    "roi_sums" : bench_roi_sums,
+    "mask_sums" : bench_mask_sums,
+    "fit_linear" : fit_bench("linear"),
+    "fit_native" : fit_bench("native"),
+    "fit_lmfit" : fit_bench("lmfit"),
+    "bootstrap" : bench_bootstrap,
+    "analyze" : bench_analyze,
+}
+
+####################################################################################################
+####################################################################################################
+####################################################################################################
+
+def time_benchmark(func, ctx, repeat):
+    """
+    Runs func(ctx) once as warm up and repeat times timed.
+
+    Return
+    ------
+    timing : dict
+        "best" and "median" wall time in s, "best_per_file"
+    """
+    func(ctx)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(ctx)
+        times.append(time.perf_counter() - start)
+    return {"best" : min(times), "median" : statistics.median(times), "best_per_file" : min(times) / ctx.nfiles}
+
+#-----------------------------------------------------------------------------
+
+def run(sizes, names, repeat, workdir):
+    """
+    Runs the benchmarks names at every scan size and returns the results
+    {name : {str(size) : timing}}.
+    """
+    results = {name : {} for name in names}
+    for size in sizes:
+        ctx = ScanContext(os.path.join(workdir, "scan_{}".format(size)), size)
+        for name in names:
+            results[name][str(size)] = timing = time_benchmark(BENCHMARKS[name], ctx, repeat)
+            print("{:<12s} {:>4d} files  best {:10.4f} s  median {:10.4f} s".format(name, size, timing["best"], timing["median"]))
+        del ctx
+    return results
+
+#-----------------------------------------------------------------------------
+
+def compare(results, baseline, tolerance, min_delta=0.002):
+    """
+    Compares the best times with the baseline and returns the regressions
+    [(name, size, ratio), ...] slower than (1 + tolerance) times the baseline
+    and by more than min_delta seconds, which ignores timer noise of very
+    short benchmarks.
+    """
+    regressions = []
+    print("\n{:<12s} {:>6s} {:>12s} {:>12s} {:>8s}".format("benchmark", "files", "best [s]", "baseline [s]", "ratio"))
+    for name, timings in results.items():
+        for size, timing in timings.items():
+            reference = baseline.get(name, {}).get(size)
+            if reference is None:
+                continue
+            ratio = timing["best"] / reference["best"]
+            slower = ratio > 1 + tolerance and timing["best"] - reference["best"] > min_delta
+            flag = " REGRESSION" if slower else ""
+            print("{:<12s} {:>6s} {:>12.4f} {:>12.4f} {:>8.2f}{}".format(name, size, timing["best"], reference["best"], ratio, flag))
+            if flag:
+                regressions.append((name, int(size), ratio))
+    return regressions
+
+#-----------------------------------------------------------------------------
+
+def environment():
+    return {"python" : platform.python_version(), "numpy" : np.__version__,
+            "platform" : platform.platform(), "processor" : platform.processor(),
+            "date" : time.strftime("%Y-%m-%d")}
+
+#-----------------------------------------------------------------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the MIEZE reduction on synthetic scans.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 4, 16], help="number of files per scan")
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), default=list(BENCHMARKS), help="benchmarks to run")
+    parser.add_argument("--repeat", type=int, default=3, help="timed repetitions per benchmark")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slow down")
+    parser.add_argument("--min-delta", type=float, default=0.002, help="ignored absolute slow down in s")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as baseline")
+    parser.add_argument("--check", action="store_true", help="exit with 1 if a benchmark regressed")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--profile", help="write per-stage timings (ndatautils.profiling) to this JSON file")
+    parser.add_argument("--workdir", help="directory of the synthetic scans, temporary if not given")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = tmpdir if args.workdir is None else args.workdir
+        with (profiling.profile() if args.profile is not None else contextlib.nullcontext()) as stats:
+            results = run(args.sizes, args.only, args.repeat, workdir)
+    if args.profile is not None:
+        stats.to_json(args.profile)
+
+    report = {"environment" : environment(), "repeat" : args.repeat, "results" : results}
+    if args.output is not None:
+        with open(args.output, "w") as wfile:
+            json.dump(report, wfile, indent=2)
+
+    regressions = []
+    if args.save_baseline:
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r") as rfile:
+                previous = json.load(rfile)["results"]
+            for name, timings in previous.items():
+                report["results"].setdefault(name, {})
+                for size, timing in timings.items():
+                    report["results"][name].setdefault(size, timing)
+        with open(args.baseline, "w") as wfile:
+            json.dump(report, wfile, indent=2)
+        print("\nBaseline written to {}".format(args.baseline))
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r") as rfile:
+            baseline = json.load(rfile)
+        regressions = compare(results, baseline["results"], args.tolerance, args.min_delta)
+        print("\n{} regression(s) beyond {:.0%} of the baseline.".format(len(regressions), args.tolerance))
+
+    return 1 if args.check and regressions else 0
+
+#-----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,19 @@
-# Importin datapath possible?
-from . import datapath
-from . import instrumentloader
-from . import fileloader
-from . import utils
-from . import miezefitter
-from . import masks
\ No newline at end of file
+"""
+Submodules are loaded on first access (e.g. ``ndatautils.fileloader``), such
+that e.g. a worker only reading files does not import the fitting and
+plotting dependencies.
+"""
+import importlib
+
+_SUBMODULES = ("datapath", "instrumentloader", "fileloader", "utils", "miezefitter", "masks", "profiling",
+               "uncertainty", "optimize", "pipeline", "synthetic", "sharedstore", "cli")
+
+__all__ = list(_SUBMODULES)
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+def __dir__():
+    return sorted(set(globals()) | set(_SUBMODULES))
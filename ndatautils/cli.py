@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Command line batch reduction of MIEZE data.
+
+Installed as the `ndatautils-reduce´ console script:
+
+    ndatautils-reduce RESEDA 14891 /data/RESEDA --scan 4408 --lrbt 62 79 52 69 --workers 0 -o scan_4408.txt
+    ndatautils-reduce MIRA 13524 /data/MIRA --fnums 298077-298120,298130 --method bootstrap --param steps=500 --param seed=1
+    ndatautils-reduce RESEDA 14891 /data/RESEDA --scan 4408 --sector 64 64 0 8 0 360 --backend native -o scan.npz
+
+The files are reduced by `miezefitter.dreduction.ReductionStructure´ in a
+pool of worker processes, the results are written by
+`ReductionStructure.to_file´ in one go, or per batch of files with --batch.
+"""
+
+### Imports
+import os
+import sys
+import ast
+import time
+import argparse
+import numpy as np
+from .datapath import DataPath
+from .fileloader import ASCIILoader, CascadeLoader
+from .instrumentloader import MIRALoader, RESEDALoader
+from .masks import Instrument, Sector_Mask
+from .miezefitter.dreduction import ReductionStructure
+###
+
+LOADERS = {"RESEDA" : RESEDALoader, "MIRA" : MIRALoader}
+METHODS = ("simple_fit", "superimposed_fitting", "bootstrap")
+
+#-----------------------------------------------------------------------------
+
+def parse_fnums(spec):
+    """
+    File numbers of a range specification like '100-120,130,140-160:5'
+    (ranges include their end, an optional ':step' thins them out).
+    """
+    fnums = []
+    for part in spec.replace(" ", "").split(","):
+        if not part:
+            continue
+        part, _, step = part.partition(":")
+        first, _, last = part.partition("-")
+        if last:
+            fnums.extend(range(int(first), int(last) + 1, int(step) if step else 1))
+        else:
+            fnums.append(int(first))
+    if not fnums:
+        raise argparse.ArgumentTypeError("No file numbers in '{}'.".format(spec))
+    return fnums
+
+#-----------------------------------------------------------------------------
+
+def parse_param(item):
+    """
+    Parses 'key=value' into (key, value), values as python literals if possible.
+    """
+    key, sep, value = item.partition("=")
+    if not sep or not key:
+        raise argparse.ArgumentTypeError("Expected key=value, got '{}'.".format(item))
+    try:
+        return key, ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return key, value
+
+#-----------------------------------------------------------------------------
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="ndatautils-reduce",
+                                     description="Batch reduction of MIEZE '.tof' files with a pool of worker processes.")
+    parser.add_argument("instrument", choices=sorted(LOADERS), type=str.upper, help="instrument of the data")
+    parser.add_argument("proposal", type=int, help="proposal number")
+    parser.add_argument("root", help="data root directory, see ndatautils.datapath.DataPath")
+
+    files = parser.add_mutually_exclusive_group(required=True)
+    files.add_argument("--fnums", type=parse_fnums, help="file numbers, e.g. '100-120,130,140-160:5'")
+    files.add_argument("--scan", type=int, help="number of a '.dat' scan file listing the files")
+
+    roi = parser.add_mutually_exclusive_group()
+    roi.add_argument("--lrbt", type=int, nargs=4, metavar=("LEFT", "RIGHT", "BOTTOM", "TOP"), help="rectangular ROI")
+    roi.add_argument("--lbwh", type=int, nargs=4, metavar=("LEFT", "BOTTOM", "WIDTH", "HEIGHT"), help="rectangular ROI")
+    roi.add_argument("--sector", type=float, nargs=6, metavar=("X", "Y", "R_IN", "R_OUT", "ANGLE_0", "ANGLE_1"),
+                     help="sector mask around (X, Y), angles in degrees")
+    roi.add_argument("--mask", help="'.npy' file of a (128, 128) mask array")
+
+    parser.add_argument("--method", choices=METHODS, default="simple_fit", help="reduction method")
+    parser.add_argument("--param", type=parse_param, action="append", default=[], metavar="KEY=VALUE",
+                        help="further parameters of the method, e.g. steps=500 (repeatable)")
+    parser.add_argument("--backend", default="linear", choices=["linear", "native", "lmfit"], help="fit backend")
+    parser.add_argument("--foils", type=int, nargs="+", help="relevant foils, the instrument's default if not given")
+    parser.add_argument("--metadata", type=parse_param, action="append", default=[], metavar="KEY=ALIAS",
+                        help="metadata entry written as result column, e.g. T_value=T (repeatable)")
+    parser.add_argument("-w", "--workers", type=int, default=0, help="worker processes, 0 uses all cores")
+    parser.add_argument("--shared-memory", action="store_true",
+                        help="read the files into shared memory, which the workers attach to without copying")
+    parser.add_argument("--batch", type=int, default=0,
+                        help="files per batch written to the output, 0 reduces all files in one batch. "
+                             "Binary outputs (.npz, .npy) are rewritten per batch, prefer .txt for many batches")
+    parser.add_argument("--cache", help="result cache directory, see miezefitter.resultcache. Entries are "
+                                        "unpickled, only use trusted directories nobody else can write to")
+    parser.add_argument("--prefetch", type=int, default=2,
+                        help="files read ahead in a background thread, only used with --workers 1")
+    parser.add_argument("-o", "--output", default="reduction_results.txt", help="result file (.txt, .npz or .npy)")
+    parser.add_argument("--append", action="store_true", help="append to an existing result file")
+    parser.add_argument("-q", "--quiet", action="store_true", help="no progress output")
+    return parser
+
+#-----------------------------------------------------------------------------
+
+def scan_fnums(instrument, proposal, root, scan):
+    """
+    File numbers listed in the '.dat' scan file number scan.
+    """
+    scanloader = ASCIILoader(DataPath(instrument, proposal, root, ".dat"), LOADERS[instrument]("DAT"))
+    scanloader.read_out_data(scan)
+    return scanloader.fnums_from_structured_array()
+
+#-----------------------------------------------------------------------------
+
+def red_params(args):
+    """
+    Parameters of the reduction method from the ROI options and --param.
+    """
+    params = {}
+    if args.lrbt is not None:
+        params["lrbt"] = args.lrbt
+    elif args.lbwh is not None:
+        params["lbwh"] = args.lbwh
+    elif args.sector is not None:
+        x, y, r_in, r_out, angle_0, angle_1 = args.sector
+        params["pre_mask"] = Sector_Mask(128, (x, y), r_in, r_out, (angle_0, angle_1), args.instrument)
+    elif args.mask is not None:
+        params["pre_mask"] = np.load(args.mask)
+    params.update(dict(args.param))
+    return params
+
+#-----------------------------------------------------------------------------
+
+class ProgressReport:
+    """
+    Prints the number of reduced files and the throughput to stderr.
+    """
+
+    def __init__(self, total, quiet=False, stream=None):
+        self.total = total
+        self.quiet = quiet
+        self.stream = sys.stderr if stream is None else stream
+        self.offset = 0
+        self.start = time.perf_counter()
+
+    def __call__(self, done, batch_total):
+        if self.quiet:
+            return
+        done += self.offset
+        elapsed = time.perf_counter() - self.start
+        rate = done / elapsed if elapsed > 0 else 0.0
+        self.stream.write("\r{:>6d}/{} files  {:7.2f} files/s  {:7.1f} s".format(done, self.total, rate, elapsed))
+        if done == self.total:
+            self.stream.write("\n")
+        self.stream.flush()
+
+#-----------------------------------------------------------------------------
+
+def main(argv=None):
+    """
+    Entry point of `ndatautils-reduce´. Returns the exit code.
+    """
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.method == "bootstrap" and any(roi is not None for roi in (args.lrbt, args.lbwh, args.sector, args.mask)):
+        parser.error("the bootstrap method draws its own ROIs around the beam center, drop the ROI option")
+    fnums = args.fnums if args.scan is None else scan_fnums(args.instrument, args.proposal, args.root, args.scan)
+    foils = tuple(args.foils) if args.foils else getattr(Instrument, args.instrument)["foils"]
+    params = red_params(args)
+    workers = None if args.workers <= 0 else args.workers
+    fileloader = CascadeLoader(DataPath(args.instrument, args.proposal, args.root, ".tof"),
+                               LOADERS[args.instrument]("TOF", foils=foils))
+
+    batch = len(fnums) if args.batch <= 0 else args.batch
+    report = ProgressReport(len(fnums), quiet=args.quiet)
+    for first in range(0, len(fnums), batch):
+        with ReductionStructure(fileloader, *fnums[first:first+batch], backend=args.backend, workers=workers,
+                                retain_data=False, cache=args.cache, prefetch=args.prefetch if workers == 1 else 0,
+                                shared_memory=args.shared_memory, progress=report) as structure:
+            structure.analyze(args.method, dict(params), dict(args.metadata))
+            structure.to_file(args.output, append=args.append or first > 0)
+        report.offset += len(structure.red_list)
+
+    if not args.quiet:
+        elapsed = time.perf_counter() - report.start
+        print("Reduced {} files in {:.1f} s ({:.2f} files/s), results written to {}".format(
+            len(fnums), elapsed, len(fnums) / elapsed, os.path.abspath(args.output)), file=sys.stderr)
+    return 0
+
+#-----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    sys.exit(main())
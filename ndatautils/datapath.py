@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from os import path
+from .profiling import timed
 
 class DataPath:
     """
@@ -41,6 +42,7 @@ class DataPath:
 
 #---------------------------------------------------------------------------------------------------
 
+    @timed("DataPath.gen_path")
     def gen_path(self, fnum):
         """
         Returns the path of a specified datafile by its filenumber. Hands task to correct path generator
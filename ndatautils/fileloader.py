@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
 
+import os
 import re
+import copy
+import time
+import threading
+from collections import OrderedDict, deque
 import numpy as np
 from .datapath import DataPath
+from . import profiling
+from .profiling import timed
 
 ####################################################################################################
 ####################################################################################################
@@ -173,6 +180,7 @@ class CascadeLoader(FileLoaderBase):
 
 #---------------------------------------------------------------------------------------------------
 
+    @timed("CascadeLoader._meta_data")
     def _meta_data(self, fnum):
         """
         Extracts metadata from a ".pad" or ".tof" file. If some quantities are specified in a
@@ -196,12 +204,15 @@ class CascadeLoader(FileLoaderBase):
         currentkey = "binarydump"
         metadict = {currentkey : {}}
         with open(self.datapath(fnum), "rb") as f:
+            lines = f.readlines()
+            if profiling.is_enabled():
+                profiling.add_bytes(f.tell())
 
-            for line in f.readlines():
+            for line in lines:
                 try:
                     temp = line.decode("utf-8").strip().split(':')
-                except:
-                    pass
+                except UnicodeDecodeError:
+                    continue    # binary payload
 
                 if len(temp) == 1 and temp[0][:3] == "###":
                     currentkey = temp[0][3:].strip()
@@ -250,6 +261,7 @@ class CascadeLoader(FileLoaderBase):
 
 #---------------------------------------------------------------------------------------------------
 
+    @timed("CascadeLoader._raw_data")
     def _raw_data(self, fnum):
         """
         Extracts rawdata from a ".pad" or ".tof" file. If a array shape is specified in a
@@ -267,15 +279,52 @@ class CascadeLoader(FileLoaderBase):
         --> summation or mean calculation on the raw data
         """
 
+        filearr = np.fromfile(self.datapath(fnum), dtype = np.int32)
+        if profiling.is_enabled():
+            profiling.add_bytes(filearr.nbytes)
         try:
-            temparr = np.fromfile(self.datapath(fnum), dtype = np.int32)[:128*128*16*8].reshape(8, 16, 128, 128)
-        except TypeError:
-            temparr = np.fromfile(self.datapath(fnum), dtype = np.int32)[:128*128].reshape(128, 128)
-        except ValueError:
-            temparr = np.fromfile(self.datapath(fnum), dtype = np.int32)[:128*128].reshape(128, 128)
+            temparr = filearr[:128*128*16*8].reshape(8, 16, 128, 128)
+        except (TypeError, ValueError):
+            temparr = filearr[:128*128].reshape(128, 128)
 
         return temparr
 
+#---------------------------------------------------------------------------------------------------
+
+    @timed("CascadeLoader.read_rawdata_into")
+    def read_rawdata_into(self, fnum, out, foils = None):
+        """
+        Reads the (8, 16, 128, 128) rawdata of a ".tof" file directly into a
+        preallocated int32 array, e.g. a block of a sharedstore.SharedArrayStore,
+        without an intermediate copy.
+
+        Parameters
+        ----------
+        fnum : int
+            passed to the self.datapath instance to get path of the data file
+        out : numpy.ndarray
+            C-contiguous int32 array of shape (8, 16, 128, 128), or
+            (len(foils), 16, 128, 128) if foils are given
+        foils : sequence, None
+            foils to read, in the order of out
+        """
+
+        foil_bytes = 16*128*128*4
+        with open(self.datapath(fnum), "rb") as f:
+            if foils is None:
+                nread = f.readinto(memoryview(out).cast("B"))
+                expected = out.nbytes
+            else:
+                nread = 0
+                for ind, foil in enumerate(foils):
+                    f.seek(foil * foil_bytes)
+                    nread += f.readinto(memoryview(out[ind]).cast("B"))
+                expected = len(foils) * foil_bytes
+        if profiling.is_enabled():
+            profiling.add_bytes(nread)
+        if nread < expected:
+            raise IOError("File {} holds only {} of {} bytes rawdata.".format(self.datapath(fnum), nread, expected))
+
 #---------------------------------------------------------------------------------------------------
 
     def not_yet_implemented(self):
@@ -324,8 +373,8 @@ class ASCIILoader(FileLoaderBase):
             for line in f.readlines():
                 try:
                     temp = line.decode("utf-8")[1:].strip().split(':') # [1:] omits the first '#'
-                except:
-                    pass
+                except UnicodeDecodeError:
+                    continue
 
                 if len(temp) == 1 and temp[0][:2] == "##": # find only '##' because the first one was omitted earlier
                     currentkey = temp[0][2:].strip()
@@ -379,6 +428,7 @@ class ASCIILoader(FileLoaderBase):
 
 #---------------------------------------------------------------------------------------------------
 
+    @timed("ASCIILoader._raw_data")
     def _raw_data(self, fnum):
         """
         Extracts array data from '.dat' file
@@ -394,7 +444,10 @@ class ASCIILoader(FileLoaderBase):
         --> summation or mean calculation on the raw data
         """
 
-        data_as_string = np.genfromtxt(self.datapath(fnum), dtype = str)
+        fpath = self.datapath(fnum)
+        data_as_string = np.genfromtxt(fpath, dtype = str)
+        if profiling.is_enabled():
+            profiling.add_bytes(os.path.getsize(fpath))
 
         if self.instrumentloader != None and self.instrumentloader.get_Loader_settings('array_format') != None:
 #            print("For debugging purposes: ",data_as_string[:3]) #DEBUGGING
@@ -439,7 +492,197 @@ class ASCIILoader(FileLoaderBase):
 ####################################################################################################
 ####################################################################################################
 
+class PrefetchLoader:
+    """
+    Wraps a file loader and reads the next scheduled files in a background
+    thread, while the current file is processed.
+    """
+
+    def __init__(self, fileloader, fnums=(), depth=2, max_bytes=512*2**20):
+        """
+        Initializes a PrefetchLoader instance
+
+        Parameters
+        ----------
+        fileloader : subclass of(or) FileLoaderBase
+            loader reading the files
+        fnums : iterable
+            file numbers in the order they will be requested, see `schedule´
+        depth : int
+            maximal number of files read ahead
+        max_bytes : int
+            maximal size of the arrays of all files read ahead. The size of
+            the largest file read so far is used to decide if the next file
+            still fits.
+
+        Notes
+        -----
+        read_out_data(fnum) serves the prefetched datadict if available and
+        reads the file directly otherwise. Prefetched files requested out of
+        order are discarded, once a later file is requested. Failed background
+        reads are repeated directly when the file is requested, also if the
+        request was already waiting for the background read. self.stats counts
+        "hits" (file was ready), "waits" (file was being read, "wait_time" in
+        seconds), "misses" (read directly), "prefetched" and "discarded" files.
+        """
+        self.fileloader = fileloader
+        self.instrumentloader = fileloader.instrumentloader
+        self.datapath = getattr(fileloader, "datapath", None)
+        self.datadict = {}
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self.stats = {"hits" : 0, "waits" : 0, "misses" : 0, "wait_time" : 0.0, "prefetched" : 0, "discarded" : 0}
+
+        self._reader = copy.copy(fileloader)
+        self._reader.datadict = {}
+        self._reader.instrumentloader = copy.deepcopy(fileloader.instrumentloader)
+        self._cond = threading.Condition()
+        self._scheduled = deque(fnums)
+        self._ready = OrderedDict()
+        self._errors = {}
+        self._loading = None
+        self._ready_bytes = 0
+        self._file_bytes = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._prefetch, daemon=True)
+        self._thread.start()
+
+#---------------------------------------------------------------------------------------------------
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+#---------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def _nbytes(datadict):
+        return sum(val.nbytes for val in datadict.values() if isinstance(val, np.ndarray))
 
+#---------------------------------------------------------------------------------------------------
+
+    def schedule(self, fnums):
+        """
+        Appends file numbers to the files read ahead. Ignored after `close´.
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._scheduled.extend(fnums)
+            self._cond.notify_all()
+
+#---------------------------------------------------------------------------------------------------
+
+    def _may_prefetch(self):
+        return (len(self._scheduled) > 0 and len(self._ready) < self.depth
+                and self._ready_bytes + self._file_bytes <= self.max_bytes)
+
+#---------------------------------------------------------------------------------------------------
+
+    def _prefetch(self):
+        """
+        Background thread reading the scheduled files with a private copy of the loader.
+        """
+        while True:
+            with self._cond:
+                while not self._closed and not self._may_prefetch():
+                    self._cond.wait()
+                if self._closed:
+                    return
+                fnum = self._loading = self._scheduled.popleft()
+
+            try:
+                self._reader.read_out_data(fnum)
+                datadict, error = self._reader.datadict, None
+            except Exception as exc:
+                datadict, error = None, exc
+            self._reader.datadict = {}
+
+            with self._cond:
+                self._loading = None
+                if self._closed:
+                    self._cond.notify_all()
+                    return
+                if error is not None:
+                    self._errors[fnum] = error
+                else:
+                    nbytes = self._nbytes(datadict)
+                    self._ready[fnum] = (datadict, nbytes)
+                    self._ready_bytes += nbytes
+                    self._file_bytes = max(self._file_bytes, nbytes)
+                    self.stats["prefetched"] += 1
+                self._cond.notify_all()
+
+#---------------------------------------------------------------------------------------------------
+
+    def read_out_data(self, fnum):
+        """
+        Updates self.datadict with the data of file fnum, prefetched if possible.
+        """
+        rawdata_setting = self.instrumentloader.get_Loader_settings("rawdata")
+        with self._cond:
+            upcoming = (fnum == self._loading or (self._loading is None and len(self._scheduled) > 0
+                                                  and self._scheduled[0] == fnum and self._may_prefetch()))
+            if rawdata_setting and (fnum in self._ready or upcoming):
+                if fnum in self._ready:
+                    self.stats["hits"] += 1
+                else:
+                    self.stats["waits"] += 1
+                    start = time.perf_counter()
+                    while fnum not in self._ready and fnum not in self._errors and not self._closed:
+                        self._cond.wait()
+                    self.stats["wait_time"] += time.perf_counter() - start
+                datadict = self._take(fnum)
+            else:
+                datadict = None
+                if fnum in self._scheduled and rawdata_setting:
+                    self._scheduled.remove(fnum)
+                if fnum in self._errors:
+                    del self._errors[fnum]
+                self.stats["misses"] += 1
+
+        if datadict is None:
+            self.fileloader.read_out_data(fnum)
+            datadict, self.fileloader.datadict = self.fileloader.datadict, {}
+        self.datadict = datadict
+
+#---------------------------------------------------------------------------------------------------
+
+    def _take(self, fnum):
+        """
+        Removes fnum and all files read ahead of it from the prefetched files
+        and returns its datadict. Returns None if the background read of
+        fnum failed or the loader was closed, the file is then read directly.
+        """
+        self._errors.pop(fnum, None)
+        if fnum not in self._ready:
+            self.stats["misses"] += 1
+            return None
+        while True:
+            ready_fnum, (datadict, nbytes) = self._ready.popitem(last=False)
+            self._ready_bytes -= nbytes
+            if ready_fnum == fnum:
+                break
+            self.stats["discarded"] += 1
+        self._cond.notify_all()
+        return datadict
+
+#---------------------------------------------------------------------------------------------------
+
+    def close(self):
+        """
+        Stops the background thread and drops all prefetched files. Files
+        requested afterwards are read directly.
+        """
+        with self._cond:
+            self._closed = True
+            self._scheduled.clear()
+            self._ready.clear()
+            self._ready_bytes = 0
+            self._cond.notify_all()
+        self._thread.join()
 
 ####################################################################################################
 ####################################################################################################
@@ -4,10 +4,9 @@
 ####################        IMPORTS        ####################################
 ###############################################################################
 
-import matplotlib.pyplot as plt
-from matplotlib.cm import Greys
-from numpy import abs, arctan2, bool, deg2rad, float, nansum, reshape, sqrt, sum, ogrid, where, zeros
+from numpy import abs, arctan2, asarray, deg2rad, flatnonzero, nansum, reshape, sqrt, stack, sum, ogrid, where, zeros
 from math import pi
+from .profiling import timed
 
 ###############################################################################
 ###############################################################################
@@ -94,6 +93,43 @@ class Mask_Base:
         """
         return (self.nn,)*2
 
+#------------------------------------------------------------------------------
+
+    def weights(self):
+        """
+        Returns the mask as flat weight vector, e.g. for ROI sums by a
+        single dot product with data of shape (..., nn*nn).
+        --------------------------------------------------
+
+        Arguments:
+        ----------
+        self        :               :
+
+        Return:
+        ----------
+        weights     : ndarray   : mask values of shape (nn*nn,) as float
+        """
+
+        return asarray(self.mask, dtype = float).reshape(-1)
+
+#------------------------------------------------------------------------------
+
+    def pixel_indices(self):
+        """
+        Returns the flat indices of all pixels selected (non-zero) by the mask.
+        --------------------------------------------------
+
+        Arguments:
+        ----------
+        self        :               :
+
+        Return:
+        ----------
+        indices     : ndarray   : indices into data of shape (..., nn*nn)
+        """
+
+        return flatnonzero(self.mask)
+
 #------------------------------------------------------------------------------
 
     @staticmethod
@@ -135,6 +171,9 @@ class Mask_Base:
         None
         """
         
+        import matplotlib.pyplot as plt
+        from matplotlib.cm import Greys
+
         fig = plt.figure()
         ax = fig.add_subplot(111)
         ax.imshow(m_array, cmap = Greys, origin = 'lower')
@@ -144,6 +183,25 @@ class Mask_Base:
         return None
 
 
+#------------------------------------------------------------------------------
+
+def mask_matrix(masks):
+    """
+    Stacks masks to one weight matrix, such that the ROI sums of all masks
+    are a single matrix product with data of shape (..., nn*nn).
+    --------------------------------------------------
+
+    Arguments:
+    ----------
+    masks       : list      : Mask_Base objects or (nn, nn) mask arrays
+
+    Return:
+    ----------
+    matrix      : ndarray   : weights of shape (#masks, nn*nn)
+    """
+
+    return stack([m.weights() if isinstance(m, Mask_Base) else asarray(m, dtype = float).reshape(-1) for m in masks])
+
 ###############################################################################
 ###############################################################################
 
@@ -197,7 +255,7 @@ class Grid_mask(Mask_Base):
         None    : None  :
         """
         
-        ratio = self.nn/self.tile_size
+        ratio = self.nn//self.tile_size
         for i in range(ratio):
             for j in range(ratio):
                 self.mask[i*self.tile_size:(i + 1)*self.tile_size, j*self.tile_size:(j + 1)*self.tile_size] = i*ratio + j
@@ -248,6 +306,7 @@ class Grid_mask(Mask_Base):
 
 #------------------------------------------------------------------------------
 
+    @timed("Grid_mask._contract_data")
     def _contract_data(self, data):
         """
         Contracts the data set by applying the grid of the mask.
@@ -263,7 +322,7 @@ class Grid_mask(Mask_Base):
         contr_data  : ndarray   : contracted (summed for each tile) of shape (#xpixel/tile_size, #ypixel/tile_size)
         """
         
-        tiles_per_row = self.nn/self.tile_size
+        tiles_per_row = self.nn//self.tile_size
         contr_data = zeros(tiles_per_row*tiles_per_row)
         for i in range(tiles_per_row*tiles_per_row):
             mask_tile = where(self.mask == i, 1., 0.)
@@ -273,6 +332,7 @@ class Grid_mask(Mask_Base):
 
 #------------------------------------------------------------------------------
 
+    @timed("Grid_mask._expand_data")
     def _expand_data(self, data):
         """
         Expands data by if array dimensions fit to Grid_mask.
@@ -467,6 +527,7 @@ class Sector_Mask(Mask_Base):
 
 #------------------------------------------------------------------------------
 
+    @timed("Sector_Mask.apply_mask")
     def apply_mask(self, data, task = 'contract'):
         """
         Applies a given task to the supplied data.
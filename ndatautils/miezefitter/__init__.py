@@ -1 +1,14 @@
-from .dreduction import Reduction
\ No newline at end of file
+import importlib
+
+_SUBMODULES = ("dreduction", "model", "sinefit", "resultcache")
+
+def __getattr__(name):
+    if name == "Reduction":
+        from .dreduction import Reduction
+        return Reduction
+    if name in _SUBMODULES:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+def __dir__():
+    return sorted(set(globals()) | set(_SUBMODULES) | {"Reduction"})
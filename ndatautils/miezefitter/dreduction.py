@@ -1,11 +1,22 @@
 # -*- coding: utf-8 -*-
 
 ### Imports
+import os
+import copy
 import numpy as np
-import matplotlib.pyplot as plt
-from ..utils import sine, fit_beam_center
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from functools import partial
+from ..utils import sine, batch_fit_beam_center
+from ..uncertainty import UncertainArray
+from ..masks import Mask_Base, mask_matrix
+from ..fileloader import PrefetchLoader
+from ..profiling import timed
+from ..sharedstore import SharedArrayStore, attach, detach
+from .sinefit import LinearSineModel, clean_weights, fit_sine_linear, split_results
+from .model import sine_model, superimposed_sine_model
+from .resultcache import ResultCache, content_identity, file_identity
 from numpy import pi
-from lmfit import Model
+from numpy.lib import recfunctions
 ###
 
 def create_model(func, backend="lmfit"):
@@ -19,13 +30,18 @@ def create_model(func, backend="lmfit"):
 
     backend : str
         - lmfit: uses `lmfit´ package for fitting
+        - linear: closed-form weighted least squares with fixed omega,
+          only for the MIEZE sine (`func´ is ignored)
+        - native: batched Levenberg-Marquardt of `model.Model´, only for
+          the MIEZE sine (`func´ is ignored)
         - iminuit: uses `iminuit´ package for fitting
 
     Return
     ------
-    model   : lmfit.Model or iminuit.Minuit object
+    model   : lmfit.Model, sinefit.LinearSineModel, model.Model or iminuit.Minuit object
     """
     if backend.upper() == "LMFIT":
+        from lmfit import Model
         model = Model(func)
         model.set_param_hint("A", min=0.0)
         model.set_param_hint("omega", value=2*pi/16, vary=False)
@@ -33,6 +49,12 @@ def create_model(func, backend="lmfit"):
         model.set_param_hint("y0", min=0.0)
         return model
 
+    elif backend.upper() == "LINEAR":
+        return LinearSineModel(omega=2*pi/16)
+
+    elif backend.upper() == "NATIVE":
+        return sine_model()
+
     elif backend.upper() == "IMINUIT":
         raise NotImplementedError
 
@@ -66,6 +88,8 @@ def check_red_fit(redobj, lrbt, foil=0, ret=False):
     result = redobj.single_fit(np.arange(0,16), redobj.preped_data[foil], np.sqrt(redobj.preped_data[foil])**-1)
     params = [result["raw_fit_vals"][key] for key in ["A", "omega", "phi", "y0"]]
 
+    import matplotlib.pyplot as plt
+
     fig, ax = plt.subplots(figsize=(7.5,5))
     ax.errorbar(np.arange(0,16), redobj.preped_data[foil], np.sqrt(redobj.preped_data[foil]), ls="", marker="o", ms=7, color="C0", capsize=5,
                 label="C: {:.2f} $\pm$ {:.2f}".format(result["contrast"], result["contrast_err"]))
@@ -80,6 +104,323 @@ def check_red_fit(redobj, lrbt, foil=0, ret=False):
     if ret:
         return fig, ax
 
+#-----------------------------------------------------------------------------
+
+def single_sine_fit(model, backend, x, preped_data, weights, full_fit_res=False):
+    """
+    Fits a sine curve into a prepared data set.
+
+    Parameters
+    ----------
+    model : lmfit.Model, sinefit.LinearSineModel
+        model as returned by `create_model´
+    backend : str
+        backend the model was created for
+    x : numpy.ndarray
+        x-coordinate value
+    prepared_data : numpy.ndarray
+        one period of the time modulated neutron intensity
+    weights : numpy.ndarray
+        weights for the residuals in the chi square fit
+    full_fit_res : bool
+        returns the lmfit.ModelResult instead of the result_dict (lmfit only)
+
+    Return
+    ------
+    result_dict : dict
+        summarized information of the fit
+    """
+    result_dict = {}
+    if backend.upper() == "LMFIT":
+        
+        model.set_param_hint("A", min=0.0, value=(max(preped_data) - min(preped_data))/2.0)
+        model.set_param_hint("omega", value=2*pi/16, vary=False)
+        model.set_param_hint("phi", min=0.0, max=2*pi, value=((2 - np.argmax(preped_data) * 1/8 + 1/2)%2)*pi)
+        model.set_param_hint("y0", min=0.0, value=np.mean(preped_data))
+
+        weights = clean_weights(weights)
+        sfit_res = model.fit(x=x, data=preped_data, weights=weights)
+        
+        if full_fit_res: # Abbort if I detect a problem with calculating contrast or its error
+            return sfit_res
+
+        amp, offset = [UncertainArray(sfit_res.params[key].value,
+                                      error=np.nan if sfit_res.params[key].stderr is None else sfit_res.params[key].stderr)
+                       for key in ("A", "y0")]
+        contrast = amp / offset
+        result_dict["contrast"] = float(contrast.value)
+        result_dict["contrast_err"] = float(contrast.error)
+        result_dict["phase"] = sfit_res.params["phi"].value
+        result_dict["phase_err"] = sfit_res.params["phi"].stderr
+        result_dict["chisqr"] = sfit_res.chisqr
+        result_dict["redchi"] = sfit_res.redchi
+        result_dict["success"] = sfit_res.success
+        result_dict["raw_fit_vals"] = {"A" : sfit_res.params["A"].value,
+                                       "omega" : sfit_res.params["omega"].value,
+                                       "phi" : sfit_res.params["phi"].value,
+                                       "y0" : sfit_res.params["y0"].value
+                                       }
+        
+    elif backend.upper() == "LINEAR":
+        result_dict = split_results(model.fit(x, preped_data, weights))
+
+    elif backend.upper() == "NATIVE":
+        result_dict = split_results(native_sine_fit(model, x, preped_data, weights))
+
+    elif backend.lower() == "iminuit":
+        raise NotImplementedError
+
+    return result_dict
+
+#-----------------------------------------------------------------------------
+
+@timed("dreduction.batch_sine_fit")
+def batch_sine_fit(model, backend, x, preped_data, weights):
+    """
+    Fits a sine curve into every data set of a batch of prepared data.
+    The `linear´ and `native´ backends solve all fits in one call, other
+    backends run `single_sine_fit´ for each data set.
+
+    Parameters
+    ----------
+    model : lmfit.Model, sinefit.LinearSineModel
+        model as returned by `create_model´
+    backend : str
+        backend the model was created for
+    x : numpy.ndarray
+        x-coordinate value
+    preped_data : numpy.ndarray
+        data sets of shape (..., 16), e.g. (foils, 16) or (steps, 16)
+    weights : numpy.ndarray
+        weights for the residuals in the chi square fit, same shape as preped_data
+
+    Return
+    ------
+    results : list
+        nested list of result_dicts with the shape preped_data.shape[:-1]
+    """
+    if backend.upper() == "LINEAR":
+        return split_results(model.fit(x, preped_data, weights))
+    if backend.upper() == "NATIVE":
+        return split_results(native_sine_fit(model, x, preped_data, weights))
+
+    preped_data = np.asarray(preped_data)
+    weights = np.broadcast_to(weights, preped_data.shape)
+    results = np.empty(preped_data.shape[:-1], dtype=object)
+    for idx in np.ndindex(results.shape):
+        results[idx] = single_sine_fit(model, backend, x, preped_data[idx], weights[idx])
+    return results.tolist()
+
+#-----------------------------------------------------------------------------
+
+def native_sine_fit(model, x, preped_data, weights):
+    """
+    Fits the MIEZE sine with fixed omega into a batch of data sets of shape
+    (..., 16) with a `model.Model´. The start values are guessed as for the
+    lmfit backend.
+
+    Return
+    ------
+    result : dict
+        arrays of shape preped_data.shape[:-1] with the keys of the
+        result_dict of `single_sine_fit´
+    """
+    preped_data = np.asarray(preped_data, dtype=float)
+    p0 = {"A" : (preped_data.max(axis=-1) - preped_data.min(axis=-1))/2.0,
+          "phi" : ((2 - np.argmax(preped_data, axis=-1) * 1/8 + 1/2)%2)*pi,
+          "y0" : preped_data.mean(axis=-1)}
+    fit = model.fit(x, preped_data, p0, weights=weights, fixed={"omega" : 2*pi/16})
+    vals, errs = fit["params"], fit["stderr"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        contrast = UncertainArray(vals["A"], error=errs["A"]) / UncertainArray(vals["y0"], error=errs["y0"])
+
+    return {"contrast" : contrast.value,
+            "contrast_err" : contrast.error,
+            "phase" : vals["phi"],
+            "phase_err" : errs["phi"],
+            "chisqr" : fit["chisqr"],
+            "redchi" : fit["redchi"],
+            "success" : fit["success"],
+            "raw_fit_vals" : {key : vals[key] for key in ("A", "omega", "phi", "y0")}
+            }
+
+#-----------------------------------------------------------------------------
+
+@timed("dreduction.superimposed_sine_fit")
+def superimposed_sine_fit(x, preped_data, weights, omega=2*pi/16):
+    """
+    Joint fit of all foils y0_f * (1 + C * sin(omega * x + phi_f)) with one
+    contrast C shared by the foils, see `model.superimposed_sine_model´.
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        time bins of length L
+    preped_data : numpy.ndarray
+        data of shape (..., foils, L), e.g. (files, foils, 16). All leading
+        dimensions are fitted independently in one batched solve.
+    weights : numpy.ndarray
+        weights for the residuals, same shape as preped_data
+    omega : float
+        fixed angular frequency of the oscillation
+
+    Return
+    ------
+    result : dict
+        "contrast", "contrast_err", "chisqr", "redchi", "success" of shape
+        preped_data.shape[:-2] and "phase", "phase_err", "offset", "offset_err"
+        of shape preped_data.shape[:-1]
+
+    Notes
+    -----
+    The start values are the closed-form fits of the single foils.
+    """
+    preped_data = np.asarray(preped_data, dtype=float)
+    weights = np.broadcast_to(clean_weights(weights), preped_data.shape)
+    nfoils, npoints = preped_data.shape[-2:]
+
+    guess = fit_sine_linear(x, preped_data, weights, omega)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        contrast0 = UncertainArray(guess["contrast"], error=guess["contrast_err"]).weighted_mean(axis=-1).value
+    p0 = {"C" : np.nan_to_num(contrast0)}
+    for foil in range(nfoils):
+        p0["phi_{}".format(foil)] = np.nan_to_num(guess["phase"][..., foil])
+        p0["y0_{}".format(foil)] = np.where(guess["success"][..., foil], guess["raw_fit_vals"]["y0"][..., foil],
+                                            preped_data[..., foil, :].mean(axis=-1))
+
+    model = superimposed_sine_model(nfoils, npoints, omega)
+    fit = model.fit(np.tile(x, nfoils), preped_data.reshape(preped_data.shape[:-2] + (-1,)), p0,
+                    weights=weights.reshape(preped_data.shape[:-2] + (-1,)))
+    vals, errs = fit["params"], fit["stderr"]
+    per_foil = lambda res, name: np.stack([res["{}_{}".format(name, foil)] for foil in range(nfoils)], axis=-1)
+
+    return {"contrast" : vals["C"],
+            "contrast_err" : errs["C"],
+            "phase" : per_foil(vals, "phi") % (2*pi),
+            "phase_err" : per_foil(errs, "phi"),
+            "offset" : per_foil(vals, "y0"),
+            "offset_err" : per_foil(errs, "y0"),
+            "chisqr" : fit["chisqr"],
+            "redchi" : fit["redchi"],
+            "success" : fit["success"]
+            }
+
+#-----------------------------------------------------------------------------
+
+def superimposed_fit_dict(result, foils, omega=2*pi/16):
+    """
+    Converts the `superimposed_sine_fit´ result of one file to a fit_dict
+    {foil : result_dict} with the shared contrast in every result_dict.
+    """
+    fit_dict = {}
+    for idx, foil in enumerate(foils):
+        fit_dict[foil] = {
+            "contrast" : float(result["contrast"]),
+            "contrast_err" : float(result["contrast_err"]),
+            "phase" : float(result["phase"][idx]),
+            "phase_err" : float(result["phase_err"][idx]),
+            "chisqr" : float(result["chisqr"]),
+            "redchi" : float(result["redchi"]),
+            "success" : bool(result["success"]),
+            "superimposed" : True,
+            "raw_fit_vals" : {"A" : float(result["contrast"] * result["offset"][idx]),
+                              "omega" : omega,
+                              "phi" : float(result["phase"][idx]),
+                              "y0" : float(result["offset"][idx])
+                              }
+        }
+    return fit_dict
+
+#-----------------------------------------------------------------------------
+
+def backend_version(backend):
+    """
+    Version of the external fit package of a backend, part of the cache keys.
+    The native backends are versioned by resultcache.CACHE_VERSION.
+    """
+    if backend.upper() == "LMFIT":
+        import lmfit
+        return lmfit.__version__
+    return None
+
+#-----------------------------------------------------------------------------
+
+def bootstrap_seed_sequence(seed=None):
+    """
+    Returns a numpy.random.SeedSequence from which the random substreams
+    of a bootstrap reduction are spawned.
+
+    Parameters
+    ----------
+    seed : None, int, sequence, numpy.random.SeedSequence, numpy.random.Generator
+        None draws fresh entropy, a Generator is advanced to derive the entropy
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    if isinstance(seed, np.random.Generator):
+        return np.random.SeedSequence(seed.integers(2**63, size=4))
+    return np.random.SeedSequence(seed)
+
+#-----------------------------------------------------------------------------
+
+def bootstrap_chunk_contrasts(backend, preped_chunk):
+    """
+    Fits a chunk of bootstrap data sets of shape (n, 16). Module level
+    function, such that it can be sent to worker processes.
+
+    Return
+    ------
+    contrasts : numpy.ndarray
+        array of shape (n, 2) with contrast and contrast error per data set
+    """
+    model = create_model(sine, backend)
+    with np.errstate(divide="ignore"):
+        weights = np.sqrt(preped_chunk)**-1
+    results = batch_sine_fit(model, backend, np.arange(16), preped_chunk, weights)
+    return np.array([(resdict["contrast"], resdict["contrast_err"]) for resdict in results], dtype=float).reshape(-1, 2)
+
+#-----------------------------------------------------------------------------
+
+def bootstrap_precision(chunk_contrasts):
+    """
+    Weighted mean of bootstrap contrasts and the relative Monte Carlo
+    precision of this mean, estimated from the scatter of the chunk means.
+
+    Parameters
+    ----------
+    chunk_contrasts : list
+        (contrast, contrast_err) arrays of shape (n, 2), one per chunk of
+        random ROIs, NaN entries are ignored
+
+    Return
+    ------
+    mean_contrast : UncertainArray
+        inverse-variance weighted mean of all contrasts with error
+        1/sqrt(sum of weights)
+    rel_precision : float
+        standard error of the weighted chunk means relative to |mean|,
+        inf for less than two chunks
+
+    Notes
+    -----
+    The ROIs of a chunk overlap heavily, so their contrasts are strongly
+    correlated and their scatter underestimates the error of the mean.
+    The chunks draw their ROIs from independent random substreams, so their
+    means are independent samples of the ROI average. rel_precision measures
+    how well the average over random ROIs is converged, not the statistical
+    uncertainty of the contrast, which is given by the error of mean_contrast.
+    """
+    tempcontrasts = np.concatenate(chunk_contrasts)
+    mean_contrast = UncertainArray(tempcontrasts[:,0], error=tempcontrasts[:,1]).weighted_mean()
+    chunk_means = np.array([UncertainArray(contrasts[:,0], error=contrasts[:,1]).weighted_mean().value
+                            for contrasts in chunk_contrasts], dtype=float)
+    chunk_means = chunk_means[np.isfinite(chunk_means)]
+    if len(chunk_means) < 2:
+        return mean_contrast, float("inf")
+    std_err = np.std(chunk_means, ddof=1) / np.sqrt(len(chunk_means))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return mean_contrast, float(std_err / np.abs(mean_contrast.value))
+
 ####################################################################################################
 ####################################################################################################
 ####################################################################################################
@@ -89,7 +430,7 @@ class Reduction:
     
     """
 
-    def __init__(self, fileloader, filespecifier, backend="lmfit"):
+    def __init__(self, fileloader, filespecifier, backend="lmfit", load=True, cache=None):
         """
         Initializes a Reduction instance
         
@@ -102,7 +443,14 @@ class Reduction:
             integer value that specifies a certain ".tof" file for reduction
         backend : str
             - lmfit: uses `lmfit´ package for fitting
+            - linear: closed-form sine fit, all foils/ROIs in one numpy call
+            - native: batched Levenberg-Marquardt fit of `model.Model´
             - iminuit: uses `iminuit´ package for fitting
+        load : bool
+            reads the file immediately, otherwise the file is read on demand
+            by the first reduction
+        cache : resultcache.ResultCache, None
+            results of `run_reduction´ are looked up in and stored to the cache
 
         Return
         ------
@@ -117,41 +465,158 @@ class Reduction:
         self.relevant_foils = self.instrumentloader.get_Loader_settings("foils")
         self.backend = backend
         self.rawdata = None
+        self.shared = None
+        self.integral_image = None
+        self.metadata = None
         self.preped_data = None
         self.fit_dict = None
+        self.map_dict = None
+        self.cache = cache
         
-        self.get_data_from_file()
+        if load:
+            self.get_data_from_file()
         self.create_model()
 
 #---------------------------------------------------------------------------------------------------
 
     def get_data_from_file(self):
         """
-        
+        Reads the file and keeps the relevant foils of the raw data in
+        self.rawdata with shape (foils, 16, 128, 128) in the native (integer)
+        dtype of the file. The metadata of the file is kept in self.metadata.
+
+        Notes
+        -----
+        The loader's reference to the raw data is released, such that only one
+        buffer per file stays alive. If all foils are relevant the loaded array
+        is used without a copy, otherwise only the relevant foils are copied.
         """
         self.fileloader.read_out_data(self.filespecifier)
-        self.rawdata = np.zeros((len(self.relevant_foils), 16, 128, 128))
-        for idx, foilind in enumerate(self.relevant_foils):
-            self.rawdata[idx] = self.fileloader.datadict['rawdata'][foilind]
+        self.metadata = self.fileloader.datadict.get('metadata')
+        rawdata = self.fileloader.datadict.pop('rawdata')
+        foils = list(self.relevant_foils)
+        if foils == list(range(len(rawdata))):
+            self.rawdata = rawdata
+        else:
+            self.rawdata = rawdata[foils]
+        del rawdata
+        self.integral_image = None
+
+#---------------------------------------------------------------------------------------------------
+
+    def release_data(self):
+        """
+        Drops the raw data and the summed-area table. Results (fit_dict,
+        map_dict, preped_data) are kept. Reductions run afterwards re-load
+        the file on demand. A shared memory block of `load_shared´ is
+        detached in this process, but only unlinked by its store.
+        """
+        self.rawdata = None
+        self.integral_image = None
+        if self.shared is not None:
+            detach(self.shared)
+            self.shared = None
+
+#---------------------------------------------------------------------------------------------------
+
+    def compact_metadata(self, keys):
+        """
+        Keeps only the entries of self.metadata with a subkey in keys, e.g.
+        the param_keys of `ReductionStructure.analyze´. Sections without such
+        an entry are dropped.
+        """
+        if self.metadata is None:
+            return
+        keys = set(keys)
+        compacted = {}
+        for section, entries in self.metadata.items():
+            if isinstance(entries, dict):
+                kept = {key : val for key, val in entries.items() if key in keys}
+                if kept:
+                    compacted[section] = kept
+        self.metadata = compacted
+
+#---------------------------------------------------------------------------------------------------
+
+    def require_data(self):
+        """
+        Loads the file if self.rawdata was not loaded yet or was released.
+        """
+        if self.rawdata is None:
+            self.get_data_from_file()
+
+#---------------------------------------------------------------------------------------------------
+
+    def get_metadata(self):
+        """
+        Returns self.metadata. Only if the file was never loaded, its
+        metadata is read without the raw data.
+        """
+        if self.metadata is None:
+            instrumentloader = self.fileloader.instrumentloader
+            rawdata_setting = instrumentloader.get_Loader_settings("rawdata")
+            instrumentloader.set_Loader_settings(rawdata=False)
+            try:
+                self.fileloader.read_out_data(self.filespecifier)
+                self.metadata = self.fileloader.datadict.get('metadata')
+            finally:
+                instrumentloader.set_Loader_settings(rawdata=rawdata_setting)
+        return self.metadata
 
 #---------------------------------------------------------------------------------------------------
 
     def create_model(self):
         """
-        Creates a lmfit.Model or iminuit.Minuit object to fit the MIEZE signal.
+        Creates the model of the selected backend to fit the MIEZE signal.
 
         Parameters
         ----------
         self.backend : str
             - lmfit: uses `lmfit´ package for fitting
+            - linear: closed-form sine fit with fixed omega
+            - native: batched Levenberg-Marquardt fit of `model.Model´
             - iminuit: uses `iminuit´ package for fitting
 
         Notes
         -----
-        Only `lmfit´ works as a backend for fitting.
+        Only `lmfit´, `linear´ and `native´ work as a backend for fitting.
         """
         self.model = create_model(sine, self.backend)
 
+#---------------------------------------------------------------------------------------------------
+
+    def load_shared(self, store):
+        """
+        Reads the relevant foils of the raw data directly into a block of a
+        sharedstore.SharedArrayStore. Pickled copies of the Reduction (e.g.
+        sent to worker processes) carry only the block's handle and attach
+        to the block instead of copying the raw data.
+
+        Parameters
+        ----------
+        store : sharedstore.SharedArrayStore
+            owner of the block, which is unlinked by store.release(self.shared)
+        """
+        self.shared, self.rawdata = store.load_cube(self.fileloader, self.filespecifier, foils=self.relevant_foils)
+        self.integral_image = None
+
+#---------------------------------------------------------------------------------------------------
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.shared is not None:
+            state["rawdata"] = None
+            state["integral_image"] = None
+        state["fileloader"] = detached_loader(self.fileloader)
+        state.pop("model", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.shared is not None:
+            self.rawdata = attach(self.shared)
+        self.create_model()
+
 #---------------------------------------------------------------------------------------------------
 #
 #    def set_model_params(self):
@@ -161,6 +626,67 @@ class Reduction:
 #
 #---------------------------------------------------------------------------------------------------
 
+    def build_integral_image(self):
+        """
+        Builds the summed-area table of self.rawdata, i.e. the cumulative sums
+        over both detector axes with a leading row and column of zeros.
+        Populates self.integral_image with shape (foils, 16, 129, 129).
+        Integer data is summed in int32 if the counts per foil and time bin
+        allow it, in int64 otherwise.
+        """
+        if not np.issubdtype(self.rawdata.dtype, np.integer):
+            dtype = float
+        elif self.rawdata.sum(axis=(-2, -1), dtype=np.int64).max() < np.iinfo(np.int32).max:
+            dtype = np.int32
+        else:
+            dtype = np.int64
+        nfoils, ntimes, ny, nx = self.rawdata.shape
+        self.integral_image = np.zeros((nfoils, ntimes, ny + 1, nx + 1), dtype=dtype)
+        np.cumsum(self.rawdata, axis=-2, dtype=dtype, out=self.integral_image[:, :, 1:, 1:])
+        np.cumsum(self.integral_image[:, :, 1:, 1:], axis=-1, out=self.integral_image[:, :, 1:, 1:])
+        return self.integral_image
+
+#---------------------------------------------------------------------------------------------------
+
+    def roi_sums(self, lrbt):
+        """
+        Sums the counts of rectangular ROIs for all foils and time bins with
+        four lookups per ROI in the summed-area table (built on first use).
+
+        Parameters
+        ----------
+        lrbt : numpy.ndarray, list
+            [left, right, bottom, top] of one ROI or an array of shape (..., 4)
+            for a batch of ROIs. Bounds follow python slice semantics, i.e.
+            rawdata[..., bottom:top, left:right].
+
+        Return
+        ------
+        sums : numpy.ndarray
+            ROI sums of shape (..., foils, 16)
+        """
+        if self.integral_image is None:
+            self.require_data()
+            self.build_integral_image()
+
+        lrbt = np.asarray(lrbt, dtype=int)
+        ny, nx = self.rawdata.shape[-2:]
+
+        def slice_bounds(start, stop, length):
+            start = np.clip(np.where(start < 0, start + length, start), 0, length)
+            stop = np.clip(np.where(stop < 0, stop + length, stop), 0, length)
+            return start, np.maximum(start, stop)
+
+        left, right = slice_bounds(lrbt[..., 0], lrbt[..., 1], nx)
+        bottom, top = slice_bounds(lrbt[..., 2], lrbt[..., 3], ny)
+
+        sat = self.integral_image
+        sums = sat[:, :, top, right] - sat[:, :, bottom, right] - sat[:, :, top, left] + sat[:, :, bottom, left]
+        return np.moveaxis(sums, (0, 1), (-2, -1))
+
+#---------------------------------------------------------------------------------------------------
+
+    @timed("Reduction.prepare_fit_data")
     def prepare_fit_data(self, lbwh=None, lrbt=None, pre_mask=None):
         """
         Prepare the raw data for fit by summing counts in ROI.
@@ -173,22 +699,76 @@ class Reduction:
         lrbt : [left, right, bottom, top], None
             integer values in 128x128 to specify ROI
         pre_mask : pre_mask object or numpy.ndarray
-            mask/mask-array that specifies a ROI
+            mask/mask-array that specifies a ROI, see `mask_sums´
+
+        Notes
+        -----
+        Rectangular ROIs are summed with the summed-area table, see `roi_sums´,
+        masks by a single product with their weight vector, see `mask_sums´.
         """
-        self.preped_data = np.zeros(self.rawdata.shape[:2])
-        if (bool(lbwh), bool(lrbt), bool(pre_mask)) == (True, False, False):
+        self.require_data()
+        rois = {"lbwh" : lbwh, "lrbt" : lrbt, "pre_mask" : pre_mask}
+        given = [key for key, roi in rois.items() if roi is not None]
+        if given == ["lbwh"]:
             left, bottom, width, height = lbwh
-            self.preped_data = np.sum(np.sum(self.rawdata[:,:,:,left:left+width], axis=-1)[:,:,bottom:bottom+height], axis=-1)
-        elif (bool(lbwh), bool(lrbt), bool(pre_mask)) == (False, True, False):
-            left, right, bottom, top = lrbt
-            self.preped_data = np.sum(np.sum(self.rawdata[:,:,:,left:right], axis=-1)[:,:,bottom:top], axis=-1)
-        elif (bool(lbwh), bool(lrbt), bool(pre_mask)) == (False, False, True):
-            raise NotImplementedError
+            self.preped_data = self.roi_sums([left, left+width, bottom, bottom+height])
+        elif given == ["lrbt"]:
+            self.preped_data = self.roi_sums(lrbt)
+        elif given == ["pre_mask"]:
+            self.preped_data = self.mask_sums(pre_mask)
+        else:
+            raise ValueError("Preparation of fitting data failed. Exactly one ROI specification required.")
+
+#---------------------------------------------------------------------------------------------------
+
+    @timed("Reduction.mask_sums")
+    def mask_sums(self, pre_mask):
+        """
+        Sums the counts of every foil and time bin weighted by a mask.
+
+        Parameters
+        ----------
+        pre_mask : masks.Mask_Base, list, numpy.ndarray
+            a mask object (e.g. masks.Sector_Mask, masks.Square_Mask), a list
+            of them, mask arrays of shape (..., 128, 128) or weight vectors of
+            shape (..., 128*128) as returned by `masks.mask_matrix´
+
+        Return
+        ------
+        sums : numpy.ndarray
+            ROI sums of shape (foils, 16) for a single mask and
+            (masks, foils, 16) for a stack of masks
+
+        Notes
+        -----
+        A single 0/1 mask sums its selected pixels as exact integers for
+        integer raw data. Weighted and stacked masks are one matrix product of the
+        weight matrix with the flattened detector images.
+        """
+        self.require_data()
+        npix = self.rawdata.shape[-2] * self.rawdata.shape[-1]
+        if isinstance(pre_mask, Mask_Base):
+            weights = pre_mask.weights()
+        elif isinstance(pre_mask, (list, tuple)):
+            weights = mask_matrix(pre_mask)
         else:
-            raise ValueError("Preparation of fitting data failed. ROI specification required.")
+            weights = np.asarray(pre_mask, dtype=float)
+            if weights.shape[-1] != npix:
+                weights = weights.reshape(weights.shape[:-2] + (npix,))
+
+        flat = self.rawdata.reshape(self.rawdata.shape[:-2] + (npix,))
+        if weights.ndim == 1:
+            pixels = np.flatnonzero(weights)
+            if np.all(weights[pixels] == 1.0):
+                return flat[..., pixels].sum(axis=-1)
+            return flat[..., pixels] @ weights[pixels]
+        stacked = weights.reshape(-1, npix)
+        sums = np.tensordot(stacked, flat, axes=([1], [2]))
+        return sums.reshape(weights.shape[:-1] + flat.shape[:-1])
 
 #---------------------------------------------------------------------------------------------------
 
+    @timed("Reduction.single_fit")
     def single_fit(self, x, preped_data, weights, full_fit_res=False):
         """
         Fits a sine curve into a prepared data set.
@@ -207,41 +787,31 @@ class Reduction:
         result_dict : dict
             summarized information of the fit
         """
-        result_dict = {}
-        if self.backend.upper() == "LMFIT":
-            
-            self.model.set_param_hint("A", min=0.0, value=(max(preped_data) - min(preped_data))/2.0)
-            self.model.set_param_hint("omega", value=2*pi/16, vary=False)
-            self.model.set_param_hint("phi", min=0.0, max=2*pi, value=((2 - np.argmax(preped_data) * 1/8 + 1/2)%2)*pi)
-            self.model.set_param_hint("y0", min=0.0, value=np.mean(preped_data))
-
-            weights = np.where(np.isnan(weights), np.zeros(len(weights)), weights)
-            weights = np.where(np.isinf(weights), np.zeros(len(weights)), weights)
-            sfit_res = self.model.fit(x=x, data=preped_data, weights=weights)
-            
-            if full_fit_res: # Abbort if I detect a problem with calculating contrast or its error
-                return sfit_res
-
-            result_dict["contrast"] = sfit_res.params["A"].value / sfit_res.params["y0"].value
-            try:
-                result_dict["contrast_err"] = result_dict["contrast"] * np.sqrt((sfit_res.params["A"].stderr/sfit_res.params["A"].value)**2 + (sfit_res.params["y0"].stderr/sfit_res.params["y0"].value)**2)
-            except TypeError:
-                result_dict["contrast_err"] = np.nan
-            result_dict["phase"] = sfit_res.params["phi"].value
-            result_dict["phase_err"] = sfit_res.params["phi"].stderr
-            result_dict["chisqr"] = sfit_res.chisqr
-            result_dict["redchi"] = sfit_res.redchi
-            result_dict["success"] = sfit_res.success
-            result_dict["raw_fit_vals"] = {"A" : sfit_res.params["A"].value,
-                                           "omega" : sfit_res.params["omega"].value,
-                                           "phi" : sfit_res.params["phi"].value,
-                                           "y0" : sfit_res.params["y0"].value
-                                           }
-            
-        elif self.backend.lower() == "iminuit":
-            raise NotImplementedError
-
-        return result_dict
+        return single_sine_fit(self.model, self.backend, x, preped_data, weights, full_fit_res)
+
+#---------------------------------------------------------------------------------------------------
+
+    def batch_fit(self, x, preped_data, weights):
+        """
+        Fits a sine curve into every data set of a batch of prepared data.
+        The `linear´ backend solves all fits in one call, other backends
+        run `single_fit´ for each data set.
+
+        Parameters
+        ----------
+        x : numpy.ndarray
+            x-coordinate value
+        preped_data : numpy.ndarray
+            data sets of shape (..., 16), e.g. (foils, 16) or (steps, 16)
+        weights : numpy.ndarray
+            weights for the residuals in the chi square fit, same shape as preped_data
+
+        Return
+        ------
+        results : list
+            nested list of result_dicts (see `single_fit´) with the shape preped_data.shape[:-1]
+        """
+        return batch_sine_fit(self.model, self.backend, x, preped_data, weights)
 
 #---------------------------------------------------------------------------------------------------
 
@@ -256,16 +826,107 @@ class Reduction:
 
         Return
         ------
+
+        Notes
+        -----
+        With self.cache the results are looked up before the file is read
+        and fitted, see `cache_key´.
         """
+        key = None if self.cache is None else self.cache_key(job, kwargs)
+        if key is not None and self.restore_cached(key):
+            return
+
+        self.require_data()
         if job.lower() == "simple_fit":
             self.run_fits(**kwargs)
         elif job.lower() == "bootstrap":
             self.run_bootstrap_fit(**kwargs)
+        elif job.lower() == "pixel_maps":
+            self.run_pixel_maps(**kwargs)
         elif job.lower() == "superimposed_fitting":
-            raise NotImplementedError
+            self.run_superimposed_fit(**kwargs)
         else:
             raise KeyError("The execution of the requested job failed. Job specifier not known.")
 
+        if key is not None:
+            self.store_cached(key, job)
+
+#---------------------------------------------------------------------------------------------------
+
+    def cache_key(self, job, kwargs, load=True):
+        """
+        Key of the results of run_reduction(job, **kwargs) in self.cache.
+
+        The file is identified by path, size and modification time if the
+        fileloader's datapath points to it, by a digest of the raw data
+        otherwise. The key further contains the relevant foils, the job, its
+        parameters (ROI, mask, seed, ...), the backend and its version.
+
+        Parameters
+        ----------
+        job : str
+            reduction job, see `run_reduction´
+        kwargs : dict
+            parameters of the job. "workers" and "executor" do not change
+            the results and are ignored.
+        load : bool
+            allows to read the file for the digest of the raw data
+
+        Return
+        ------
+        key : str, None
+            None if the results are not reproducible (bootstrap without
+            seed or with a Generator as seed) or the file can not be
+            identified without loading it.
+        """
+        if job.lower() == "bootstrap" and (kwargs.get("seed") is None or isinstance(kwargs["seed"], np.random.Generator)):
+            return None
+
+        try:
+            identity = file_identity(self.fileloader.datapath(self.filespecifier))
+        except Exception:
+            identity = None
+        if identity is None:
+            if not load:
+                return None
+            self.require_data()
+            identity = content_identity(self.rawdata)
+
+        params = {key : val for key, val in kwargs.items() if key not in ("workers", "executor")}
+        try:
+            return ResultCache.make_key(identity, list(self.relevant_foils), job.lower(), params,
+                                        self.backend.lower(), backend_version(self.backend))
+        except TypeError:
+            return None
+
+#---------------------------------------------------------------------------------------------------
+
+    def restore_cached(self, key):
+        """
+        Restores the results stored under key in self.cache.
+        Returns True on a hit, False otherwise.
+        """
+        entry = self.cache.get(key)
+        if entry is None:
+            return False
+        for attr, val in entry.items():
+            if attr != "metadata" or self.metadata is None:
+                setattr(self, attr, val)
+        return True
+
+#---------------------------------------------------------------------------------------------------
+
+    def store_cached(self, key, job):
+        """
+        Stores the results of job and the metadata under key in self.cache.
+        """
+        entry = {"metadata" : self.metadata}
+        if job.lower() == "pixel_maps":
+            entry["map_dict"] = self.map_dict
+        else:
+            entry["fit_dict"] = self.fit_dict
+        self.cache.put(key, entry)
+
 #---------------------------------------------------------------------------------------------------
 
     def run_fits(self, **kwargs):
@@ -280,8 +941,31 @@ class Reduction:
             ROI specified as [left, bottom, width, height]
         lrbt        : list
             ROI specified as [left, right, bottom, top]
-        pre_maks    :
-            ROI specified as numpy.ndarray
+        pre_mask    : masks.Mask_Base, numpy.ndarray
+            ROI specified as single mask, see `mask_sums´
+        """
+        self.prepare_roi_data(**kwargs)
+        self.fit_preped_data()
+
+#---------------------------------------------------------------------------------------------------
+
+    @timed("Reduction.fit_preped_data")
+    def fit_preped_data(self):
+        """
+        Fits every foil of self.preped_data and populates self.fit_dict.
+        Does not need the raw data.
+        """
+        with np.errstate(divide="ignore"):
+            weights = np.sqrt(self.preped_data)**-1
+        results = self.batch_fit(np.arange(16), self.preped_data, weights)
+        self.fit_dict = dict(zip(self.relevant_foils, results))
+
+#---------------------------------------------------------------------------------------------------
+
+    def prepare_roi_data(self, **kwargs):
+        """
+        `prepare_fit_data´ for the ROI given in kwargs (lrbt, lbwh or pre_mask).
+        Without ROI a 9x9 pixel area near the fitted beam center is used.
         """
         kwargs_dict = {
             "lrbt" : None,
@@ -290,89 +974,548 @@ class Reduction:
         }
         kwargs_dict.update(kwargs)
 
-        if not any(kwargs_dict.values()):
-            center = fit_beam_center(np.sum(np.sum(self.rawdata, axis=0), axis=0))
+        if all(roi is None for roi in kwargs_dict.values()):
+            self.require_data()
+            center = batch_fit_beam_center(self.rawdata[None])[0]
             kwargs_dict["lrbt"] = [int(center[1])-4 - 3, int(center[1])+5 - 3, int(center[0])-4, int(center[0])+5]
 
         self.prepare_fit_data(**kwargs_dict)
-        self.fit_dict = {}
-        for idx, foilind in enumerate(self.relevant_foils):
-            self.fit_dict[foilind] = self.single_fit(list(range(16)), self.preped_data[idx], np.sqrt(self.preped_data[idx])**-1)
 
 #---------------------------------------------------------------------------------------------------
 
+    def run_superimposed_fit(self, **kwargs):
+        """
+        Joint sine fit of all relevant foils in a ROI with one shared
+        contrast and a phase and offset per foil, see `superimposed_sine_fit´.
+        The ROI is specified as in `run_fits´. Every foil's entry of
+        self.fit_dict holds the shared contrast and its own phase.
+        """
+        self.prepare_roi_data(**kwargs)
+        with np.errstate(divide="ignore"):
+            weights = np.sqrt(self.preped_data)**-1
+        result = superimposed_sine_fit(np.arange(16), self.preped_data, weights)
+        self.fit_dict = superimposed_fit_dict(result, self.relevant_foils)
+
+#---------------------------------------------------------------------------------------------------
+
+    @timed("Reduction.run_bootstrap_fit")
     def run_bootstrap_fit(self, **kwargs):
         """
+        Bootstrap estimate of the contrast. Fits the first relevant foil for
+        `steps´ randomly sized rectangular ROIs around the beam center and
+        averages the contrasts weighted by their errors. The ROI closest to
+        the average is fitted for all foils and populates self.fit_dict.
 
+        Parameters
+        ----------
+        center      : float
+            mean distance of the ROI edges from the beam center in pixel
+        sigma       : float
+            standard deviation of the ROI edge distances in pixel
+        steps       : int
+            number of random ROIs
+        seed        : None, int, numpy.random.SeedSequence, numpy.random.Generator
+            seed of the random ROIs. Equal seeds give identical results,
+            independent of the number of workers.
+        workers     : int, None
+            number of parallel workers fitting chunks of the random ROIs,
+            None uses all available cores
+        executor    : None, str
+            "process" or "thread" pool, defaults to threads for the
+            numpy based `linear´ backend and to processes otherwise
+        chunk_size  : int
+            number of ROIs per chunk, each chunk draws its ROIs from an
+            independent random substream
+        rel_precision : None, float
+            adaptive mode: chunks are fitted in order until the Monte Carlo
+            precision of the weighted mean contrast relative to the mean (see
+            `bootstrap_precision´) drops below rel_precision, `steps´ is the
+            upper limit then. None fits all steps.
+        min_steps   : None, int
+            minimal number of ROIs fitted in adaptive mode, two chunks if None
+
+        Notes
+        -----
+        The "bootstrap" entry of the results reports the number of fitted ROIs
+        ("steps"), the limit ("max_steps"), the reached relative precision and
+        whether the target precision was reached ("converged").
         """
         bootstrap_pars = {
             "center" : 10,
             "sigma" : 5,
-            "steps" : 1000
+            "steps" : 1000,
+            "seed" : None,
+            "workers" : 1,
+            "executor" : None,
+            "chunk_size" : 100,
+            "rel_precision" : None,
+            "min_steps" : None
         }
         bootstrap_pars.update(kwargs)
         self.fit_dict = {}
 
-        ### Generate some random number ROIs
-        randn_lrbt = np.abs(
-            np.random.normal(
-                bootstrap_pars["center"],
-                bootstrap_pars["sigma"],
-                (bootstrap_pars["steps"], 4)
-            ).astype(int)
-        )
+        ### Generate some random number ROIs, one random substream per chunk
+        seedseq = bootstrap_seed_sequence(bootstrap_pars["seed"])
+        steps, chunk_size = bootstrap_pars["steps"], bootstrap_pars["chunk_size"]
+        chunk_steps = [min(chunk_size, steps - start) for start in range(0, steps, chunk_size)]
+        randn_lrbt = np.concatenate([
+            np.abs(
+                np.random.default_rng(subseq).normal(
+                    bootstrap_pars["center"],
+                    bootstrap_pars["sigma"],
+                    (nsteps, 4)
+                ).astype(int)
+            ) for subseq, nsteps in zip(seedseq.spawn(len(chunk_steps)), chunk_steps)
+        ])
 
         ### Compute beam center on detector
-        center = fit_beam_center(self.rawdata.sum(axis=0).sum(axis=0))
+        center = tuple(batch_fit_beam_center(self.rawdata[None])[0])
 
-        ### Bootstrap method
-        tempcontrasts = np.zeros((bootstrap_pars["steps"], 2))
+        ### Bootstrap method, the ROI sums are computed per chunk
+        center_lrbt = np.array([int(center[1]), int(center[1]), int(center[0]), int(center[0])])
+        chunk_lrbts = np.split(center_lrbt + randn_lrbt * np.array([-1, 1, -1, 1]), np.cumsum(chunk_steps)[:-1])
+        min_steps = 2 * chunk_size if bootstrap_pars["min_steps"] is None else bootstrap_pars["min_steps"]
+        chunk_contrasts, converged = self._bootstrap_contrasts(chunk_lrbts, bootstrap_pars["workers"], bootstrap_pars["executor"],
+                                                               bootstrap_pars["rel_precision"], min_steps)
 
-        for i, (a, b, c, d) in enumerate(randn_lrbt):
-            lrbt = [int(center[1]) - a, int(center[1]) + b, int(center[0]) - c, int(center[0]) + d]
-            self.prepare_fit_data(lrbt=lrbt)
-            resdict = self.single_fit(list(range(16)), self.preped_data[0], np.sqrt(self.preped_data[0])**-1)
-            tempcontrasts[i] = resdict["contrast"], resdict["contrast_err"]
-        
         ### Average over contrast values
-        nanidxs = np.where(~np.isnan(tempcontrasts).any(axis=1))[0]
-        contrast = np.average(tempcontrasts[nanidxs,0], weights=tempcontrasts[nanidxs,1]**-2)
-        contrast_err = ((tempcontrasts[nanidxs,1]**-2).sum())**-0.5
+        mean_contrast, rel_precision = bootstrap_precision(chunk_contrasts)
+        tempcontrasts = np.concatenate(chunk_contrasts)
+        contrast, contrast_err = float(mean_contrast.value), float(mean_contrast.error)
         reprind = np.argmin(np.abs(np.where(np.isnan(tempcontrasts[:,0]), np.zeros(len(tempcontrasts)), tempcontrasts[:,0]) - contrast))
 
         ### Run fit for the best lrbt combination and update with bootstrap params
         a, b, c, d = randn_lrbt[reprind]
         lrbt = [int(center[1]) - a, int(center[1]) + b, int(center[0]) - c, int(center[0]) + d]
         self.prepare_fit_data(lrbt=lrbt)
-        for idx, foilind in enumerate(self.relevant_foils):
-            resdict = self.single_fit(list(range(16)), self.preped_data[idx], np.sqrt(self.preped_data[idx])**-1)
+        with np.errstate(divide="ignore"):
+            weights = np.sqrt(self.preped_data)**-1
+        results = self.batch_fit(np.arange(16), self.preped_data, weights)
+        for foilind, resdict in zip(self.relevant_foils, results):
             resdict.update({"bootstrap" : dict(
                 contrast=contrast,
                 contrast_err=contrast_err,
                 center=center,
                 lrbt=lrbt,
-                steps=bootstrap_pars["steps"]
+                steps=len(tempcontrasts),
+                max_steps=bootstrap_pars["steps"],
+                rel_precision=rel_precision,
+                converged=converged,
+                seed=seedseq.entropy
             )})
             self.fit_dict[foilind] = resdict
 
+#---------------------------------------------------------------------------------------------------
+
+    def _bootstrap_contrasts(self, chunk_lrbts, workers=1, executor=None, rel_precision=None, min_steps=0):
+        """
+        Sums and fits the chunks of bootstrap ROIs in order, in parallel if
+        workers > 1. The ROI sums of the first relevant foil are computed
+        per group of chunks right before the group is fitted. With a
+        rel_precision the fitting stops after the first chunk at which the
+        target precision is reached. Chunks fitted ahead by other workers are
+        discarded, so the result does not depend on the number of workers.
+
+        Return
+        ------
+        chunk_contrasts : list
+            (contrast, contrast_err) arrays of shape (chunk steps, 2) of the
+            fitted chunks
+        converged : bool
+            True if rel_precision was given and reached
+        """
+        fit_chunk = partial(bootstrap_chunk_contrasts, self.backend)
+        pool, group_size = None, len(chunk_lrbts)
+        if workers is None or workers > 1:
+            if executor is None:
+                executor = "thread" if self.backend.upper() == "LINEAR" else "process"
+            pool = {"PROCESS" : ProcessPoolExecutor, "THREAD" : ThreadPoolExecutor}[executor.upper()](max_workers=workers)
+            if rel_precision is not None:
+                group_size = workers or os.cpu_count()
+        elif rel_precision is not None:
+            group_size = 1
+
+        fitted, nfitted = [], 0
+        try:
+            for start in range(0, len(chunk_lrbts), group_size):
+                group = [self.roi_sums(lrbts)[:, 0] for lrbts in chunk_lrbts[start:start + group_size]]
+                for contrasts in (map(fit_chunk, group) if pool is None else pool.map(fit_chunk, group)):
+                    fitted.append(contrasts)
+                    nfitted += len(contrasts)
+                    if (rel_precision is not None and nfitted >= min_steps
+                            and bootstrap_precision(fitted)[1] <= rel_precision):
+                        return fitted, True
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+        return fitted, False
+
+#---------------------------------------------------------------------------------------------------
+
+    def run_pixel_maps(self, tile_size=None, grid_mask=None):
+        """
+        Computes contrast, phase, mean intensity and their uncertainties for
+        every pixel (or every tile of a grid) and all relevant foils in one
+        vectorized closed-form sine fit, independent of self.backend.
+        Populates self.map_dict with arrays of shape (foils, 128, 128).
+
+        Parameters
+        ----------
+        tile_size : int, None
+            sums quadratic tiles of tile_size x tile_size pixels before fitting
+        grid_mask : masks.Grid_mask, None
+            alternative to tile_size, its tile_size is used
+
+        Notes
+        -----
+        Results of a tile are assigned to every pixel of the tile. Pixels or tiles
+        with too few counts for a fit are NaN, "success" is False there.
+        """
+        if grid_mask is not None:
+            tile_size = grid_mask.tile_size
+        tile_size = 1 if tile_size is None else int(tile_size)
+
+        nfoils, ntimes, ny, nx = self.rawdata.shape
+        if ny % tile_size or nx % tile_size:
+            raise ValueError("tile_size {} is not a divisor of the detector size {}x{}.".format(tile_size, ny, nx))
+
+        tiles = self.rawdata.reshape(nfoils, ntimes, ny // tile_size, tile_size, nx // tile_size, tile_size).sum(axis=(3, 5))
+        tiles = np.moveaxis(tiles, 1, -1).astype(float)
+        with np.errstate(divide="ignore"):
+            result = fit_sine_linear(np.arange(ntimes), tiles, tiles**-0.5)
+
+        expand = lambda arr: np.repeat(np.repeat(arr, tile_size, axis=-2), tile_size, axis=-1)
+        self.map_dict = {
+            "contrast" : expand(result["contrast"]),
+            "contrast_err" : expand(result["contrast_err"]),
+            "phase" : expand(result["phase"]),
+            "phase_err" : expand(result["phase_err"]),
+            "mean" : expand(result["raw_fit_vals"]["y0"]),
+            "mean_err" : expand(result["raw_fit_errs"]["y0"]),
+            "redchi" : expand(result["redchi"]),
+            "success" : expand(result["success"]),
+            "foils" : tuple(self.relevant_foils),
+            "tile_size" : tile_size,
+        }
+
+##############################################################################
+##############################################################################
+##############################################################################
+
+def reduce_file(fileloader, filespecifier, backend, red_method, red_params, cache=None):
+    """
+    Loads and reduces a single file. Module level function, such that
+    ReductionStructure can run it in worker processes. With a
+    resultcache.ResultCache the file is only loaded if its results
+    are not cached.
+
+    Return
+    ------
+    fit_dict : dict
+        Reduction.fit_dict of the file
+    metadata : dict
+        Reduction.metadata of the file
+    """
+    redobj = Reduction(fileloader, filespecifier, backend=backend, load=False, cache=cache)
+    redobj.run_reduction(job=red_method, **red_params)
+    return redobj.fit_dict, redobj.metadata
+
+#-----------------------------------------------------------------------------
+
+def reduce_shared(redobj, red_method, red_params):
+    """
+    Reduces a Reduction, whose raw data was loaded by `Reduction.load_shared´,
+    in a worker process. The unpickled redobj is attached to the shared
+    memory block, which is detached again when the reduction finished.
+
+    Return
+    ------
+    fit_dict, map_dict, metadata : dict
+        results of the reduction and the metadata of the file
+    """
+    try:
+        redobj.run_reduction(job=red_method, **red_params)
+        return redobj.fit_dict, redobj.map_dict, redobj.get_metadata()
+    finally:
+        redobj.release_data()
+
+#-----------------------------------------------------------------------------
+
+def detached_loader(fileloader):
+    """
+    Returns a shallow copy of a file loader with an empty datadict, which is
+    cheap to send to a worker process. A PrefetchLoader is replaced by (a copy
+    of) the loader it wraps.
+    """
+    if isinstance(fileloader, PrefetchLoader):
+        fileloader = fileloader.fileloader
+    loader = copy.copy(fileloader)
+    loader.datadict = {}
+    return loader
+
+#-----------------------------------------------------------------------------
+
+def mean_foil_positions(relevant_foils, instrumentloader=None):
+    """
+    Positions in relevant_foils of the foils entering the weighted mean
+    contrast: the foils of the "mean_foils" loader setting (foil numbers,
+    e.g. InstrumentLoader(foils=(0, 1, 2, 3), mean_foils=(0, 2, 3))) if
+    given. Otherwise all but the second of four foils, as in the RESEDA
+    analysis, and all foils for any other number of foils.
+    """
+    relevant_foils = list(relevant_foils)
+    settings = {} if instrumentloader is None else instrumentloader.instance_dict
+    if settings.get("mean_foils") is not None:
+        return [relevant_foils.index(foil) for foil in settings["mean_foils"]]
+    if len(relevant_foils) == 4:
+        return [0, 2, 3]
+    return list(range(len(relevant_foils)))
+
+#-----------------------------------------------------------------------------
+
+def metadata_index(metadata):
+    """
+    Flattens the sections of a metadata dict {'mainkey' : {'subkey' : (value, unit)}}
+    to one {'subkey' : (value, unit)} lookup. The first section containing a
+    subkey wins.
+    """
+    index = {}
+    for subdict in metadata.values():
+        if isinstance(subdict, dict):
+            for key, entry in subdict.items():
+                index.setdefault(key, entry)
+    return index
+
+#-----------------------------------------------------------------------------
+
+def param_value(entry):
+    """
+    Value of a (value, unit) metadata entry, 0 if the value is not a float.
+    """
+    try:
+        value = entry[0]
+    except (TypeError, IndexError, KeyError):
+        return 0.0
+    return value if isinstance(value, float) else 0.0
+
 ##############################################################################
 ##############################################################################
 ##############################################################################
 
 class ReductionStructure:
     """
-    
+    Collection of Reduction instances of a scan, e.g. an echo time scan
     """
     def __init__(self, fileloader, *files, **kwargs):
         """
-        
+        Initializes a ReductionStructure instance
+
+        Parameters
+        ----------
+        fileloader : subclass of(or) fileloader.FileLoaderBase
+            loader to retrieve the data of the files
+        files : int
+            file numbers of the scan
+        kwargs :
+            backend : str
+                fit backend of the Reduction instances, see `Reduction´
+            workers : int, None
+                number of worker processes. With workers != 1 the files are
+                not loaded on initialization, but loaded and reduced by the
+                workers in `analyze´. None uses all available cores.
+            retain_data : bool
+                False streams through the files: each file is loaded right
+                before and its raw data dropped right after its reduction,
+                only fit_dict and the metadata entries of the param_keys of
+                `analyze´ are kept. Default True.
+            cache : resultcache.ResultCache, str, None
+                result cache (or its directory) of the reductions. Files are
+                only read and fitted if their results are not cached, so
+                Reductions are created without loading the files.
+            prefetch : int
+                number of files read ahead in a background thread while the
+                current file is reduced (workers == 1 only), see
+                `fileloader.PrefetchLoader´. Default 0. The thread runs
+                until `close´, use the ReductionStructure as context manager.
+            prefetch_bytes : int
+                memory limit of the files read ahead, default 512 MiB
+            progress : callable, None
+                called as progress(done, total) whenever files finished
+                their reduction in `run_reductions´, e.g. for progress bars
+            shared_memory : bool
+                with workers != 1 the files are read by the main process
+                directly into shared memory blocks (see `sharedstore´),
+                which the workers attach to without copying. Default False.
         """
         self.fileloader = fileloader
         self.kwargs = kwargs
-        if len(files) == 0:
-            self.red_list = []
-        else:
-            self.red_list = [Reduction(self.fileloader, f) for f in files]
+        self.backend = kwargs.get("backend", "lmfit")
+        self.workers = kwargs.get("workers", 1)
+        self.retain_data = kwargs.get("retain_data", True)
+        self.cache = kwargs.get("cache")
+        if isinstance(self.cache, str):
+            self.cache = ResultCache(self.cache)
+        load = self.workers == 1 and self.retain_data and self.cache is None
+        if self.workers == 1 and kwargs.get("prefetch", 0) > 0:
+            # files are scheduled in `run_reductions´, such that reading overlaps the reductions
+            load = False
+            self.fileloader = PrefetchLoader(fileloader, depth=kwargs["prefetch"],
+                                             max_bytes=kwargs.get("prefetch_bytes", 512*2**20))
+        self.red_list = [Reduction(self.fileloader, f, backend=self.backend, load=load, cache=self.cache) for f in files]
+        self.metadata_keys = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Stops the background thread of a PrefetchLoader (prefetch > 0) and
+        drops the files read ahead. Files requested afterwards are read
+        directly, results are kept.
+        """
+        if isinstance(self.fileloader, PrefetchLoader):
+            self.fileloader.close()
+
+    def schedule_prefetch(self, red_method, red_params):
+        """
+        Schedules the files, which `run_reductions´ will read, for prefetching.
+        Files with cached results are skipped.
+        """
+        fnums = []
+        for redobj in self.red_list:
+            if redobj.rawdata is not None:
+                continue
+            key = None if self.cache is None else redobj.cache_key(red_method, red_params, load=False)
+            if key is None or key not in self.cache:
+                fnums.append(redobj.filespecifier)
+        self.fileloader.schedule(fnums)
+
+    def release_reduced(self, redobj):
+        """
+        Without self.retain_data drops the raw data of a reduced Reduction
+        and its metadata apart from the entries of self.metadata_keys (the
+        param_keys of `analyze´), once its results were cached.
+        """
+        if not self.retain_data:
+            redobj.release_data()
+            if self.metadata_keys is not None:
+                redobj.compact_metadata(self.metadata_keys)
+
+    def report_progress(self, done):
+        """
+        Passes the number of reduced files to the progress callback, if any.
+        """
+        progress = self.kwargs.get("progress")
+        if progress is not None:
+            progress(done, len(self.red_list))
+
+    def run_reductions(self, red_method, red_params):
+        """
+        Runs `Reduction.run_reduction´ for all elements in self.red_list,
+        in a process pool if self.workers != 1. Every worker loads its own
+        file, the fit_dicts are gathered in the order of self.red_list.
+        Without self.retain_data the raw data of each file is released
+        right after its reduction.
+
+        The serial "superimposed_fitting" prepares the ROI data of all files
+        first and fits all files and foils in one batched solve.
+
+        With self.cache only the files without cached results are fitted.
+        With a PrefetchLoader the next files are read while the current one
+        is reduced. The progress callback (see `__init__´) is called as
+        files are finished.
+        """
+        if self.workers == 1 and isinstance(self.fileloader, PrefetchLoader):
+            self.schedule_prefetch(red_method, red_params)
+        if self.workers == 1 and red_method.lower() == "superimposed_fitting":
+            pending = []
+            for redobj in self.red_list:
+                key = None if self.cache is None else redobj.cache_key(red_method, red_params)
+                if key is None or not redobj.restore_cached(key):
+                    redobj.prepare_roi_data(**red_params)
+                    pending.append((redobj, key))
+                if not self.retain_data:
+                    redobj.release_data()
+            if pending:
+                preped_data = np.stack([redobj.preped_data for redobj, _ in pending])
+                with np.errstate(divide="ignore"):
+                    weights = np.sqrt(preped_data)**-1
+                result = superimposed_sine_fit(np.arange(16), preped_data, weights)
+                for idx, (redobj, key) in enumerate(pending):
+                    redobj.fit_dict = superimposed_fit_dict({name : val[idx] for name, val in result.items()},
+                                                            redobj.relevant_foils)
+                    if key is not None:
+                        redobj.store_cached(key, red_method)
+            for redobj in self.red_list:
+                self.release_reduced(redobj)
+            self.report_progress(len(self.red_list))
+            return
+
+        if self.workers == 1:
+            for done, redobj in enumerate(self.red_list, 1):
+                redobj.run_reduction(job=red_method, **red_params)
+                self.release_reduced(redobj)
+                self.report_progress(done)
+            return
+
+        pending = []
+        for redobj in self.red_list:
+            key = None if self.cache is None else redobj.cache_key(red_method, red_params, load=False)
+            if key is None or not redobj.restore_cached(key):
+                pending.append(redobj)
+            else:
+                self.release_reduced(redobj)
+        done = len(self.red_list) - len(pending)
+        self.report_progress(done)
+        if not pending:
+            return
+
+        if self.kwargs.get("shared_memory", False):
+            self.run_shared_reductions(pending, red_method, red_params, done)
+            return
+
+        loader = detached_loader(self.fileloader)
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(reduce_file, loader, redobj.filespecifier, self.backend, red_method, red_params, self.cache) : redobj
+                       for redobj in pending}
+            for future in as_completed(futures):
+                futures[future].fit_dict, futures[future].metadata = future.result()
+                self.release_reduced(futures[future])
+                done += 1
+                self.report_progress(done)
+
+    def run_shared_reductions(self, pending, red_method, red_params, done=0):
+        """
+        Reduces the Reductions pending in a process pool with the raw data in
+        shared memory: the main process reads the next files into blocks of
+        a sharedstore.SharedArrayStore while the workers reduce the previous
+        ones. At most two files per worker are held in shared memory, each
+        block is unlinked as soon as its file is reduced. All blocks are
+        unlinked if a worker fails or crashes.
+        """
+        max_pending = 2 * (self.workers or os.cpu_count() or 1)
+        queue = list(reversed(pending))
+        with SharedArrayStore() as store, ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = {}
+            while queue or futures:
+                while queue and len(futures) < max_pending:
+                    redobj = queue.pop()
+                    redobj.load_shared(store)
+                    futures[pool.submit(reduce_shared, redobj, red_method, red_params)] = redobj
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    redobj = futures.pop(future)
+                    handle = redobj.shared
+                    redobj.release_data()
+                    store.release(handle)
+                    redobj.fit_dict, redobj.map_dict, redobj.metadata = future.result()
+                    self.release_reduced(redobj)
+                    done += 1
+                    self.report_progress(done)
     
     def analyze(self, red_method, red_params, param_keys):
         """
@@ -380,7 +1523,11 @@ class ReductionStructure:
         Uses one rectangular area as mask.
 
         red_method : str
-            chooses a reduction method in ["bootstrap", "simple_fit"]
+            chooses a reduction method in ["bootstrap", "simple_fit", "superimposed_fitting"].
+            The joint fit of "superimposed_fitting" already shares one contrast
+            between all foils, which is used as weighted mean contrast.
+            Otherwise the contrasts of the foils of `mean_foil_positions´
+            are averaged.
         red_params ; dict
             will be passed to ``analyze´´ to specify reduction precedure
         param_keys : dict
@@ -394,11 +1541,8 @@ class ReductionStructure:
         >>> example_structure = ReductionStructure(...)
         >>> example_structure.analyze(dtx_value="theta_D"})
         """
-        self.contrast = []
-        self.contrast_err = []
-
         param_keys.update(dict([("echotime_value", "tau_M")])) # Standard add MIEZE time
-        self.params_dict = self.get_params(**param_keys)
+        self.metadata_keys = tuple(param_keys)
 
         # for redobj in self.red_list:
         #     if "lrbt" not in self.kwargs.keys():
@@ -418,20 +1562,22 @@ class ReductionStructure:
         #     self.contrast.append(tc)
         #     self.contrast_err.append(tcerr)
 
-        for redobj in self.red_list:
-            redobj.run_reduction(job=red_method, **red_params)
-            tc = []
-            tcerr = []
-            for foil in redobj.relevant_foils:
-                tc.append(redobj.fit_dict[foil]["contrast"])
-                tcerr.append(redobj.fit_dict[foil]["contrast_err"])
-            self.contrast.append(tc)
-            self.contrast_err.append(tcerr)
-
-        self.contrast = np.array(self.contrast)
-        self.contrast_err = np.array(self.contrast_err)
-        self.weighted_mean_contrast = np.nansum(self.contrast[:,(0,2,3)]*self.contrast_err[:,(0,2,3)]**-2, axis=1)/np.nansum(self.contrast_err[:,(0,2,3)]**-2, axis=1)
-        self.weighted_mean_contrast_err = np.sqrt(1 / np.nansum(self.contrast_err[:,(0,2,3)]**-2, axis=1))
+        self.run_reductions(red_method, red_params)
+        self.params_dict = self.get_params(**param_keys)
+
+        results = np.array([[(redobj.fit_dict[foil]["contrast"], redobj.fit_dict[foil]["contrast_err"])
+                             for foil in redobj.relevant_foils] for redobj in self.red_list], dtype=float)
+        contrasts = UncertainArray(results[..., 0], error=results[..., 1])
+        if red_method.lower() == "superimposed_fitting":
+            mean_contrasts = contrasts[:,0]
+        else:
+            positions = mean_foil_positions(self.red_list[0].relevant_foils, self.fileloader.instrumentloader)
+            mean_contrasts = contrasts[:,positions].weighted_mean(axis=1)
+
+        self.contrast = contrasts.value
+        self.contrast_err = contrasts.error
+        self.weighted_mean_contrast = mean_contrasts.value
+        self.weighted_mean_contrast_err = mean_contrasts.error
 
     def get_results(self):
         return self.contrast, self.contrast_err, self.params_dict
@@ -456,6 +1602,8 @@ class ReductionStructure:
             True    --> returns fig, ax
             False   --> does not return fig, ax
         """
+        import matplotlib.pyplot as plt
+
         fig, ax = plt.subplots(figsize=(7.5,5), dpi=300)
         ax.errorbar(self.params_dict[param_key],
                     self.weighted_mean_contrast,
@@ -473,59 +1621,154 @@ class ReductionStructure:
 
     def get_params(self, **param_keys):
         """
-        Returns the metadata specified by keys. Can be either 'mainkey' or 'subkey'.
-        Returns the entire dictionary if no key is given.
+        Collects the metadata values specified by param_keys of all files.
         --------------------------------------------------
 
         Arguments:
-        ---------- 
-        *keys       : list  : list of keys for metadata retrieval
+        ----------
+        **param_keys : dict  : {'subkey' : 'alias', ...} of metadata subkeys
 
         Returns:
         ----------
-        seldict     : dict  : dictionary containing metadata {'mainkey' : subdict, 'subkey' : item ,...}
+        seldict     : dict  : {'alias' : numpy.ndarray, ...} with one value per
+                              file, or a single float if all values are equal
+
+        Notes:
+        ----------
+        The metadata is taken from the files' Reduction instances, which keep
+        it from loading the raw data. Files are only read (without raw data)
+        if they were never loaded. Files lacking a subkey get NaN.
         """
 
-        self.fileloader.instrumentloader.set_Loader_settings(rawdata=False)
+        indices = [metadata_index(redobj.get_metadata()) for redobj in self.red_list]
         seldict = {}
-        for redobj in self.red_list:
-            self.fileloader.read_out_data(redobj.filespecifier)
-            metadata = self.fileloader.datadict["metadata"]
-            for key, alias in param_keys.items():
-                for subdict in metadata.values():
-                    if key in subdict.keys() and alias in seldict.keys():
-                        if isinstance(subdict[key][0], float):
-                            seldict[alias].append(subdict[key][0])
-                        else:
-                            seldict[alias].append(0)
-                    elif key in subdict.keys():
-                        if isinstance(subdict[key][0], float):
-                            seldict[alias] = [subdict[key][0]]
-                        else:
-                            seldict[alias] = [0]
-        for k, vs in seldict.items():
-            if np.isclose(max(vs), min(vs)):
-                seldict[k] = max(vs)
+        for key, alias in param_keys.items():
+            if not any(key in index for index in indices):
+                continue
+            values = np.array([param_value(index[key]) if key in index else np.nan for index in indices])
+            if np.isclose(np.nanmax(values), np.nanmin(values)):
+                seldict[alias] = np.nanmax(values)
+            else:
+                seldict[alias] = values
 
         return seldict
 
-    def to_file(self, fpath):
+    def result_table(self):
+        """
+        Returns the results of `analyze´ as structured array with one row
+        per file. The columns are the params, the weighted mean contrast
+        and the contrast of every foil, see `to_file´.
+        """
         nfoils = self.contrast.shape[1]
-        nrows = len(self.weighted_mean_contrast)
-        warr = np.empty((nrows, 2*nfoils + 2 + len(self.params_dict)))
-        warr[:,-2-2*nfoils] = self.weighted_mean_contrast
-        warr[:,-1-2*nfoils] = self.weighted_mean_contrast_err
-        warr[:,-2*nfoils::2] = self.contrast
-        warr[:,-2*nfoils+1::2] = self.contrast_err
-        for idx, (pkey, params) in enumerate(self.params_dict.items()):
-            if type(params) is not list:
-                warr[:,idx] = nrows * [params]
-            else:
-                warr[:,idx] = params
-
-        with open(fpath, "w") as wfile:
-            contrast_descr = ["C weighted av.      , C weighted av. err  "] + [ ", ".join((f"{f'C foil {i+1}':20}", f"{f'C err foil {i+1}':20}")) for i in range(4)]
-            param_descr = ", ".join([f"{f'### {key}':20}" if idx == 0 else f"{f'{key}':20}" for idx, key in enumerate(self.params_dict.keys())])
-            wfile.write(param_descr + ", " + ", ".join(contrast_descr) + "\n")
-            for slic in warr:
-                wfile.write(", ".join([f"{f'{v:.15f}':20}" for v in slic]) + "\n")
\ No newline at end of file
+        names = list(self.params_dict.keys()) + ["C weighted av.", "C weighted av. err"]
+        for i in range(nfoils):
+            names += [f"C foil {i+1}", f"C err foil {i+1}"]
+
+        foil_cols = np.stack((self.contrast, self.contrast_err), axis=-1).reshape(len(self.contrast), -1)
+        param_cols = [np.broadcast_to(params, len(self.contrast)) for params in self.params_dict.values()]
+        warr = np.column_stack(param_cols + [self.weighted_mean_contrast, self.weighted_mean_contrast_err, foil_cols])
+        return recfunctions.unstructured_to_structured(warr.astype(float), names=names)
+
+    def to_file(self, fpath, fmt=None, append=False):
+        """
+        Writes the result table of `analyze´ to a file.
+
+        Parameters
+        ----------
+        fpath   : str
+            path of the file
+        fmt     : str, None
+            - txt: comma separated text with a '###' header line
+            - npz: one array per column
+            - npy: structured array
+            None selects by the file extension, text for unknown extensions.
+        append  : bool
+            adds the rows to an existing file with identical columns
+
+        Notes
+        -----
+        Text files are written with 15 decimals, use 'npz' or 'npy' to keep
+        full precision. The results are read back by `load_results´.
+        Appending to a text file only writes the new rows, while 'npz' and
+        'npy' files are read and rewritten as a whole. Use text files (or
+        one binary file per call) when appending many times, e.g. per batch.
+        """
+        table = self.result_table()
+        fmt = fmt or results_format(fpath)
+        exists = append and os.path.exists(fpath) and os.path.getsize(fpath) > 0
+
+        if fmt == "txt":
+            if exists:
+                check_columns(_txt_columns(fpath), table.dtype.names, fpath)
+            labels = [f"### {name}" if idx == 0 else name for idx, name in enumerate(table.dtype.names)]
+            with open(fpath, "a" if exists else "w") as wfile:
+                np.savetxt(wfile, recfunctions.structured_to_unstructured(table), fmt="%-20.15f", delimiter=", ",
+                           header="" if exists else ", ".join(f"{label:20}" for label in labels), comments="")
+            return
+
+        if exists:
+            previous = load_results(fpath, fmt)
+            check_columns(previous.dtype.names, table.dtype.names, fpath)
+            table = np.concatenate((previous, table))
+        if fmt == "npz":
+            with open(fpath, "wb") as wfile:
+                np.savez(wfile, **{name : table[name] for name in table.dtype.names})
+        elif fmt == "npy":
+            with open(fpath, "wb") as wfile:
+                np.save(wfile, table)
+        else:
+            raise ValueError(f"Unknown result format '{fmt}'. Choose from ['txt', 'npz', 'npy'].")
+
+##############################################################################
+##############################################################################
+
+def results_format(fpath):
+    """
+    Result file format ('txt', 'npz' or 'npy') derived from the file extension.
+    """
+    ext = os.path.splitext(fpath)[1].lower()
+    return ext[1:] if ext in (".npz", ".npy") else "txt"
+
+#-----------------------------------------------------------------------------
+
+def _txt_columns(fpath):
+    """
+    Column names of a text result file, read from its '###' header line.
+    """
+    with open(fpath, "r") as rfile:
+        header = rfile.readline()
+    return [name.strip() for name in header.lstrip("#").split(",")]
+
+#-----------------------------------------------------------------------------
+
+def check_columns(present, new, fpath):
+    """
+    Raises a ValueError if the columns new appended to the file fpath differ
+    from the columns present in it.
+    """
+    if list(present) != list(new):
+        raise ValueError(f"Cannot append to '{fpath}': columns {list(new)} do not match {list(present)}.")
+
+#-----------------------------------------------------------------------------
+
+def load_results(fpath, fmt=None):
+    """
+    Reads a result file written by `ReductionStructure.to_file´.
+
+    Return
+    ------
+    table : numpy.ndarray
+        structured array with one field per column and one row per file
+    """
+    fmt = fmt or results_format(fpath)
+    if fmt == "txt":
+        names = _txt_columns(fpath)
+        warr = np.loadtxt(fpath, delimiter=",", comments="#", ndmin=2)
+        return recfunctions.unstructured_to_structured(warr, names=names)
+    if fmt == "npz":
+        with np.load(fpath) as columns:
+            return recfunctions.unstructured_to_structured(np.column_stack([columns[name] for name in columns.files]),
+                                                           names=columns.files)
+    if fmt == "npy":
+        return np.load(fpath)
+    raise ValueError(f"Unknown result format '{fmt}'. Choose from ['txt', 'npz', 'npy'].")
@@ -2,29 +2,302 @@
 """
 The model module for fitting MIEZE-S(q,t) data sets
 
-Model class defines a structure to implement different physical 
+Model class defines a structure to implement different physical
 models to fit (MIEZE) datasets.
-Various functionality to save and load previous models will be included
+Models are vectorized functions, which are fitted to many independent
+data sets at once by a batched Levenberg-Marquardt iteration.
 """
 
+### Imports
+import numpy as np
+from numpy import pi
+from ..utils import sine
+from ..optimize import batch_levenberg_marquardt
+###
+
+def numerical_jacobian(func, x, *params, rel_step=1.49e-8):
+    """
+    Forward difference Jacobian of a vectorized model function.
+
+    Parameters
+    ----------
+    func : callable
+        func(x, *params) with every parameter as a (n, 1) column,
+        returns the model of shape (n, len(x))
+    x : numpy.ndarray
+        independent variable of length L
+    params : numpy.ndarray
+        parameter columns of shape (n, 1)
+    rel_step : float
+        relative step size, the absolute step is rel_step * max(|p|, 1)
+
+    Return
+    ------
+    jac : numpy.ndarray
+        partial derivatives of shape (n, L, P)
+    """
+    params = [np.asarray(p, dtype=float) for p in params]
+    base = func(x, *params)
+    jac = np.empty(np.shape(base) + (len(params),))
+    for pidx, p in enumerate(params):
+        step = rel_step * np.maximum(np.abs(p), 1.0)
+        shifted = list(params)
+        shifted[pidx] = p + step
+        jac[..., pidx] = (func(x, *shifted) - base) / step
+    return jac
+
+####################################################################################################
+####################################################################################################
+####################################################################################################
+
 class Model:
     """
     The `Model´ class is the core structure to build fit models
     """
 
-    def init(self, name, func=None, mparams=None, shape=None, *args, **kwargs):
+    def __init__(self, name, func, mparams, jac=None, bounds=None):
         """
-        
+        Initializes a Model instance
+
+        Parameters
+        ----------
+        name : str
+            name of the model
+        func : callable
+            vectorized model function func(x, *params). During a fit every
+            parameter is passed as a (n, 1) column for n data sets and the
+            model of shape (n, len(x)) is returned.
+        mparams : list
+            names of the parameters in the order of the func arguments
+        jac : callable, None
+            analytic Jacobian jac(x, *params) of shape (n, len(x), P).
+            None uses `numerical_jacobian´.
+        bounds : dict, None
+            default bounds {'name' : (min, max), ...}, unbounded if missing
         """
         self.name = name
         self.func = func
-        self.shape = shape
-        self.mparams = mparams
-        self.args = args
-        self.kwargs = kwargs
+        self.mparams = list(mparams)
+        self.jac = jac
+        self.bounds = {} if bounds is None else dict(bounds)
+
+#---------------------------------------------------------------------------------------------------
+
+    def eval(self, x, **params):
+        """
+        Evaluates the model for the parameter values params {'name' : value}.
+        Array valued parameters are broadcast against x along a new last axis.
+        """
+        return self.func(np.asarray(x, dtype=float), *[np.asarray(params[key], dtype=float)[..., None] for key in self.mparams])
+
+#---------------------------------------------------------------------------------------------------
+
+    def jacobian(self, x, *params):
+        """
+        Analytic Jacobian of the model if available, numerical otherwise.
+        """
+        if self.jac is None:
+            return numerical_jacobian(self.func, x, *params)
+        return self.jac(x, *params)
+
+#---------------------------------------------------------------------------------------------------
+
+    def _param_array(self, values, batch_shape, default):
+        """
+        Stacks a {'name' : value} dict to an array of shape (N, P), values
+        may be scalars or arrays broadcastable to batch_shape.
+        """
+        columns = [np.broadcast_to(np.asarray(values.get(key, default[pidx]), dtype=float), batch_shape)
+                   for pidx, key in enumerate(self.mparams)]
+        return np.stack(columns, axis=-1).reshape(-1, len(self.mparams))
+
+#---------------------------------------------------------------------------------------------------
+
+    def fit(self, x, data, p0, weights=None, bounds=None, fixed=None, max_iter=200, ftol=1e-10, xtol=1e-10):
+        """
+        Fits the model to a batch of independent data sets at once.
+
+        Parameters
+        ----------
+        x : numpy.ndarray
+            independent variable of length L, shared by all data sets
+        data : numpy.ndarray
+            data sets of shape (..., L)
+        p0 : dict
+            start values {'name' : value}, scalars or arrays of shape data.shape[:-1]
+        weights : numpy.ndarray, None
+            weights of the residuals, broadcastable to data. NaN/inf are set to zero.
+        bounds : dict, None
+            {'name' : (min, max)} overriding self.bounds, min and max may be
+            arrays of shape data.shape[:-1] for per data set bounds
+        fixed : dict, None
+            {'name' : value} of parameters kept at value, which replaces p0
+        max_iter : int
+            maximal number of iterations
+        ftol, xtol : float
+            relative tolerances of chi square and parameter steps
+
+        Return
+        ------
+        result : dict
+            arrays of shape data.shape[:-1]:
+            "params" : {'name' : value}, "stderr" : {'name' : error},
+            "chisqr", "redchi", "converged" and "success" (converged with
+            finite errors). "covar" has the shape data.shape[:-1] + (P, P),
+            rows and columns of fixed parameters are NaN.
+
+        Notes
+        -----
+        The covariance matrix is scaled by the reduced chi square, as lmfit
+        does by default. Fixed parameters are held by equal bounds and a
+        zero Jacobian column, such that they may differ between data sets.
+        """
+        x = np.asarray(x, dtype=float)
+        data = np.asarray(data, dtype=float)
+        batch_shape = data.shape[:-1]
+        fixed = {} if fixed is None else fixed
+        bounds = dict(self.bounds, **({} if bounds is None else bounds))
+        npars = len(self.mparams)
+
+        if weights is None:
+            weights = np.ones_like(data)
+        weights = np.asarray(weights, dtype=float)
+        weights = np.where(np.isfinite(weights), weights, 0.0)
+        weights = np.broadcast_to(weights, data.shape).reshape(-1, data.shape[-1])
+
+        p0 = self._param_array(dict(p0, **fixed), batch_shape, [np.nan] * npars)
+        if np.isnan(p0).any():
+            raise ValueError("Start values of all parameters in {} are required.".format(self.mparams))
+        lower = self._param_array({key : bnd[0] for key, bnd in bounds.items()}, batch_shape, [-np.inf] * npars)
+        upper = self._param_array({key : bnd[1] for key, bnd in bounds.items()}, batch_shape, [np.inf] * npars)
+        vary = np.array([key not in fixed for key in self.mparams])
+        lower = np.where(vary, lower, p0)
+        upper = np.where(vary, upper, p0)
+
+        def jac(x, *params):
+            return self.jacobian(x, *params) * vary
+
+        params, chisqr, converged = batch_levenberg_marquardt(self.func, jac, x, data.reshape(-1, data.shape[-1]), p0,
+                                                              weights=weights, lower=lower, upper=upper,
+                                                              max_iter=max_iter, ftol=ftol, xtol=xtol)
+
+        redchi = chisqr / (data.shape[-1] - vary.sum())
+        J = jac(x, *params.T[..., None])[..., vary] * weights[..., None]
+        JTJ = np.einsum("nlp,nlq->npq", J, J)
+        covar = np.full((len(params), npars, npars), np.nan)
+        free = np.ix_(vary, vary)
+        with np.errstate(invalid="ignore"):
+            invertible = np.linalg.matrix_rank(JTJ) == vary.sum()
+            covar_free = np.full_like(JTJ, np.nan)
+            covar_free[invertible] = np.linalg.inv(JTJ[invertible]) * redchi[invertible, None, None]
+            covar[:, free[0], free[1]] = covar_free
+            stderr = np.sqrt(np.einsum("npp->np", covar))
+
+        success = converged & np.isfinite(stderr[:, vary]).all(axis=1)
+        return {
+            "params" : {key : params[:, pidx].reshape(batch_shape) for pidx, key in enumerate(self.mparams)},
+            "stderr" : {key : stderr[:, pidx].reshape(batch_shape) for pidx, key in enumerate(self.mparams)},
+            "covar" : covar.reshape(batch_shape + (npars, npars)),
+            "chisqr" : chisqr.reshape(batch_shape),
+            "redchi" : redchi.reshape(batch_shape),
+            "converged" : converged.reshape(batch_shape),
+            "success" : success.reshape(batch_shape),
+        }
+
+####################################################################################################
+####################################################################################################
+####################################################################################################
+
+def sine_jacobian(x, A, omega, phi, y0):
+    """
+    Partial derivatives of `utils.sine´ with respect to (A, omega, phi, y0).
+    """
+    arg = omega * x + phi
+    dA = np.sin(arg)
+    dphi = A * np.cos(arg)
+    return np.stack(np.broadcast_arrays(dA, dphi * x, dphi, np.ones_like(arg)), axis=-1)
+
 #-----------------------------------------------------------------------
 
-if __name__ == "__main__":
-    print("Model was loaded as script")
-else:
-    print("Model was loaded as module")
\ No newline at end of file
+def exponential_decay(x, amp, tau):
+    """
+    Exponential decay amp * exp(-x / tau) of e.g. S(q,t)/S(q,0).
+    """
+    return amp * np.exp(-x / tau)
+
+#-----------------------------------------------------------------------
+
+def exponential_decay_jacobian(x, amp, tau):
+    """
+    Partial derivatives of `exponential_decay´ with respect to (amp, tau).
+    """
+    decay = np.exp(-x / tau)
+    return np.stack(np.broadcast_arrays(decay, amp * decay * x / tau**2), axis=-1)
+
+#-----------------------------------------------------------------------
+
+def stretched_exponential(x, amp, tau, beta):
+    """
+    Stretched exponential decay amp * exp(-(x / tau)**beta).
+    """
+    return amp * np.exp(-(np.abs(x) / tau)**beta)
+
+#-----------------------------------------------------------------------
+
+def sine_model():
+    """
+    MIEZE sine A * sin(omega * x + phi) + y0 with analytic Jacobian.
+    """
+    return Model("sine", sine, ["A", "omega", "phi", "y0"], jac=sine_jacobian,
+                 bounds={"A" : (0.0, np.inf), "phi" : (0.0, 2*pi), "y0" : (0.0, np.inf)})
+
+#-----------------------------------------------------------------------
+
+def exponential_decay_model():
+    """
+    S(q,t) decay amp * exp(-t / tau) with analytic Jacobian.
+    """
+    return Model("exponential_decay", exponential_decay, ["amp", "tau"], jac=exponential_decay_jacobian,
+                 bounds={"amp" : (0.0, np.inf), "tau" : (1e-12, np.inf)})
+
+#-----------------------------------------------------------------------
+
+def stretched_exponential_model():
+    """
+    S(q,t) decay amp * exp(-(t / tau)**beta) with numerical Jacobian.
+    """
+    return Model("stretched_exponential", stretched_exponential, ["amp", "tau", "beta"],
+                 bounds={"amp" : (0.0, np.inf), "tau" : (1e-12, np.inf), "beta" : (1e-3, 2.0)})
+
+#-----------------------------------------------------------------------
+
+def superimposed_sine_model(nfoils, npoints=16, omega=2*pi/16):
+    """
+    Joint MIEZE sine of nfoils foils y0_f * (1 + C * sin(omega * x + phi_f))
+    with a shared contrast C and a phase phi_f and offset y0_f per foil.
+
+    The model is evaluated on the foils' time bins concatenated to one axis,
+    i.e. x = np.tile(time_bins, nfoils) and data of shape (..., nfoils * npoints).
+    The parameters are ["C", "phi_0", ..., "y0_0", ...].
+    """
+    foil = np.repeat(np.arange(nfoils), npoints)
+    onehot = (foil[:, None] == np.arange(nfoils)).astype(float)
+
+    def per_point(columns):
+        return np.concatenate(np.broadcast_arrays(*columns), axis=-1)[..., foil]
+
+    def func(x, C, *params):
+        return per_point(params[nfoils:]) * (1 + C * np.sin(omega * x + per_point(params[:nfoils])))
+
+    def jac(x, C, *params):
+        y0, arg = per_point(params[nfoils:]), omega * x + per_point(params[:nfoils])
+        dC = y0 * np.sin(arg)
+        dphi = y0 * C * np.cos(arg)
+        dy0 = 1 + C * np.sin(arg)
+        return np.concatenate((dC[..., None], dphi[..., None] * onehot, dy0[..., None] * onehot), axis=-1)
+
+    phis = ["phi_{}".format(idx) for idx in range(nfoils)]
+    offsets = ["y0_{}".format(idx) for idx in range(nfoils)]
+    return Model("superimposed_sine", func, ["C"] + phis + offsets, jac=jac,
+                 bounds=dict([("C", (0.0, np.inf))] + [(key, (0.0, np.inf)) for key in offsets]))
+
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk memoization of reduction results.
+
+A ResultCache stores the results of `Reduction.run_reduction´ under a key
+derived from the file identity, the job and its parameters, the backend and
+CACHE_VERSION. Reanalyzing a scan therefore only fits files or settings,
+which were not reduced before. Entries are evicted least recently used
+first, once the cache exceeds its size limit.
+
+Entries are pickle files, which can execute arbitrary code when they are
+loaded. Only use cache directories which nobody else can write to.
+"""
+
+### Imports
+import os
+import pickle
+import hashlib
+import tempfile
+import numpy as np
+###
+
+CACHE_VERSION = 1
+"""Increased whenever the content of cached results changes."""
+
+#-----------------------------------------------------------------------------
+
+def file_identity(path):
+    """
+    Identity of a file (absolute path, size, modification time in ns)
+    or None if path is no existing file.
+    """
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError, ValueError):
+        return None
+    if not os.path.isfile(path):
+        return None
+    return (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+#-----------------------------------------------------------------------------
+
+def content_identity(array):
+    """
+    Identity of an array by its dtype, shape and a sha256 digest of its data.
+    """
+    array = np.ascontiguousarray(array)
+    return ("ndarray", array.dtype.str, array.shape, hashlib.sha256(memoryview(array).cast("B")).hexdigest())
+
+#-----------------------------------------------------------------------------
+
+def key_part(obj):
+    """
+    Converts obj into a canonical, hashable representation for cache keys.
+    Masks are represented by their weights, arrays by `content_identity´.
+
+    Raises
+    ------
+    TypeError
+        if obj has no reproducible representation, e.g. a random Generator
+    """
+    if isinstance(obj, dict):
+        return tuple(sorted((str(key), key_part(val)) for key, val in obj.items()))
+    if isinstance(obj, (list, tuple)):
+        return tuple(key_part(val) for val in obj)
+    if isinstance(obj, np.ndarray):
+        return content_identity(obj)
+    if isinstance(obj, np.random.SeedSequence):
+        return ("SeedSequence", key_part(obj.entropy), key_part(obj.spawn_key))
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if hasattr(obj, "weights") and hasattr(obj, "getMask"):
+        return ("mask", content_identity(obj.weights()))
+    raise TypeError("Cannot derive a cache key from {!r}.".format(obj))
+
+####################################################################################################
+####################################################################################################
+####################################################################################################
+
+class ResultCache:
+    """
+    Directory of pickled reduction results with a size limit
+
+    The directory has to be trusted, `get´ unpickles every entry it finds.
+    hits and misses count the lookups of this instance in the current
+    process, lookups by pickled copies in worker processes are not counted.
+    """
+
+    def __init__(self, directory, max_size=512*2**20):
+        """
+        Initializes a ResultCache instance
+
+        Parameters
+        ----------
+        directory : str
+            cache directory, created if missing
+        max_size : int
+            size limit of all entries in bytes. The least recently used
+            entries are removed when a new entry exceeds the limit.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+#---------------------------------------------------------------------------------------------------
+
+    def __repr__(self):
+        return "ResultCache('{}', max_size={})".format(self.directory, self.max_size)
+
+#---------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def make_key(*parts):
+        """
+        Hex digest of the canonical representation of parts, see `key_part´.
+        """
+        return hashlib.sha256(repr((CACHE_VERSION, key_part(parts))).encode()).hexdigest()
+
+#---------------------------------------------------------------------------------------------------
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".pkl")
+
+#---------------------------------------------------------------------------------------------------
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+#---------------------------------------------------------------------------------------------------
+
+    def get(self, key):
+        """
+        Returns the entry stored under key or None. A hit marks the entry
+        as recently used. The entry is unpickled, so the cache directory
+        has to be trusted.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as rfile:
+                entry = pickle.load(rfile)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            self.discard(key)
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        return entry
+
+#---------------------------------------------------------------------------------------------------
+
+    def put(self, key, entry):
+        """
+        Stores entry under key and evicts old entries if the size limit is exceeded.
+        """
+        fd, tmppath = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as wfile:
+                pickle.dump(entry, wfile, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmppath, self._path(key))
+        except BaseException:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+            raise
+        self.evict(keep=key)
+
+#---------------------------------------------------------------------------------------------------
+
+    def discard(self, key):
+        """
+        Removes the entry stored under key, if present.
+        """
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+#---------------------------------------------------------------------------------------------------
+
+    def entries(self):
+        """
+        Returns [(last use, size, path), ...] of all entries, oldest first.
+        """
+        entries = []
+        for dentry in os.scandir(self.directory):
+            if dentry.name.endswith(".pkl"):
+                try:
+                    stat = dentry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, dentry.path))
+        return sorted(entries)
+
+#---------------------------------------------------------------------------------------------------
+
+    def size(self):
+        """
+        Total size of all entries in bytes.
+        """
+        return sum(size for _, size, _ in self.entries())
+
+#---------------------------------------------------------------------------------------------------
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used entries until the total size is
+        below self.max_size. The entry stored under keep is never removed.
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        keep = None if keep is None else self._path(keep)
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+#---------------------------------------------------------------------------------------------------
+
+    def clear(self):
+        """
+        Removes all entries.
+        """
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Closed-form fitting of the MIEZE sine signal.
+
+With a fixed angular frequency the model A * sin(omega * x + phi) + y0 is
+linear in (A * cos(phi), A * sin(phi), y0). The weighted least squares
+problem is therefore solved directly for any number of data sets with one
+batched solve of the 3x3 normal equations.
+"""
+
+### Imports
+import numpy as np
+from numpy import pi
+from ..uncertainty import UncertainArray
+###
+
+def clean_weights(weights):
+    """
+    Replaces NaN and inf weights (e.g. 1/sqrt(0) for empty time bins) by zero.
+    """
+    weights = np.asarray(weights, dtype=float)
+    return np.where(np.isfinite(weights), weights, 0.0)
+
+#-----------------------------------------------------------------------------
+
+def fit_sine_linear(x, data, weights, omega=2*pi/16):
+    """
+    Fits A * sin(omega * x + phi) + y0 with fixed omega to a batch of data sets.
+
+    Parameters
+    ----------
+    x       : numpy.ndarray
+        x-coordinate values of length L, e.g. the 16 time bins
+    data    : numpy.ndarray
+        data sets of shape (..., L)
+    weights : numpy.ndarray
+        weights of the residuals, broadcastable to data. NaN/inf are set to zero.
+    omega   : float
+        fixed angular frequency of the oscillation
+
+    Return
+    ------
+    result : dict
+        arrays of shape data.shape[:-1] with the same keys as the result_dict
+        of Reduction.single_fit: "contrast", "contrast_err", "phase", "phase_err",
+        "chisqr", "redchi", "success" and "raw_fit_vals" : {"A", "omega", "phi", "y0"}.
+        Additionally "raw_fit_errs" : {"A", "phi", "y0"} contains the stderr values.
+
+    Notes
+    -----
+    The covariance matrix is scaled by the reduced chi square, as lmfit does
+    by default. phi is returned in [0, 2 pi), A is always positive.
+    """
+
+    x = np.asarray(x, dtype=float)
+    data = np.asarray(data, dtype=float)
+    weights = np.broadcast_to(clean_weights(weights), data.shape)
+    batch_shape = data.shape[:-1]
+
+    design = np.stack((np.sin(omega * x), np.cos(omega * x), np.ones_like(x)), axis=-1)
+    wsqr = weights * weights
+    normal = np.einsum("lp,...l,lq->...pq", design, wsqr, design)
+    rhs = np.einsum("lp,...l->...p", design, wsqr * data)
+
+    success = np.abs(np.linalg.det(normal)) > 1e-12 * np.einsum("...pp->...", normal)**3
+    normal = np.where(success[..., None, None], normal, np.eye(3))
+    inv_normal = np.linalg.inv(normal)
+    coeffs = np.einsum("...pq,...q->...p", inv_normal, rhs)
+
+    resid = (coeffs @ design.T - data) * weights
+    chisqr = np.einsum("...l,...l->...", resid, resid)
+    redchi = chisqr / (len(x) - 3)
+    covar = inv_normal * redchi[..., None, None]
+
+    s, c, y0 = coeffs[..., 0], coeffs[..., 1], coeffs[..., 2]
+    amp = np.hypot(s, c)
+    phi = np.arctan2(c, s) % (2*pi)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        grad_amp = np.stack((s / amp, c / amp), axis=-1)
+        grad_phi = np.stack((-c / amp**2, s / amp**2), axis=-1)
+        amp_err = np.sqrt(np.einsum("...p,...pq,...q->...", grad_amp, covar[..., :2, :2], grad_amp))
+        phi_err = np.sqrt(np.einsum("...p,...pq,...q->...", grad_phi, covar[..., :2, :2], grad_phi))
+        y0_err = np.sqrt(covar[..., 2, 2])
+        contrast = UncertainArray(amp, error=amp_err) / UncertainArray(y0, error=y0_err)
+
+    success = success & np.isfinite(contrast.value)
+    invalid = lambda arr: np.where(success, arr, np.nan)
+
+    return {
+        "contrast" : invalid(contrast.value),
+        "contrast_err" : invalid(contrast.error),
+        "phase" : invalid(phi),
+        "phase_err" : invalid(phi_err),
+        "chisqr" : invalid(chisqr),
+        "redchi" : invalid(redchi),
+        "success" : success,
+        "raw_fit_vals" : {"A" : invalid(amp),
+                          "omega" : np.full(batch_shape, omega),
+                          "phi" : invalid(phi),
+                          "y0" : invalid(y0)
+                          },
+        "raw_fit_errs" : {"A" : invalid(amp_err),
+                          "phi" : invalid(phi_err),
+                          "y0" : invalid(y0_err)
+                          },
+    }
+
+#-----------------------------------------------------------------------------
+
+def split_results(batched):
+    """
+    Splits the output of `fit_sine_linear` into a nested list of result dicts
+    with python scalars, one for every data set of the batch.
+    """
+
+    def select(val, idx):
+        if isinstance(val, dict):
+            return {key : select(subval, idx) for key, subval in val.items()}
+        return val[idx].item()
+
+    shape = np.shape(batched["contrast"])
+    if len(shape) == 0:
+        return select(batched, ())
+    results = np.empty(int(np.prod(shape)), dtype=object)
+    results[:] = [select(batched, idx) for idx in np.ndindex(shape)]
+    return results.reshape(shape).tolist()
+
+####################################################################################################
+####################################################################################################
+####################################################################################################
+
+class LinearSineModel:
+    """
+    Fit backend for the MIEZE sine with fixed angular frequency, solved in closed form
+    """
+
+    def __init__(self, omega=2*pi/16):
+        """
+        Parameters
+        ----------
+        omega : float
+            fixed angular frequency of the oscillation
+        """
+        self.omega = omega
+
+    def fit(self, x, data, weights):
+        """
+        Weighted linear least squares fit of a batch of data sets, see `fit_sine_linear`.
+        """
+        return fit_sine_linear(x, data, weights, self.omega)
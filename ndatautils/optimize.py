@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Batched least squares optimization.
+
+`batch_levenberg_marquardt´ fits a model to many independent data sets in
+one vectorized iteration. It is the engine of `miezefitter.model.Model´ and
+`utils.batch_fit_beam_center´.
+"""
+
+### Imports
+import numpy as np
+###
+
+#---------------------------------------------------------------------------------------------------
+
+def batch_levenberg_marquardt(func, jac, x, data, p0, weights=None, lower=None, upper=None,
+                              max_iter=100, ftol=1e-10, xtol=1e-10):
+    """
+    Minimizes sum(((func(x, *p) - data) * weights)**2) for N independent
+    data sets at once with a bounded Levenberg-Marquardt iteration.
+
+    Parameters
+    ----------
+    func : callable
+        func(x, *params) with every parameter passed as a (n, 1) column,
+        has to return the model of shape (n, len(x))
+    jac : callable
+        jac(x, *params), same call signature as func, has to return the
+        partial derivatives of shape (n, len(x), P)
+    x : np.ndarray
+        independent variable of length L, shared by all data sets
+    data : np.ndarray
+        data sets of shape (N, L)
+    p0 : np.ndarray
+        start parameters of shape (N, P)
+    weights : np.ndarray, None
+        weights of the residuals, broadcastable to (N, L)
+    lower, upper : np.ndarray, None
+        parameter bounds broadcastable to (N, P), -/+ inf if None
+    max_iter : int
+        maximal number of iterations
+    ftol, xtol : float
+        relative tolerances of chi square and parameter steps
+
+    Return
+    ------
+    params : np.ndarray
+        best parameters of shape (N, P)
+    chisqr : np.ndarray
+        weighted sum of squared residuals of shape (N,)
+    converged : np.ndarray
+        boolean mask of shape (N,), False if max_iter was reached
+
+    Notes
+    -----
+    Bounds are handled by projecting each trial step onto the box. Only the
+    data sets which did not converge yet are evaluated in each iteration.
+    """
+
+    data = np.asarray(data, dtype=float)
+    nsets, npars = np.shape(p0)
+    weights = np.broadcast_to(1.0 if weights is None else np.asarray(weights, dtype=float), data.shape)
+    lower = np.broadcast_to(-np.inf if lower is None else lower, (nsets, npars))
+    upper = np.broadcast_to(np.inf if upper is None else upper, (nsets, npars))
+
+    def residuals(p, idx):
+        return (func(x, *p.T[..., None]) - data[idx]) * weights[idx]
+
+    allidx = np.arange(nsets)
+    params = np.clip(np.array(p0, dtype=float), lower, upper)
+    resid = residuals(params, allidx)
+    chisqr = np.einsum("nl,nl->n", resid, resid)
+    damping = np.full(nsets, 1e-3)
+    converged = np.zeros(nsets, dtype=bool)
+
+    for _ in range(max_iter):
+        idx = np.flatnonzero(~converged)
+        if len(idx) == 0:
+            break
+
+        J = jac(x, *params[idx].T[..., None]) * weights[idx][..., None]
+        JTJ = np.einsum("nlp,nlq->npq", J, J)
+        grad = np.einsum("nlp,nl->np", J, resid[idx])
+        diag = np.einsum("npp->np", JTJ)
+        lhs = JTJ + (damping[idx, None] * (diag + 1e-12 * diag.max(axis=1, keepdims=True) + 1e-300))[..., None] * np.eye(npars)
+        try:
+            step = np.linalg.solve(lhs, -grad[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            step = -np.einsum("npq,nq->np", np.linalg.pinv(lhs), grad)
+
+        trial = np.clip(params[idx] + step, lower[idx], upper[idx])
+        trial_resid = residuals(trial, idx)
+        trial_chisqr = np.einsum("nl,nl->n", trial_resid, trial_resid)
+
+        better = trial_chisqr <= chisqr[idx]
+        small_df = np.abs(chisqr[idx] - trial_chisqr) <= ftol * chisqr[idx]
+        small_dx = np.all(np.abs(trial - params[idx]) <= xtol * (np.abs(params[idx]) + xtol), axis=1)
+
+        upd = idx[better]
+        params[upd] = trial[better]
+        resid[upd] = trial_resid[better]
+        chisqr[upd] = trial_chisqr[better]
+        damping[idx] = np.where(better, damping[idx] * 0.1, damping[idx] * 10.0)
+        converged[idx] = (better & (small_df | small_dx)) | (damping[idx] > 1e16)
+
+    return params, chisqr, converged
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""
+Generator based streaming reduction of scans.
+
+Every stage is a generator consuming the items of the previous stage, so a
+scan is reduced file by file with a constant memory footprint and the first
+results are available right away:
+
+    fnums -> `load_stage´ -> `roi_stage´ -> `fit_stage´ -> `record_stage´
+
+`load_stage´ reads files ahead with a memory bounded
+`fileloader.PrefetchLoader´, `prefetch´ decouples other stages by a bounded
+buffer filled in a background thread, `parallel_map´ runs a stage in a
+bounded worker pool while keeping the order of the items. `reduce_scan´ chains the stages for the common case.
+
+Examples
+--------
+>>> scanloader = ASCIILoader(DataPath("RESEDA", 14891, root), RESEDALoader())
+>>> fileloader = CascadeLoader(DataPath("RESEDA", 14891, root, ".tof"), RESEDALoader())
+>>> for record in reduce_scan(fileloader, scan_fnums(scanloader, 4408), roi={"lrbt" : [62, 79, 52, 69]}):
+...     print(record["fnum"], record["tau_M"], record["weighted_mean_contrast"])
+"""
+
+### Imports
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from .fileloader import PrefetchLoader
+from .miezefitter.dreduction import Reduction, detached_loader, mean_foil_positions, metadata_index, param_value
+from .uncertainty import UncertainArray
+###
+
+_END = object()
+
+#-----------------------------------------------------------------------------
+
+def prefetch(iterable, depth=2):
+    """
+    Iterates iterable in a background thread, which runs up to depth items
+    ahead of the consumer.
+
+    Parameters
+    ----------
+    iterable : iterable
+        upstream stage
+    depth : int
+        size of the buffer, 0 iterates in the calling thread
+
+    Notes
+    -----
+    Exceptions of the upstream stage are raised in the consumer. Closing
+    the generator stops the background thread.
+    """
+    if depth <= 0:
+        yield from iterable
+        return
+
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.05)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        items = iter(iterable)
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+            put((_END, None))
+        except BaseException as exc:
+            put((_END, exc))
+        finally:
+            if hasattr(items, "close"):
+                items.close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, exc = buffer.get()
+            if exc is not None:
+                raise exc
+            if item is _END:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+#-----------------------------------------------------------------------------
+
+def parallel_map(func, iterable, workers=2, executor="thread", depth=None):
+    """
+    Applies func to the items of iterable in a pool of workers and yields
+    the results in the order of the items.
+
+    Parameters
+    ----------
+    func : callable
+        applied to every item, module level function for processes
+    iterable : iterable
+        upstream stage
+    workers : int
+        number of workers, 1 maps in the calling thread
+    executor : str
+        "thread" or "process" pool
+    depth : int, None
+        maximal number of submitted, not yet consumed items, 2 * workers if None
+    """
+    if workers == 1:
+        yield from map(func, iterable)
+        return
+
+    depth = 2 * workers if depth is None else max(depth, 1)
+    pool = (ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor)(max_workers=workers)
+    pending = deque()
+    try:
+        for item in iterable:
+            pending.append(pool.submit(func, item))
+            if len(pending) >= depth:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+####################################################################################################
+####################################################################################################
+####################################################################################################
+
+def scan_fnums(scanloader, scan_fnum):
+    """
+    Source stage: the file numbers of the detector files of a scan.
+
+    Parameters
+    ----------
+    scanloader : fileloader.ASCIILoader
+        loader of the '.dat' scan files
+    scan_fnum : int
+        number of the scan file
+    """
+    scanloader.read_out_data(scan_fnum)
+    yield from scanloader.fnums_from_structured_array()
+
+#-----------------------------------------------------------------------------
+
+def load_stage(fnums, fileloader, backend="lmfit", depth=2, workers=1, max_bytes=512*2**20):
+    """
+    Yields a loaded Reduction for every file number.
+
+    Parameters
+    ----------
+    fnums : iterable
+        file numbers
+    fileloader : subclass of(or) fileloader.FileLoaderBase
+        loader of the detector files
+    backend : str
+        fit backend of the Reductions
+    depth : int
+        number of files read ahead in the background by a
+        `fileloader.PrefetchLoader´
+    workers : int
+        number of threads reading files concurrently, each with its own
+        copy of fileloader (see `dreduction.detached_loader´). With
+        workers > 1 up to max(depth, workers) files are read ahead.
+    max_bytes : int
+        memory limit of the files read ahead by the PrefetchLoader
+    """
+    if workers > 1:
+        def load(fnum):
+            return Reduction(detached_loader(fileloader), fnum, backend=backend)
+
+        yield from parallel_map(load, fnums, workers=workers, depth=max(depth, workers))
+        return
+
+    fnums = iter(fnums)
+    upcoming = deque()
+    with PrefetchLoader(fileloader, depth=depth, max_bytes=max_bytes) as prefetcher:
+        def schedule():
+            while len(upcoming) <= depth:
+                fnum = next(fnums, _END)
+                if fnum is _END:
+                    return
+                upcoming.append(fnum)
+                prefetcher.schedule([fnum])
+
+        schedule()
+        while upcoming:
+            redobj = Reduction(prefetcher, upcoming.popleft(), backend=backend)
+            schedule()
+            yield redobj
+
+#-----------------------------------------------------------------------------
+
+def roi_stage(reductions, **roi):
+    """
+    Sums the ROI of every Reduction (see `Reduction.prepare_roi_data´) and
+    releases its raw data. roi takes lrbt, lbwh or pre_mask, the beam
+    center region if empty.
+    """
+    for redobj in reductions:
+        redobj.prepare_roi_data(**roi)
+        redobj.release_data()
+        yield redobj
+
+#-----------------------------------------------------------------------------
+
+def fit_preped(redobj):
+    """
+    Fits the prepared data of a Reduction, see `Reduction.fit_preped_data´.
+    """
+    redobj.fit_preped_data()
+    return redobj
+
+#-----------------------------------------------------------------------------
+
+def fit_stage(reductions, workers=1, executor="thread"):
+    """
+    Fits the prepared ROI sums of every Reduction, optionally in a pool of
+    workers, see `parallel_map´.
+    """
+    return parallel_map(fit_preped, reductions, workers=workers, executor=executor)
+
+#-----------------------------------------------------------------------------
+
+def reduce_stage(reductions, red_method, red_params=None):
+    """
+    Runs any `Reduction.run_reduction´ job (e.g. "bootstrap") on every
+    Reduction and releases its raw data afterwards.
+    """
+    red_params = {} if red_params is None else red_params
+    for redobj in reductions:
+        redobj.run_reduction(job=red_method, **red_params)
+        redobj.release_data()
+        yield redobj
+
+#-----------------------------------------------------------------------------
+
+def record_stage(reductions, param_keys=None, mean_foils=None):
+    """
+    Converts every reduced Reduction into a result record.
+
+    Parameters
+    ----------
+    reductions : iterable
+        Reductions with populated fit_dict
+    param_keys : dict, None
+        {'metadata_key' : 'alias'} as in `ReductionStructure.analyze´,
+        "echotime_value" is always added as "tau_M"
+    mean_foils : tuple, None
+        positions in Reduction.relevant_foils of the foils entering the
+        weighted mean contrast, `dreduction.mean_foil_positions´ if None
+
+    Return
+    ------
+    record : dict
+        "fnum", one entry per alias (NaN if missing), "foils", "contrast"
+        and "contrast_err" per foil, "weighted_mean_contrast" and
+        "weighted_mean_contrast_err"
+    """
+    param_keys = dict({} if param_keys is None else param_keys, echotime_value="tau_M")
+    for redobj in reductions:
+        index = metadata_index(redobj.get_metadata())
+        foils = list(redobj.relevant_foils)
+        contrasts = UncertainArray([redobj.fit_dict[foil]["contrast"] for foil in foils],
+                                   error=[redobj.fit_dict[foil]["contrast_err"] for foil in foils])
+        positions = mean_foil_positions(foils, redobj.instrumentloader) if mean_foils is None else list(mean_foils)
+        mean_contrast = contrasts[positions].weighted_mean()
+
+        record = {"fnum" : redobj.filespecifier}
+        record.update({alias : param_value(index[key]) if key in index else np.nan for key, alias in param_keys.items()})
+        record.update({"foils" : foils,
+                       "contrast" : contrasts.value,
+                       "contrast_err" : contrasts.error,
+                       "weighted_mean_contrast" : float(mean_contrast.value),
+                       "weighted_mean_contrast_err" : float(mean_contrast.error)})
+        yield record
+
+####################################################################################################
+####################################################################################################
+####################################################################################################
+
+def reduce_scan(fileloader, fnums, roi=None, red_method="simple_fit", red_params=None, param_keys=None,
+                backend="lmfit", depth=2, load_workers=1, fit_workers=1):
+    """
+    Streams the files of a scan through the reduction and yields one result
+    record per file (see `record_stage´) as soon as it is reduced.
+
+    Parameters
+    ----------
+    fileloader : subclass of(or) fileloader.FileLoaderBase
+        loader of the detector files
+    fnums : iterable
+        file numbers, e.g. `scan_fnums´
+    roi : dict, None
+        ROI of "simple_fit" as {'lrbt' : [...]}, {'lbwh' : [...]} or
+        {'pre_mask' : mask}, the beam center region if None
+    red_method : str
+        "simple_fit" sums the ROI right after loading and fits the ROI sums,
+        other jobs of `Reduction.run_reduction´ run with red_params
+    red_params : dict, None
+        parameters of red_method other than "simple_fit"
+    param_keys : dict, None
+        metadata of the records, see `record_stage´
+    backend : str
+        fit backend, the default matches `dreduction.Reduction´
+    depth : int
+        number of files read ahead in the background
+    load_workers, fit_workers : int
+        number of threads reading files and fitting ROI sums
+    """
+    reductions = load_stage(fnums, fileloader, backend=backend, depth=depth, workers=load_workers)
+    if red_method.lower() == "simple_fit":
+        reductions = fit_stage(roi_stage(reductions, **({} if roi is None else roi)), workers=fit_workers)
+    else:
+        reductions = reduce_stage(reductions, red_method, red_params)
+    return record_stage(reductions, param_keys)
@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in stage timing and profiling of the reduction.
+
+The file access and the reduction steps are instrumented as named stages.
+While profiling is enabled every stage records its wall time, number of
+calls, bytes read from disk and, optionally, its peak memory allocation
+(`tracemalloc´) into a ProfileStats object. Disabled, the instrumentation
+costs a single check per call.
+
+Within ndatautils the file loaders, the data-processing methods of the
+masks and the reduction steps are @timed, and byte counts are only
+computed and passed to add_bytes behind an is_enabled() check.
+
+Examples
+--------
+>>> with profiling.profile(memory=True) as stats:
+...     redstruct.analyze("simple_fit", {"lrbt" : [62, 79, 52, 69]})
+>>> print(stats.table())
+>>> stats.to_json("reduction_profile.json")
+
+User code joins in with the same hooks:
+
+>>> @profiling.timed("normalization")
+... def normalize(data): ...
+>>> with profiling.stage("export") as current:
+...     current.add_bytes(nbytes)
+"""
+
+### Imports
+import json
+import time
+import fnmatch
+import functools
+import threading
+import tracemalloc
+from collections import OrderedDict
+###
+
+_stats = None
+_own_tracing = False
+_local = threading.local()
+
+#-----------------------------------------------------------------------------
+
+def _new_record():
+    return {"calls" : 0, "wall_time" : 0.0, "min_time" : float("inf"), "max_time" : 0.0,
+            "bytes_read" : 0, "peak_memory" : None}
+
+####################################################################################################
+####################################################################################################
+####################################################################################################
+
+class ProfileStats:
+    """
+    Per stage records of a profiling run
+    """
+
+    def __init__(self):
+        """
+        Initializes an empty ProfileStats instance. The records of a stage
+        are "calls", "wall_time" (total in s), "min_time", "max_time",
+        "mean_time", "bytes_read" and "peak_memory" (maximal allocation
+        above the start of a call in bytes, None without memory tracing).
+        """
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+
+#---------------------------------------------------------------------------------------------------
+
+    def record(self, name, wall_time, nbytes=0, peak_memory=None):
+        """
+        Adds one call of stage name.
+        """
+        with self._lock:
+            rec = self._records.setdefault(name, _new_record())
+            rec["calls"] += 1
+            rec["wall_time"] += wall_time
+            rec["min_time"] = min(rec["min_time"], wall_time)
+            rec["max_time"] = max(rec["max_time"], wall_time)
+            rec["bytes_read"] += nbytes
+            if peak_memory is not None:
+                rec["peak_memory"] = max(rec["peak_memory"] or 0, peak_memory)
+
+#---------------------------------------------------------------------------------------------------
+
+    def merge(self, other):
+        """
+        Adds the records of another ProfileStats instance, e.g. of a worker process.
+        """
+        for name, orec in other._records.items():
+            with self._lock:
+                rec = self._records.setdefault(name, _new_record())
+                rec["calls"] += orec["calls"]
+                rec["wall_time"] += orec["wall_time"]
+                rec["min_time"] = min(rec["min_time"], orec["min_time"])
+                rec["max_time"] = max(rec["max_time"], orec["max_time"])
+                rec["bytes_read"] += orec["bytes_read"]
+                if orec["peak_memory"] is not None:
+                    rec["peak_memory"] = max(rec["peak_memory"] or 0, orec["peak_memory"])
+
+#---------------------------------------------------------------------------------------------------
+
+    def __getitem__(self, name):
+        with self._lock:
+            rec = dict(self._records[name])
+        rec["mean_time"] = rec["wall_time"] / rec["calls"]
+        return rec
+
+    def __contains__(self, name):
+        return name in self._records
+
+    def __iter__(self):
+        return iter(self.names())
+
+    def __len__(self):
+        return len(self._records)
+
+    def __repr__(self):
+        return "ProfileStats({} stages)".format(len(self))
+
+#---------------------------------------------------------------------------------------------------
+
+    def names(self):
+        """
+        Names of the recorded stages in order of their first call.
+        """
+        with self._lock:
+            return list(self._records)
+
+#---------------------------------------------------------------------------------------------------
+
+    def query(self, pattern="*", sort=None):
+        """
+        Returns {name : record} of all stages matching the shell-style pattern,
+        e.g. "CascadeLoader.*".
+
+        Parameters
+        ----------
+        pattern : str
+            fnmatch pattern of the stage names
+        sort : str, None
+            record field to sort by in descending order, order of the
+            first call if None
+        """
+        records = [(name, self[name]) for name in self.names() if fnmatch.fnmatchcase(name, pattern)]
+        if sort is not None:
+            records.sort(key=lambda item: -1 if item[1][sort] is None else item[1][sort], reverse=True)
+        return OrderedDict(records)
+
+#---------------------------------------------------------------------------------------------------
+
+    def total(self, field="wall_time", pattern="*"):
+        """
+        Sum of field over all stages matching pattern. Nested stages are
+        counted in their own and in their enclosing stage.
+        """
+        return sum(rec[field] or 0 for rec in self.query(pattern).values())
+
+#---------------------------------------------------------------------------------------------------
+
+    def reset(self):
+        """
+        Removes all records.
+        """
+        with self._lock:
+            self._records.clear()
+
+#---------------------------------------------------------------------------------------------------
+
+    def table(self, sort="wall_time"):
+        """
+        Human readable summary of all stages as a string.
+        """
+        lines = ["{:<40s} {:>8s} {:>12s} {:>12s} {:>14s} {:>14s}".format(
+            "stage", "calls", "total [s]", "mean [s]", "bytes read", "peak mem [B]")]
+        for name, rec in self.query(sort=sort).items():
+            lines.append("{:<40s} {:>8d} {:>12.6f} {:>12.6f} {:>14d} {:>14s}".format(
+                name, rec["calls"], rec["wall_time"], rec["mean_time"], rec["bytes_read"],
+                "-" if rec["peak_memory"] is None else str(rec["peak_memory"])))
+        return "\n".join(lines)
+
+#---------------------------------------------------------------------------------------------------
+
+    def to_dict(self):
+        """
+        Returns {"stages" : {name : record, ...}} as plain python types.
+        """
+        return {"stages" : dict(self.query())}
+
+#---------------------------------------------------------------------------------------------------
+
+    def to_json(self, fpath=None, indent=2):
+        """
+        Exports the records as JSON, see `to_dict´. Writes to fpath if given
+        and returns the JSON string.
+        """
+        text = json.dumps(self.to_dict(), indent=indent)
+        if fpath is not None:
+            with open(fpath, "w") as wfile:
+                wfile.write(text)
+        return text
+
+#---------------------------------------------------------------------------------------------------
+
+    @classmethod
+    def from_json(cls, source):
+        """
+        Restores a ProfileStats instance from a JSON string or file path
+        written by `to_json´.
+        """
+        if not source.lstrip().startswith("{"):
+            with open(source, "r") as rfile:
+                source = rfile.read()
+        stats = cls()
+        for name, rec in json.loads(source)["stages"].items():
+            rec.pop("mean_time", None)
+            stats._records[name] = dict(_new_record(), **rec)
+        return stats
+
+####################################################################################################
+####################################################################################################
+####################################################################################################
+
+def enable(memory=False, stats=None):
+    """
+    Starts recording the instrumented stages.
+
+    Parameters
+    ----------
+    memory : bool
+        records the peak memory of every stage with `tracemalloc´. Tracing
+        slows down allocation heavy code considerably.
+    stats : ProfileStats, None
+        records are added to stats, a new instance if None
+
+    Return
+    ------
+    stats : ProfileStats
+        the active records
+    """
+    global _stats, _own_tracing
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _own_tracing = True
+    _stats = ProfileStats() if stats is None else stats
+    return _stats
+
+#-----------------------------------------------------------------------------
+
+def disable():
+    """
+    Stops recording and returns the recorded ProfileStats (None if profiling
+    was not enabled). Memory tracing started by `enable´ is stopped.
+    """
+    global _stats, _own_tracing
+    stats, _stats = _stats, None
+    if _own_tracing:
+        tracemalloc.stop()
+        _own_tracing = False
+    return stats
+
+#-----------------------------------------------------------------------------
+
+def is_enabled():
+    return _stats is not None
+
+#-----------------------------------------------------------------------------
+
+def get_stats():
+    """
+    The active ProfileStats or None if profiling is disabled.
+    """
+    return _stats
+
+#-----------------------------------------------------------------------------
+
+class profile:
+    """
+    Context manager enabling profiling for its body, see `enable´. Yields
+    the ProfileStats and restores the previous state on exit.
+    """
+
+    def __init__(self, memory=False, stats=None):
+        self.memory = memory
+        self.stats = ProfileStats() if stats is None else stats
+
+    def __enter__(self):
+        global _stats
+        self._previous = _stats
+        self._tracing = self.memory and not tracemalloc.is_tracing()
+        if self._tracing:
+            tracemalloc.start()
+        _stats = self.stats
+        return self.stats
+
+    def __exit__(self, *exc_info):
+        global _stats
+        if self._tracing:
+            tracemalloc.stop()
+        _stats = self._previous
+        return False
+
+####################################################################################################
+####################################################################################################
+####################################################################################################
+
+class _NullStage:
+    """
+    Stage used while profiling is disabled.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add_bytes(self, nbytes):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+#-----------------------------------------------------------------------------
+
+class _Stage:
+    """
+    Records one call of a stage into the active ProfileStats.
+    """
+
+    def __init__(self, name, nbytes, stats):
+        self.name = name
+        self.nbytes = nbytes
+        self.stats = stats
+
+    def add_bytes(self, nbytes):
+        self.nbytes += nbytes
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        self.child_peak = 0
+        if tracemalloc.is_tracing():
+            self.start_memory, self.outer_peak = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        else:
+            self.start_memory = None
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall_time = time.perf_counter() - self.start
+        stack = _local.stack
+        stack.pop()
+        peak_memory = None
+        if self.start_memory is not None and tracemalloc.is_tracing():
+            peak = max(tracemalloc.get_traced_memory()[1], self.child_peak)
+            peak_memory = max(peak - self.start_memory, 0)
+            # the enclosing stage lost its peak by the reset in __enter__
+            if stack:
+                stack[-1].child_peak = max(stack[-1].child_peak, self.outer_peak, peak)
+        self.stats.record(self.name, wall_time, self.nbytes, peak_memory)
+        return False
+
+#-----------------------------------------------------------------------------
+
+def stage(name, nbytes=0):
+    """
+    Context manager recording its body as stage name while profiling is
+    enabled. The yielded object counts bytes read by add_bytes(nbytes).
+
+    Notes
+    -----
+    Peak memory is traced process wide, stages running concurrently in
+    other threads (e.g. of `fileloader.PrefetchLoader´) contribute to it.
+    """
+    if _stats is None:
+        return _NULL_STAGE
+    return _Stage(name, nbytes, _stats)
+
+#-----------------------------------------------------------------------------
+
+def add_bytes(nbytes):
+    """
+    Adds nbytes read to the innermost running stage of the calling thread.
+    """
+    if _stats is None:
+        return
+    stack = getattr(_local, "stack", None)
+    if stack:
+        stack[-1].add_bytes(nbytes)
+
+#-----------------------------------------------------------------------------
+
+def timed(name=None):
+    """
+    Decorator recording every call of the decorated function as a stage,
+    named by the function's qualified name if name is None. Works bare
+    (@timed) and with arguments (@timed("name")).
+    """
+    if callable(name):
+        return timed()(name)
+
+    def decorator(func):
+        stage_name = func.__qualname__ if name is None else name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _stats is None:
+                return func(*args, **kwargs)
+            with _Stage(stage_name, 0, _stats):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
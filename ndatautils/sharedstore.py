@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+Shared-memory backed arrays for multi-process reductions.
+
+A SharedArrayStore owns blocks of `multiprocessing.shared_memory´, into
+which the detector cubes are read directly (see `SharedArrayStore.load_cube´).
+Only a small SharedArray handle (block name, shape, dtype) is sent to worker
+processes, which map the block with `attach´ instead of receiving a pickled
+copy of the data.
+
+Cleanup
+-------
+Only the store unlinks its blocks: on `release´, `close´, leaving its
+context or when it is garbage collected. Workers merely map the blocks, so
+a crashing worker leaves nothing behind. Blocks of a crashed owner process
+are unlinked by the multiprocessing resource tracker at its shutdown.
+
+Examples
+--------
+>>> with SharedArrayStore() as store:
+...     handle, cube = store.load_cube(fileloader, 144052, foils=(0, 1, 2, 3))
+...     future = pool.submit(worker_function, handle)   # worker: cube = attach(handle)
+"""
+
+### Imports
+import os
+import sys
+import uuid
+import weakref
+import numpy as np
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from .profiling import timed
+###
+
+CUBE_SHAPE = (8, 16, 128, 128)
+"""Shape of the raw data of a CASCADE '.tof' file (foils, time bins, y, x)."""
+
+_ATTACHED = {}
+"""Blocks mapped by `attach´ in this process, {name : SharedMemory}."""
+
+_LINGERING = []
+"""Released blocks, which arrays still referred to when they were closed."""
+
+#-----------------------------------------------------------------------------
+
+class SharedArray:
+    """
+    Picklable handle of an array in a shared memory block
+    """
+
+    __slots__ = ("name", "shape", "dtype")
+
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype).str
+
+    def __getstate__(self):
+        return (self.name, self.shape, self.dtype)
+
+    def __setstate__(self, state):
+        self.name, self.shape, self.dtype = state
+
+    def __repr__(self):
+        return "SharedArray('{}', shape={}, dtype='{}')".format(self.name, self.shape, self.dtype)
+
+    def __eq__(self, other):
+        return isinstance(other, SharedArray) and self.__getstate__() == other.__getstate__()
+
+    def __hash__(self):
+        return hash(self.__getstate__())
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape, dtype=np.int64)) * np.dtype(self.dtype).itemsize
+
+#-----------------------------------------------------------------------------
+
+def _view(shm, handle):
+    return np.ndarray(handle.shape, dtype=handle.dtype, buffer=shm.buf)
+
+#-----------------------------------------------------------------------------
+
+def attach(handle):
+    """
+    Maps the block of handle into this process and returns the array
+    without copying. Repeated calls reuse the mapping.
+
+    Notes
+    -----
+    The mapping is not registered with the resource tracker where python
+    allows it (>= 3.13). Otherwise pool workers register the name with the
+    resource tracker of their parent, which already tracks it, so the
+    worker's exit never unlinks the block.
+    """
+    shm = _ATTACHED.get(handle.name)
+    if shm is None:
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name=handle.name, track=False)
+        else:
+            shm = shared_memory.SharedMemory(name=handle.name)
+        _ATTACHED[handle.name] = shm
+    return _view(shm, handle)
+
+#-----------------------------------------------------------------------------
+
+def detach(handle):
+    """
+    Unmaps the block of handle in this process, if it was attached. Arrays
+    still referring to it keep the mapping alive. Never unlinks the block.
+    """
+    shm = _ATTACHED.pop(handle.name, None)
+    if shm is not None:
+        _close(shm)
+
+#-----------------------------------------------------------------------------
+
+def _close(shm):
+    """
+    Closes the mapping of shm. If arrays still refer to it, shm is kept
+    alive in _LINGERING and closed by a later call, once they are gone.
+    """
+    for lingering in list(_LINGERING):
+        try:
+            lingering.close()
+            _LINGERING.remove(lingering)
+        except BufferError:
+            pass
+    try:
+        shm.close()
+    except BufferError:
+        _LINGERING.append(shm)
+
+#-----------------------------------------------------------------------------
+
+def _unlink_blocks(blocks):
+    """
+    Closes and unlinks all blocks of a store, used by its finalizer.
+    """
+    while blocks:
+        _, shm = blocks.popitem()
+        _close(shm)
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+####################################################################################################
+####################################################################################################
+####################################################################################################
+
+class SharedArrayStore:
+    """
+    Owner of shared memory blocks holding arrays
+    """
+
+    def __init__(self, prefix="ndu"):
+        """
+        Initializes an empty SharedArrayStore instance
+
+        Parameters
+        ----------
+        prefix : str
+            prefix of the block names, which are unique per store and block
+        """
+        self.prefix = "{}_{}_{}".format(prefix, os.getpid(), uuid.uuid4().hex[:8])
+        self._blocks = OrderedDict()
+        self._count = 0
+        self._finalizer = weakref.finalize(self, _unlink_blocks, self._blocks)
+
+#---------------------------------------------------------------------------------------------------
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def __contains__(self, handle):
+        return handle.name in self._blocks
+
+    def __repr__(self):
+        return "SharedArrayStore('{}', {} blocks, {} bytes)".format(self.prefix, len(self), self.nbytes)
+
+#---------------------------------------------------------------------------------------------------
+
+    @property
+    def nbytes(self):
+        """
+        Total size of all blocks in bytes.
+        """
+        return sum(shm.size for shm in self._blocks.values())
+
+#---------------------------------------------------------------------------------------------------
+
+    def empty(self, shape, dtype=np.int32):
+        """
+        Creates a block for an array of shape and dtype.
+
+        Return
+        ------
+        handle : SharedArray
+            picklable handle for `attach´
+        array : numpy.ndarray
+            uninitialized array in the block
+        """
+        self._count += 1
+        handle = SharedArray("{}_{}".format(self.prefix, self._count), shape, dtype)
+        shm = shared_memory.SharedMemory(name=handle.name, create=True, size=max(handle.nbytes, 1))
+        self._blocks[handle.name] = shm
+        return handle, _view(shm, handle)
+
+#---------------------------------------------------------------------------------------------------
+
+    def from_array(self, array):
+        """
+        Copies array into a new block, see `empty´.
+        """
+        array = np.asarray(array)
+        handle, shared = self.empty(array.shape, array.dtype)
+        shared[...] = array
+        return handle, shared
+
+#---------------------------------------------------------------------------------------------------
+
+    @timed("SharedArrayStore.load_cube")
+    def load_cube(self, fileloader, fnum, foils=None):
+        """
+        Reads the raw data of file fnum into a new block.
+
+        Parameters
+        ----------
+        fileloader : subclass of(or) fileloader.FileLoaderBase
+            loader of the file. Loaders with a read_rawdata_into(fnum, out, foils)
+            method (e.g. `fileloader.CascadeLoader´) fill the block directly,
+            others read the file and the raw data is copied once.
+        fnum : int
+            number of the file
+        foils : sequence, None
+            foils stored in the block, all if None
+
+        Return
+        ------
+        handle, array : SharedArray, numpy.ndarray
+            see `empty´, the array has shape (foils, 16, 128, 128)
+        """
+        reader = getattr(fileloader, "read_rawdata_into", None)
+        if reader is None:
+            fileloader.read_out_data(fnum)
+            rawdata = fileloader.datadict.pop("rawdata")
+            return self.from_array(rawdata if foils is None else rawdata[list(foils)])
+
+        nfoils = CUBE_SHAPE[0] if foils is None else len(foils)
+        handle, cube = self.empty((nfoils,) + CUBE_SHAPE[1:], np.int32)
+        try:
+            reader(fnum, cube, foils)
+        except BaseException:
+            self.release(handle)
+            raise
+        return handle, cube
+
+#---------------------------------------------------------------------------------------------------
+
+    def release(self, handle):
+        """
+        Unlinks the block of handle. Arrays of this process referring to it
+        stay valid until they are deleted, workers cannot attach anymore.
+        """
+        shm = self._blocks.pop(handle.name, None)
+        if shm is None:
+            return
+        _close(shm)
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+#---------------------------------------------------------------------------------------------------
+
+    def close(self):
+        """
+        Unlinks all blocks of the store.
+        """
+        _unlink_blocks(self._blocks)
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic NICOS/CASCADE data files.
+
+Writes '.tof'/'.pad' detector files (int32 payload followed by a NICOS
+metadata footer) with a Poisson distributed MIEZE signal of known contrast
+and phase, and '.dat' scan files listing them, in the layout generated by
+`datapath.DataPath´. The files are read by the regular loaders, which makes
+tests and benchmarks independent of measured data.
+
+Examples
+--------
+>>> scan = write_scan(root, 14891, 4408, fnums=range(1, 6), echotimes=np.geomspace(0.01, 1.0, 5))
+>>> scanloader = ASCIILoader(DataPath("RESEDA", 14891, root, ".dat"), RESEDALoader("DAT"))
+>>> fileloader = CascadeLoader(DataPath("RESEDA", 14891, root, ".tof"), RESEDALoader("TOF", foils=(0, 1, 2, 3)))
+"""
+
+### Imports
+import os
+import numpy as np
+from .datapath import DataPath
+###
+
+#-----------------------------------------------------------------------------
+
+def mieze_expectation(contrast=0.6, phase=1.3, nfoils=8, ntbins=16, shape=(128, 128),
+                      center=(64.0, 64.0), width=(4.0, 5.0), intensity=400.0, background=0.5):
+    """
+    Expected counts of a MIEZE measurement with a gaussian beam spot.
+
+    Parameters
+    ----------
+    contrast : float, array_like
+        MIEZE contrast, scalar or one value per foil
+    phase : float, array_like
+        phase of the MIEZE sine, scalar or one value per foil
+    nfoils, ntbins : int
+        number of foils and time bins
+    shape : tuple
+        detector shape (ny, nx)
+    center : tuple
+        beam center (y, x) in pixel
+    width : tuple
+        standard deviations of the beam spot (y, x) in pixel
+    intensity : float
+        mean counts per time bin in the beam center
+    background : float
+        unmodulated mean counts per time bin and pixel
+
+    Return
+    ------
+    expectation : numpy.ndarray
+        (nfoils, ntbins, ny, nx) float array
+        intensity * beam * (1 + contrast * sin(2 pi / ntbins * t + phase)) + background
+    """
+    y, x = np.mgrid[:shape[0], :shape[1]]
+    beam = intensity * np.exp(-0.5 * (((y - center[0]) / width[0])**2 + ((x - center[1]) / width[1])**2))
+    contrast = np.broadcast_to(np.asarray(contrast, dtype=float), (nfoils,))
+    phase = np.broadcast_to(np.asarray(phase, dtype=float), (nfoils,))
+    modulation = 1.0 + contrast[:, None] * np.sin(2 * np.pi / ntbins * np.arange(ntbins) + phase[:, None])
+    return beam * modulation[..., None, None] + background
+
+#-----------------------------------------------------------------------------
+
+def mieze_counts(seed=None, **signal):
+    """
+    Poisson distributed int32 counts of `mieze_expectation´(**signal).
+
+    Parameters
+    ----------
+    seed : None, int, numpy.random.Generator
+        seed of the counting statistics
+    """
+    rng = np.random.default_rng(seed)
+    return rng.poisson(mieze_expectation(**signal)).astype(np.int32)
+
+#-----------------------------------------------------------------------------
+
+def format_value(value):
+    """
+    Formats a metadata entry as written by NICOS: (value, unit) tuples as
+    'value unit', floats in fixed point notation, which the loaders parse back.
+    """
+    if isinstance(value, tuple) and len(value) == 2 and isinstance(value[1], str):
+        return "{} {}".format(format_value(value[0]), value[1]).strip()
+    if isinstance(value, tuple):
+        return ", ".join(format_value(val) for val in value)
+    if isinstance(value, (float, np.floating)):
+        return "{:.8f}".format(value)
+    return str(value)
+
+#-----------------------------------------------------------------------------
+
+def format_metadata(metadata, prefix=""):
+    """
+    NICOS metadata block of {'section' : {'key' : value}} as a string with
+    '### section' headers and 'key : value' lines. '.dat' files prefix
+    the entry lines with '#'.
+    """
+    lines = []
+    for section, entries in metadata.items():
+        lines.append("### {}".format(section))
+        for key, value in entries.items():
+            lines.append("{}{:>40s} : {}".format(prefix, key, format_value(value)))
+    return "\n".join(lines) + "\n"
+
+#-----------------------------------------------------------------------------
+
+def cascade_metadata(fnum, echotime=None, contrast=None, phase=None, temperature=4.0, sample="synthetic"):
+    """
+    Default metadata footer of a synthetic CASCADE file.
+    """
+    metadata = {
+        "Sample and alignment" : {"Sample_samplename" : sample, "T_value" : (temperature, "K")},
+        "Miscellaneous" : {"file_number" : int(fnum)},
+    }
+    if echotime is not None:
+        metadata["Miscellaneous"]["echotime_value"] = (float(echotime), "ns")
+    if contrast is not None:
+        metadata["Miscellaneous"]["synthetic_contrast"] = float(np.mean(contrast))
+    if phase is not None:
+        metadata["Miscellaneous"]["synthetic_phase"] = float(np.mean(phase))
+    return metadata
+
+#-----------------------------------------------------------------------------
+
+def write_cascade_file(fpath, rawdata, metadata=None):
+    """
+    Writes a CASCADE '.tof' or '.pad' file: rawdata as int32 payload
+    followed by the metadata footer, see `format_metadata´.
+
+    Parameters
+    ----------
+    fpath : str
+        path of the file, missing directories are created
+    rawdata : numpy.ndarray
+        (8, 16, 128, 128) counts of a '.tof' or (128, 128) of a '.pad' file
+    metadata : dict, None
+        {'section' : {'key' : value}}
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(fpath)), exist_ok=True)
+    with open(fpath, "wb") as wfile:
+        wfile.write(np.ascontiguousarray(rawdata, dtype=np.int32).tobytes())
+        wfile.write(b"\n")
+        if metadata:
+            wfile.write(format_metadata(metadata).encode("utf-8"))
+
+#-----------------------------------------------------------------------------
+
+def write_scan_file(fpath, names, units, rows, metadata=None):
+    """
+    Writes a NICOS '.dat' scan file.
+
+    Parameters
+    ----------
+    fpath : str
+        path of the file, missing directories are created
+    names, units : list
+        column names and units of the scan data
+    rows : list
+        rows of the scan data, one value per column
+    metadata : dict, None
+        {'section' : {'key' : value}} written before the scan data
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(fpath)), exist_ok=True)
+    with open(fpath, "w") as wfile:
+        wfile.write("### NICOS data file\n")
+        if metadata:
+            wfile.write(format_metadata(metadata, prefix="#"))
+        wfile.write("### Scan data\n")
+        wfile.write("# " + "\t".join(names) + "\n")
+        wfile.write("# " + "\t".join(units) + "\n")
+        for row in rows:
+            wfile.write("\t".join(format_value(val) for val in row) + "\n")
+        wfile.write("### End of NICOS data file\n")
+
+#-----------------------------------------------------------------------------
+
+def per_file(values, nfiles):
+    """
+    Broadcasts a scalar, per file (nfiles,) or per file and foil
+    (nfiles, nfoils) parameter to shape (nfiles, 1) or (nfiles, nfoils).
+    """
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+        values = values[:, None]
+    return np.broadcast_to(values, (nfiles, values.shape[-1] if values.ndim == 2 else 1))
+
+####################################################################################################
+####################################################################################################
+####################################################################################################
+
+def write_scan(root, proposal, scan_fnum, fnums, echotimes=None, instrument="RESEDA", ending=".tof",
+               contrast=0.6, phase=1.3, seed=0, **signal):
+    """
+    Writes a MIEZE scan: one detector file per file number and the '.dat'
+    scan file listing them, in the DataPath layout below root.
+
+    Parameters
+    ----------
+    root : str
+        data root directory
+    proposal : int
+        proposal number
+    scan_fnum : int
+        number of the '.dat' scan file
+    fnums : iterable
+        numbers of the detector files
+    echotimes : array_like, None
+        echo time of every file in ns, 0.1 ns steps if None
+    instrument : str
+        "RESEDA" or "MIRA"
+    ending : str
+        ".tof" for (8, 16, 128, 128) or ".pad" for (128, 128) files
+    contrast, phase : float, array_like
+        scalar, per file (len(fnums),), or per file and foil (len(fnums), nfoils)
+    seed : int
+        seed of the counting statistics, every file draws from its own substream
+    signal : dict
+        further parameters of `mieze_expectation´
+
+    Return
+    ------
+    scan : dict
+        "scan_path", "paths", "fnums", "echotimes", "contrast" and "phase"
+        of the files
+    """
+    fnums = [int(fnum) for fnum in fnums]
+    nfiles = len(fnums)
+    echotimes = 0.1 * np.arange(1, nfiles + 1) if echotimes is None else np.asarray(echotimes, dtype=float)
+    contrast = per_file(contrast, nfiles)
+    phase = per_file(phase, nfiles)
+
+    datapath = DataPath(instrument, proposal, root, ending)
+    streams = np.random.SeedSequence(seed).spawn(nfiles)
+    paths = []
+    for fidx, fnum in enumerate(fnums):
+        counts = mieze_counts(np.random.default_rng(streams[fidx]), contrast=contrast[fidx], phase=phase[fidx], **signal)
+        if ending == ".pad":
+            counts = counts.sum(axis=(0, 1), dtype=np.int32)
+        fpath = datapath(fnum)
+        write_cascade_file(fpath, counts, cascade_metadata(fnum, echotimes[fidx], contrast[fidx], phase[fidx]))
+        paths.append(fpath)
+
+    scan_path = DataPath(instrument, proposal, root, ".dat")(scan_fnum)
+    rows = [(echotimes[fidx], 4.0, "cascade/" + os.path.basename(paths[fidx])) for fidx in range(nfiles)]
+    write_scan_file(scan_path, ["echotime", "T", "file1"], ["ns", "K", "file"], rows,
+                    metadata={"Sample and alignment" : {"Sample_samplename" : "synthetic"}})
+
+    return {"scan_path" : scan_path, "paths" : paths, "fnums" : fnums, "echotimes" : echotimes,
+            "contrast" : np.array(contrast), "phase" : np.array(phase)}
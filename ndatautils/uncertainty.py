@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Array-backed values with Gaussian uncertainties.
+
+UncertainArray stores a value and a variance array of the same shape and
+propagates the (uncorrelated, first order) uncertainties through numpy
+arithmetic, e.g. for the contrast C = A / y0 of a whole set of fit results.
+"""
+
+import numpy as np
+from numpy.lib.mixins import NDArrayOperatorsMixin
+
+####################################################################################################
+####################################################################################################
+####################################################################################################
+
+def _split(operand):
+    """
+    Returns (value, variance) of an UncertainArray or an exact number/array.
+    """
+    if isinstance(operand, UncertainArray):
+        return operand.value, operand.variance
+    return np.asarray(operand, dtype=float), 0.0
+
+#---------------------------------------------------------------------------------------------------
+
+def _propagate_add(a, va, b, vb):
+    return a + b, va + vb
+
+def _propagate_subtract(a, va, b, vb):
+    return a - b, va + vb
+
+def _propagate_multiply(a, va, b, vb):
+    return a * b, b * b * va + a * a * vb
+
+def _propagate_divide(a, va, b, vb):
+    quot = a / b
+    return quot, (va + quot * quot * vb) / (b * b)
+
+def _propagate_power(a, va, b, vb):
+    powr = a ** b
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dpda = b * a ** (b - 1)
+        dpdb = np.where(vb == 0, 0.0, powr * np.log(np.abs(a)))
+    return powr, dpda * dpda * va + dpdb * dpdb * vb
+
+def _propagate_sqrt(a, va):
+    root = np.sqrt(a)
+    return root, va / (4.0 * a)
+
+def _propagate_exp(a, va):
+    expa = np.exp(a)
+    return expa, expa * expa * va
+
+def _propagate_log(a, va):
+    return np.log(a), va / (a * a)
+
+_BINARY_UFUNCS = {
+    np.add : _propagate_add,
+    np.subtract : _propagate_subtract,
+    np.multiply : _propagate_multiply,
+    np.true_divide : _propagate_divide,
+    np.power : _propagate_power,
+}
+
+_UNARY_UFUNCS = {
+    np.negative : lambda a, va: (-a, va),
+    np.positive : lambda a, va: (+a, va),
+    np.absolute : lambda a, va: (np.abs(a), va),
+    np.sqrt : _propagate_sqrt,
+    np.exp : _propagate_exp,
+    np.log : _propagate_log,
+}
+
+####################################################################################################
+####################################################################################################
+####################################################################################################
+
+class UncertainArray(NDArrayOperatorsMixin):
+    """
+    Value and variance arrays with Gaussian uncertainty propagation.
+
+    Supports the arithmetic operators (+, -, *, /, **), the numpy ufuncs
+    add, subtract, multiply, true_divide, power, negative, positive,
+    absolute, sqrt, exp and log, as well as sums and (weighted) means.
+    All operands are treated as uncorrelated.
+
+    Examples
+    --------
+    >>> A = UncertainArray([10.0, 20.0], error=[1.0, 2.0])
+    >>> y0 = UncertainArray([50.0, 40.0], error=[2.0, 2.0])
+    >>> contrast = A / y0
+    >>> contrast.value, contrast.error
+    (array([0.2, 0.5]), array([0.02154066, 0.0559017 ]))
+    """
+
+    def __init__(self, value, error=None, variance=None):
+        """
+        Initializes an UncertainArray instance
+
+        Parameters
+        ----------
+        value : float, numpy.ndarray
+            nominal values
+        error : float, numpy.ndarray, None
+            standard deviations, broadcastable to the shape of value
+        variance : float, numpy.ndarray, None
+            variances, alternative to error. Zero if neither is given.
+        """
+
+        if error is not None and variance is not None:
+            raise ValueError("Specify either 'error' or 'variance', not both.")
+
+        self.value = np.array(value, dtype=float)
+        if error is not None:
+            variance = np.square(np.asarray(error, dtype=float))
+        elif variance is None:
+            variance = 0.0
+        self.variance = np.array(np.broadcast_to(variance, self.value.shape), dtype=float)
+
+#---------------------------------------------------------------------------------------------------
+
+    @property
+    def error(self):
+        """
+        Standard deviation sqrt(variance)
+        """
+        return np.sqrt(self.variance)
+
+    @property
+    def rel_error(self):
+        """
+        Relative standard deviation |error / value|
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.abs(self.error / self.value)
+
+    @property
+    def shape(self):
+        return self.value.shape
+
+    @property
+    def ndim(self):
+        return self.value.ndim
+
+    @property
+    def size(self):
+        return self.value.size
+
+    def __len__(self):
+        return len(self.value)
+
+    def __getitem__(self, key):
+        return UncertainArray(self.value[key], variance=self.variance[key])
+
+    def __repr__(self):
+        return "UncertainArray(value={!r}, error={!r})".format(self.value, self.error)
+
+#---------------------------------------------------------------------------------------------------
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        """
+        numpy ufunc protocol, propagates the variances of the supported ufuncs
+        """
+
+        if method != "__call__" or kwargs.get("out") is not None:
+            return NotImplemented
+
+        if ufunc in _BINARY_UFUNCS and len(inputs) == 2:
+            (a, va), (b, vb) = _split(inputs[0]), _split(inputs[1])
+            value, variance = _BINARY_UFUNCS[ufunc](a, va, b, vb)
+        elif ufunc in _UNARY_UFUNCS and len(inputs) == 1:
+            value, variance = _UNARY_UFUNCS[ufunc](*_split(inputs[0]))
+        else:
+            return NotImplemented
+
+        return UncertainArray(value, variance=variance)
+
+#---------------------------------------------------------------------------------------------------
+
+    def sum(self, axis=None, dtype=None, out=None, keepdims=False):
+        """
+        Sum of the values along axis, variances add up.
+        """
+
+        if out is not None:
+            raise TypeError("UncertainArray.sum does not support 'out'.")
+        return UncertainArray(self.value.sum(axis=axis, keepdims=keepdims),
+                              variance=self.variance.sum(axis=axis, keepdims=keepdims))
+
+#---------------------------------------------------------------------------------------------------
+
+    def mean(self, axis=None, dtype=None, out=None, keepdims=False):
+        """
+        Unweighted mean of the values along axis.
+        """
+
+        count = self.value.size if axis is None else np.prod([self.value.shape[ax] for ax in np.atleast_1d(axis)])
+        return self.sum(axis=axis, out=out, keepdims=keepdims) / count
+
+#---------------------------------------------------------------------------------------------------
+
+    def weighted_mean(self, axis=None, keepdims=False):
+        """
+        Inverse-variance weighted mean along axis.
+
+        Entries with a NaN value or variance are ignored. The variance of the
+        result is 1 / sum(1 / variance), NaN where no valid entry is left.
+
+        Parameters
+        ----------
+        axis : int, tuple, None
+            axis along which the mean is computed, all axes if None
+        keepdims : bool
+            keep reduced axes with length one
+
+        Return
+        ------
+        mean : UncertainArray
+        """
+
+        valid = ~(np.isnan(self.value) | np.isnan(self.variance))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            weights = np.where(valid, 1.0 / self.variance, 0.0)
+            wsum = weights.sum(axis=axis, keepdims=keepdims)
+            mean = np.where(valid, weights * self.value, 0.0).sum(axis=axis, keepdims=keepdims) / wsum
+            variance = np.where(wsum > 0, 1.0 / wsum, np.nan)
+        return UncertainArray(mean, variance=variance)
+
+#---------------------------------------------------------------------------------------------------
+
+    def reshape(self, *shape):
+        return UncertainArray(self.value.reshape(*shape), variance=self.variance.reshape(*shape))
+
+    @property
+    def T(self):
+        return UncertainArray(self.value.T, variance=self.variance.T)
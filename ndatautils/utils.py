@@ -3,8 +3,9 @@
 import numpy as np
 
 from math import pi, sqrt
-from lmfit import Model
-import matplotlib.pyplot as plt
+
+from .uncertainty import UncertainArray
+from .optimize import batch_levenberg_marquardt
 
 ####################################################################################################
 ####################################################################################################
@@ -15,7 +16,25 @@ def gaussian_function(x, amp, x0, sig, bckg):
     
     """
 
-    return amp * 1.0/sqrt(2 * pi * sig * sig) * np.exp(- 0.5 * ((x - x0)/sig)**2) + bckg
+    return amp * 1.0/np.sqrt(2 * pi * sig * sig) * np.exp(- 0.5 * ((x - x0)/sig)**2) + bckg
+
+#---------------------------------------------------------------------------------------------------
+
+def gaussian_jacobian(x, amp, x0, sig, bckg):
+    """
+    Partial derivatives of `gaussian_function` with respect to
+    (amp, x0, sig, bckg). Broadcasts like `gaussian_function`.
+
+    Return
+    ------
+    jac : np.ndarray
+        derivatives stacked along the last axis, shape (..., len(x), 4)
+    """
+
+    u = (x - x0) / sig
+    norm_gauss = np.exp(-0.5 * u * u) / (sqrt(2 * pi) * sig)
+    gauss = amp * norm_gauss
+    return np.stack(np.broadcast_arrays(norm_gauss, gauss * u / sig, gauss * (u * u - 1) / sig, np.ones_like(gauss)), axis=-1)
 
 #---------------------------------------------------------------------------------------------------
 
@@ -80,6 +99,55 @@ def fast_calc_beam_center(Ixy_data):
 
 #---------------------------------------------------------------------------------------------------
 
+def batch_calc_beam_center(Ixy_stack, widths=False):
+    """
+    Calculates the centers of the beam for a stack of 2D detector images.
+    Same weighting as in `fast_calc_beam_center`, but all images of the
+    stack are treated in one vectorized computation.
+
+    Parameters
+    ----------
+    Ixy_stack : np.ndarray
+        neutron intensity data of shape (N, ..., ny, nx), e.g. (N, 128, 128)
+        or (N, foils, 16, 128, 128). All axes between the first and the last
+        two are summed up.
+    widths : bool
+        if True the standard deviations (square root of the second central
+        moment) of the beam profile along both detector axes are returned
+
+    Return
+    ------
+    centers : np.ndarray
+        array of shape (N, 2) with ('center axis -2', 'center axis -1') per image
+    widths : np.ndarray
+        array of shape (N, 2), only returned if `widths` is True
+
+    Notes
+    -----
+    The stack is reduced to the (N, ny, nx) images in a single pass over the
+    data. Both marginal distributions are computed from these images.
+    """
+
+    Ixy_stack = np.asarray(Ixy_stack)
+    if Ixy_stack.ndim < 3:
+        raise ValueError("A stack of shape (N, ..., ny, nx) is required, got {}.".format(Ixy_stack.shape))
+
+    nimg, ny, nx = Ixy_stack.shape[0], Ixy_stack.shape[-2], Ixy_stack.shape[-1]
+    images = Ixy_stack.reshape(nimg, -1, ny, nx).sum(axis=1, dtype=float)
+
+    marginals = (images.sum(axis=2), images.sum(axis=1))
+    I_tot = marginals[0].sum(axis=1)
+    coords = (np.arange(ny, dtype=float), np.arange(nx, dtype=float))
+
+    centers = np.stack([marg @ coord / I_tot for marg, coord in zip(marginals, coords)], axis=1)
+    if not widths:
+        return centers
+
+    second_moments = np.stack([marg @ coord**2 / I_tot for marg, coord in zip(marginals, coords)], axis=1)
+    return centers, np.sqrt(np.clip(second_moments - centers**2, 0.0, None))
+
+#---------------------------------------------------------------------------------------------------
+
 def fit_beam_center(Ixy_data):
     """
     Calculates the center of a 2D dataset with I(x, y) as
@@ -107,9 +175,10 @@ def fit_beam_center(Ixy_data):
 
     center_vals = []
 
+    from lmfit import Model
+
     gaussian_model = Model(gaussian_function)
     gaussian_model.set_param_hint('amp', min=0)
-    gaussian_model.set_param_hint('x0', min=0, max=128)
     gaussian_model.set_param_hint('sig', min=0)
     gaussian_model.set_param_hint('bckg', min=0)
 
@@ -120,6 +189,7 @@ def fit_beam_center(Ixy_data):
         temp_amp = np.max(fit_data)
         sig_estimate = len(np.where(fit_data > temp_amp/2)[0]) / 2.35
         amp_estimate = temp_amp * sqrt(2*pi) * sig_estimate
+        gaussian_model.set_param_hint('x0', min=0, max=l)
         fit_res = gaussian_model.fit(
                 x=range(l),
                 data=fit_data,
@@ -134,16 +204,306 @@ def fit_beam_center(Ixy_data):
 
 #---------------------------------------------------------------------------------------------------
 
+def batch_fit_beam_center(Ixy_stack, max_iter=100):
+    """
+    Calculates the centers of the beam for a stack of 2D detector images.
+    Fits a 1D gaussian function with background to both marginal
+    distributions of every image, like `fit_beam_center`, but all fits
+    are solved simultaneously without lmfit.
+
+    Parameters
+    ----------
+    Ixy_stack : np.ndarray
+        neutron intensity data of shape (N, ..., ny, nx). All axes between
+        the first and the last two are summed up.
+    max_iter : int
+        maximal number of Levenberg-Marquardt iterations
+
+    Return
+    ------
+    centers : np.ndarray
+        array of shape (N, 2) with ('center axis -2', 'center axis -1') per image
+
+    Notes
+    -----
+    Start values are estimated as in `fit_beam_center`. Parameters are bound
+    to amp >= 0, 0 <= x0 <= length of the axis, sig > 0 and bckg >= 0.
+    """
+
+    Ixy_stack = np.asarray(Ixy_stack)
+    if Ixy_stack.ndim < 3:
+        raise ValueError("A stack of shape (N, ..., ny, nx) is required, got {}.".format(Ixy_stack.shape))
+
+    nimg, ny, nx = Ixy_stack.shape[0], Ixy_stack.shape[-2], Ixy_stack.shape[-1]
+    images = Ixy_stack.reshape(nimg, -1, ny, nx).sum(axis=1, dtype=float)
+
+    centers = np.zeros((nimg, 2))
+    for axis, fit_data in enumerate((images.sum(axis=2), images.sum(axis=1))):
+        length = fit_data.shape[1]
+        temp_amp = fit_data.max(axis=1)
+        sig_estimate = np.maximum(np.count_nonzero(fit_data > temp_amp[:, None] / 2, axis=1) / 2.35, 0.5)
+        p0 = np.stack((temp_amp * sqrt(2 * pi) * sig_estimate,
+                       np.argmax(fit_data, axis=1).astype(float),
+                       sig_estimate,
+                       np.zeros(nimg)), axis=1)
+
+        params, _, _ = batch_levenberg_marquardt(
+                gaussian_function,
+                gaussian_jacobian,
+                np.arange(length, dtype=float),
+                fit_data,
+                p0,
+                lower=np.array([0.0, 0.0, 1e-6, 0.0]),
+                upper=np.array([np.inf, length, np.inf, np.inf]),
+                max_iter=max_iter
+                )
+        centers[:, axis] = params[:, 1]
+
+    return centers
+
+#---------------------------------------------------------------------------------------------------
+
+class StreamingHistogram:
+    """
+    Histogram which accumulates data chunk by chunk in constant memory.
+
+    With fixed bin edges every chunk is sorted into the bins by
+    np.searchsorted/np.bincount. Without edges the histogram is adaptive:
+    nbins equidistant bins span the range of the data seen so far and
+    neighbouring bins are merged pairwise whenever the range has to grow.
+    Partial histograms (e.g. of worker processes) are combined with
+    `merge` or `+`.
+
+    Examples
+    --------
+    >>> hist = StreamingHistogram(nbins=64)
+    >>> for fnum in fnums:
+    ...     fileloader.read_out_data(fnum)
+    ...     hist.add(fileloader.datadict["rawdata"])
+    >>> counts, edges = hist.to_numpy()
+    """
+
+    def __init__(self, bins=None, range=None, nbins=128):
+        """
+        Initializes a StreamingHistogram instance
+
+        Parameters
+        ----------
+        bins : numpy.ndarray, sequence, None
+            monotonically increasing, fixed bin edges. Values outside are
+            counted in self.underflow and self.overflow.
+        range : tuple, None
+            (min, max) initial range of an adaptive histogram. Taken from the
+            first chunk if None. Histograms with the same initial range and
+            nbins can always be merged.
+        nbins : int
+            number of bins of an adaptive histogram, has to be even
+        """
+
+        if bins is not None:
+            self.fixed = True
+            self._edges = np.asarray(bins, dtype=float)
+            if self._edges.ndim != 1 or len(self._edges) < 2 or np.any(np.diff(self._edges) <= 0):
+                raise ValueError("'bins' has to be a monotonically increasing sequence of at least two edges.")
+            self.nbins = len(self._edges) - 1
+        else:
+            if nbins < 2 or nbins % 2:
+                raise ValueError("'nbins' of an adaptive histogram has to be an even number >= 2.")
+            self.fixed = False
+            self._edges = None
+            self.nbins = nbins
+            self.lo, self.width = None, None
+            if range is not None:
+                self._init_range(*range)
+
+        self.counts = np.zeros(self.nbins)
+        self.underflow = 0.0
+        self.overflow = 0.0
+
+#---------------------------------------------------------------------------------------------------
+
+    def _init_range(self, vmin, vmax):
+        """
+        Sets the equidistant bins of an adaptive histogram to span [vmin, vmax].
+        """
+        if vmax <= vmin:
+            vmax = vmin + max(abs(vmin), 1.0)
+        self.lo, self.width = float(vmin), (float(vmax) - float(vmin)) / self.nbins
+
+#---------------------------------------------------------------------------------------------------
+
+    def _grow(self, vmin, vmax):
+        """
+        Doubles the bin width of an adaptive histogram until [vmin, vmax] is covered.
+        """
+        half = self.nbins // 2
+        while vmin < self.lo or vmax > self.lo + self.width * self.nbins:
+            merged = self.counts.reshape(half, 2).sum(axis=1)
+            self.counts = np.zeros(self.nbins)
+            if vmax > self.lo + self.width * self.nbins:
+                self.counts[:half] = merged
+            else:
+                self.counts[half:] = merged
+                self.lo -= self.width * self.nbins
+            self.width *= 2.0
+
+#---------------------------------------------------------------------------------------------------
+
+    @property
+    def edges(self):
+        if self.fixed:
+            return self._edges
+        if self.lo is None:
+            return None
+        return self.lo + self.width * np.arange(self.nbins + 1)
+
+    @property
+    def centers(self):
+        edges = self.edges
+        return 0.5 * (edges[1:] + edges[:-1])
+
+    @property
+    def widths(self):
+        return np.diff(self.edges)
+
+    @property
+    def total(self):
+        return self.counts.sum() + self.underflow + self.overflow
+
+#---------------------------------------------------------------------------------------------------
+
+    def add(self, data, weights=None):
+        """
+        Sorts a chunk of data into the histogram. NaN entries are ignored,
+        +inf and -inf are counted in self.overflow and self.underflow.
+
+        Parameters
+        ----------
+        data : numpy.ndarray
+            data chunk of arbitrary shape
+        weights : numpy.ndarray, None
+            weights of the data points, same shape as data
+
+        Return
+        ------
+        self : StreamingHistogram
+        """
+
+        data = np.asarray(data, dtype=float).ravel()
+        valid = ~np.isnan(data)
+        if weights is not None:
+            weights = np.asarray(weights, dtype=float).ravel()[valid]
+        data = data[valid]
+        if len(data) == 0:
+            return self
+
+        if self.fixed:
+            idx = np.searchsorted(self._edges, data, side="right") - 1
+            idx[data == self._edges[-1]] = self.nbins - 1
+            under, over = idx < 0, idx >= self.nbins
+            inside = ~(under | over)
+            if weights is None:
+                self.underflow += np.count_nonzero(under)
+                self.overflow += np.count_nonzero(over)
+            else:
+                self.underflow += weights[under].sum()
+                self.overflow += weights[over].sum()
+                weights = weights[inside]
+            idx = idx[inside]
+        else:
+            finite = np.isfinite(data)
+            if not finite.all():
+                under, over = data == -np.inf, data == np.inf
+                if weights is None:
+                    self.underflow += np.count_nonzero(under)
+                    self.overflow += np.count_nonzero(over)
+                else:
+                    self.underflow += weights[under].sum()
+                    self.overflow += weights[over].sum()
+                    weights = weights[finite]
+                data = data[finite]
+                if len(data) == 0:
+                    return self
+            vmin, vmax = data.min(), data.max()
+            if self.lo is None:
+                self._init_range(vmin, vmax)
+            self._grow(vmin, vmax)
+            idx = np.minimum(((data - self.lo) / self.width).astype(int), self.nbins - 1)
+
+        self.counts += np.bincount(idx, weights=weights, minlength=self.nbins)
+        return self
+
+#---------------------------------------------------------------------------------------------------
+
+    def merge(self, other):
+        """
+        Adds the counts of another StreamingHistogram to this one.
+
+        Fixed histograms need identical edges. Adaptive histograms need
+        bins that lie within the (possibly grown) bins of this histogram,
+        which is the case if both were created with the same range and nbins.
+
+        Return
+        ------
+        self : StreamingHistogram
+        """
+
+        if self.fixed != other.fixed or self.nbins != other.nbins:
+            raise ValueError("Only histograms of the same kind and number of bins can be merged.")
+
+        if self.fixed:
+            if not np.array_equal(self._edges, other._edges):
+                raise ValueError("Fixed histograms can only be merged with identical bin edges.")
+            self.counts += other.counts
+        elif other.lo is not None:
+            other_edges = other.edges
+            if self.lo is None:
+                self.lo, self.width = other.lo, other.width
+            self._grow(other_edges[0], other_edges[-1])
+            while self.width < other.width * (1 - 1e-9):
+                self._grow(self.lo - self.width, self.lo + self.width * self.nbins)
+
+            first = np.floor((other_edges[:-1] - self.lo) / self.width + 1e-9).astype(int)
+            last = np.ceil((other_edges[1:] - self.lo) / self.width - 1e-9).astype(int) - 1
+            filled = other.counts != 0
+            if np.any(first[filled] != last[filled]):
+                raise ValueError("The bins of the merged histograms are not aligned. Use the same 'range' and 'nbins'.")
+            self.counts += np.bincount(np.clip(first, 0, self.nbins - 1), weights=other.counts, minlength=self.nbins)
+
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        return self
+
+    def __add__(self, other):
+        merged = StreamingHistogram.__new__(StreamingHistogram)
+        merged.__dict__.update({key : np.copy(val) if isinstance(val, np.ndarray) else val for key, val in self.__dict__.items()})
+        return merged.merge(other)
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+#---------------------------------------------------------------------------------------------------
+
+    def to_numpy(self):
+        """
+        Returns (counts, edges) as np.histogram does. Raises a ValueError
+        for an adaptive histogram without range, which has no bins before
+        the first data is added.
+        """
+        if self.edges is None:
+            raise ValueError("The adaptive histogram has no bins yet, add data or pass a 'range'.")
+        return self.counts.copy(), self.edges.copy()
+
+#-----------------------------------------------------------------------------
+
 def quickplotHistogram(histdata, bins=None, output=False):
     """
-    Calculates the center of a beam from a 2D dataset with I(x, y) as
-    input. Simply weighting the array's index by the number of neutron
-    counts acquired in the pixel.
+    Plots a histogram of the data as a bar plot.
 
     Parameters
     ----------
-    histdata: np.ndarray
-        data for histogrammation
+    histdata: np.ndarray, StreamingHistogram
+        data for histogrammation or an already accumulated histogram
     bins: optional, np.ndarray, sequence
         defines bins and boundaries for the histograms data,
         otherwise bins the for min to max of histdata with
@@ -158,20 +518,23 @@ def quickplotHistogram(histdata, bins=None, output=False):
     bin_edges : array of dtype float
         Return the bin edges ``(length(hist)+1)``
 
-
+    Raises
+    ------
+    ValueError
+        for an empty adaptive StreamingHistogram, see `StreamingHistogram.to_numpy´
     """
-    numentries = lambda arr: np.prod(arr.shape)
-    if bins:
+    if isinstance(histdata, StreamingHistogram):
+        hist, bin_edges = histdata.to_numpy()
+    elif bins is not None:
         hist, bin_edges = np.histogram(histdata, bins=bins)
+    elif np.size(histdata) // 1000 > 1:
+        hist, bin_edges = np.histogram(histdata, bins=np.size(histdata) // 1000)
     else:
-        if numentires(histdata) / 1000 > 1:
-            hist, bin_edges = np.histogram(histdata, bins=np.linspace(np.min(histdata), np.max(histdata), numentries(histdata) / 1000, endpoint=True))
-        else:
-            hist, bin_edges = np.histogram(histdata)
-    
-    x = [(b+bin_edges[i+1])/2 for i, b in enumerate(bin_edges[:-1])]
-    width = [(bin_edges[i+1] - b) for i, b in enumerate(bin_edges[:-1])]
-    plt.bar(x, hist, width=width, edgecolor="k", linewidth=1.0)
+        hist, bin_edges = np.histogram(histdata)
+
+    import matplotlib.pyplot as plt
+
+    plt.bar(0.5 * (bin_edges[1:] + bin_edges[:-1]), hist, width=np.diff(bin_edges), edgecolor="k", linewidth=1.0)
     plt.show()
     
     if output:
@@ -208,20 +571,13 @@ def uncertainty_propagation_mult_div(*vals_errs_inv):
                                        )
     (0.5, 0.07071067811865477)
     """
-    vals, errs, inv = [], [], []
-    comb_vals = None
-    sqr_err_sum = 0.0
+    comb = UncertainArray(1.0)
     for v, e, i in vals_errs_inv:
-        if np.any(comb_vals):
-            if i:
-                comb_vals /= v
-            else:
-                comb_vals *= v
+        if i:
+            comb = comb / UncertainArray(v, error=e)
         else:
-            if i:
-                comb_vals = 1./v
-            else:
-                comb_vals = v
-        sqr_err_sum += (e/v)**2
+            comb = comb * UncertainArray(v, error=e)
 
-    return comb_vals, comb_vals * np.sqrt(sqr_err_sum)
\ No newline at end of file
+    if comb.ndim == 0:
+        return float(comb.value), float(comb.error)
+    return comb.value, comb.error
@@ -0,0 +1,49 @@
+""" shared pytest fixtures: synthetic MIEZE cubes and a stand-in file loader serving them """
+import numpy as np
+import pytest
+
+from ndatautils.instrumentloader import InstrumentLoader
+
+CONTRAST = 0.6
+PHASE = 1.3
+
+#-----------------------------------------------------------------------
+
+def make_mieze_cube(seed, contrast=CONTRAST, phase=PHASE, nfoils=8, center=(60.0, 70.0)):
+    """ Poisson distributed (foils, 16, 128, 128) MIEZE signal with a gaussian beam spot """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[:128, :128]
+    beam = 400.0 * np.exp(-0.5 * (((y - center[0]) / 4.0)**2 + ((x - center[1]) / 5.0)**2)) + 0.5
+    modulation = 1.0 + contrast * np.sin(2 * np.pi / 16 * np.arange(16) + phase)
+    return rng.poisson(beam * modulation[:, None, None], size=(nfoils, 16, 128, 128)).astype(np.int32)
+
+class FakeLoader:
+    """ minimal stand-in for a CascadeLoader serving synthetic data """
+
+    def __init__(self, foils=(0, 1, 2, 3), datapath=None):
+        self.instrumentloader = InstrumentLoader(foils=foils)
+        self.datapath = datapath
+        self.datadict = {}
+        self.reads = []
+
+    def read_out_data(self, fnum):
+        self.reads.append(fnum)
+        self.datadict["metadata"] = {"Miscellaneous" : {"echotime_value" : (0.1 * fnum, "ns")},
+                                     "Sample" : {"temperature" : (4.0, "K"), "name" : ("MnSi", "")}}
+        self.datadict["rawdata"] = make_mieze_cube(fnum)
+
+#-----------------------------------------------------------------------
+
+@pytest.fixture(scope="session")
+def mieze_cube():
+    """ make_mieze_cube(seed, contrast, phase, nfoils, center) """
+    return make_mieze_cube
+
+@pytest.fixture(scope="session")
+def fake_loader():
+    """ the FakeLoader class, call it for a loader or derive from it """
+    return FakeLoader
+
+@pytest.fixture
+def loader(fake_loader):
+    return fake_loader()
@@ -1,36 +1,26 @@
-from pprint import pprint
-from sys import path
-#----------------------------------------------------------
-path_ndatautils = "/home/lbeddric/Dokumente/devpython/ndatautils"
-if path_ndatautils  not in path:
-    path.append(path_ndatautils)
-#----------------------------------------------------------
+""" Reading a MIRA '.tof' file with the CascadeLoader, on synthetic data """
 from ndatautils.datapath import DataPath
 from ndatautils.fileloader import CascadeLoader
+from ndatautils.synthetic import write_scan
 #----------------------------------------------------------
 
 instrument = "MIRA"
-root = "/home/lbeddric/Dokumente/Data/MIRAdata"
 propnum = 13524
 ending = ".tof"
 
 #-----------------------------------------------------------------------------
 
-MIRApath = DataPath(instrument, propnum, root, ending)
-print(MIRApath(298077), "\n")
-
-#-----------------------------------------------------------------------------
-
-MIRAloader = CascadeLoader(MIRApath)
-print("MIRAloader initialized!\nRetrieve data now!")
-
-#-----------------------------------------------------------------------------
+def test_MIRA_tof(tmp_path):
+    root = str(tmp_path)
+    scan = write_scan(root, propnum, 1, [298077], echotimes=[0.25], instrument=instrument, ending=ending)
 
-MIRAloader.read_out_data(298077)
-print("Print some of the metadata now:\n")
-pprint(MIRAloader.datadict["metadata"]["Sample and alignment"])
+    MIRApath = DataPath(instrument, propnum, root, ending)
+    assert MIRApath(298077) == scan["paths"][0]
 
-#-----------------------------------------------------------------------------
+    MIRAloader = CascadeLoader(MIRApath)
+    MIRAloader.read_out_data(298077)
+    assert MIRAloader.datadict["metadata"]["Sample and alignment"]["T_value"] == (4.0, "K")
+    assert MIRAloader.datadict["metadata"]["Miscellaneous"]["echotime_value"] == (0.25, "ns")
 
-print("\nShape and total counts of the retrieved rawdata:")
-print(MIRAloader.datadict["rawdata"].shape, MIRAloader.datadict["rawdata"].sum())
+    assert MIRAloader.datadict["rawdata"].shape == (8, 16, 128, 128)
+    assert MIRAloader.datadict["rawdata"].sum() > 0
@@ -1,35 +1,25 @@
-from pprint import pprint
-from sys import path
-#----------------------------------------------------------
-path_ndatautils = "/home/lbeddric/Dokumente/devpython/ndatautils"
-if path_ndatautils  not in path:
-    path.append(path_ndatautils)
-#----------------------------------------------------------
+""" Reading a RESEDA '.pad' file with the CascadeLoader, on synthetic data """
 from ndatautils.datapath import DataPath
 from ndatautils.fileloader import CascadeLoader
+from ndatautils.synthetic import write_scan
 #----------------------------------------------------------
 
 instrument = "RESEDA"
-root = "/home/lbeddric/Dokumente/Data/RESEDAdata"
 propnum = 14891
 ending = ".pad"
-#-----------------------------------------------------------------------------
-
-RESEDApath = DataPath(instrument, propnum, root, ending)
-print(RESEDApath(144052), "\n")
 
 #-----------------------------------------------------------------------------
 
-RESEDAloader = CascadeLoader(RESEDApath)
-print("RESEDAloader initialized!\nRetrieve data now!")
+def test_RESEDA_pad(tmp_path):
+    root = str(tmp_path)
+    scan = write_scan(root, propnum, 4408, [144052], instrument=instrument, ending=ending)
 
-#-----------------------------------------------------------------------------
-
-RESEDAloader.read_out_data(144052)
-print("Print some of the metadata now:\n")
-pprint(RESEDAloader.datadict["metadata"]["Sample and alignment"])
+    RESEDApath = DataPath(instrument, propnum, root, ending)
+    assert RESEDApath(144052) == scan["paths"][0]
 
-#-----------------------------------------------------------------------------
+    RESEDAloader = CascadeLoader(RESEDApath)
+    RESEDAloader.read_out_data(144052)
+    assert RESEDAloader.datadict["metadata"]["Sample and alignment"]["Sample_samplename"] == "synthetic"
 
-print("\nShape and total counts of the retrieved rawdata:")
-print(RESEDAloader.datadict["rawdata"].shape, RESEDAloader.datadict["rawdata"].sum())
+    assert RESEDAloader.datadict["rawdata"].shape == (128, 128)
+    assert RESEDAloader.datadict["rawdata"].sum() > 0
@@ -0,0 +1,43 @@
+""" pytest checks of the ndatautils-reduce command line interface """
+import threading
+
+import numpy as np
+import pytest
+
+from ndatautils.cli import main, parse_fnums
+from ndatautils.miezefitter.dreduction import load_results
+from ndatautils.synthetic import write_scan
+
+CONTRASTS = [0.7, 0.5, 0.3, 0.2]
+
+@pytest.fixture(scope="module")
+def scan_root(tmp_path_factory):
+    root = str(tmp_path_factory.mktemp("data"))
+    write_scan(root, 14891, 4408, [21, 22, 23, 24], echotimes=[0.1, 0.2, 0.4, 0.8], contrast=CONTRASTS)
+    return root
+
+#-----------------------------------------------------------------------
+
+def test_parse_fnums():
+    assert parse_fnums("100-103,110, 120-130:5") == [100, 101, 102, 103, 110, 120, 125, 130]
+
+@pytest.mark.parametrize("options", [["--workers", "1", "--batch", "3"], ["--workers", "1", "--batch", "1"],
+                                     ["--workers", "2"]])
+def test_scan_reduction(scan_root, tmp_path, capsys, options):
+    output = str(tmp_path / "results.txt")
+    threads = threading.active_count()
+    exit_code = main(["reseda", "14891", scan_root, "--scan", "4408", "--lrbt", "58", "71", "56", "73",
+                      "--foils", "0", "1", "2", "3", "--metadata", "T_value=T", "-o", output] + options)
+    assert exit_code == 0
+    assert threading.active_count() == threads
+    assert "4/4 files" in capsys.readouterr().err
+
+    table = load_results(output)
+    np.testing.assert_allclose(table["tau_M"], [0.1, 0.2, 0.4, 0.8])
+    np.testing.assert_allclose(table["T"], 4.0)
+    np.testing.assert_allclose(table["C weighted av."], CONTRASTS, atol=5 * table["C weighted av. err"].max())
+
+def test_bootstrap_rejects_roi(scan_root, capsys):
+    with pytest.raises(SystemExit):
+        main(["RESEDA", "14891", scan_root, "--fnums", "21", "--method", "bootstrap", "--lrbt", "1", "2", "3", "4"])
+    assert "bootstrap" in capsys.readouterr().err
@@ -0,0 +1,35 @@
+""" pytest checks of the lazy imports of ndatautils """
+import subprocess
+import sys
+
+import pytest
+
+#-----------------------------------------------------------------------
+
+def loaded_modules(statement):
+    """ runs statement in a fresh interpreter, returns whether matplotlib and lmfit got imported """
+    code = statement + "; import sys; print('matplotlib' in sys.modules, 'lmfit' in sys.modules)"
+    return subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.split()
+
+@pytest.mark.parametrize("statement", [
+    "import ndatautils",
+    "from ndatautils.datapath import DataPath; from ndatautils.fileloader import CascadeLoader",
+    "from ndatautils.miezefitter.dreduction import Reduction, ReductionStructure",
+    "import ndatautils; ndatautils.masks.Sector_Mask; ndatautils.utils.fit_beam_center",
+])
+def test_no_heavy_imports(statement):
+    assert loaded_modules(statement) == ["False", "False"]
+
+def test_lmfit_loaded_on_demand():
+    statement = "from ndatautils.miezefitter.dreduction import create_model; from ndatautils.utils import sine; create_model(sine, 'lmfit')"
+    assert loaded_modules(statement)[1] == "True"
+
+def test_lazy_attributes():
+    import ndatautils
+    assert ndatautils.fileloader.CascadeLoader.__name__ == "CascadeLoader"
+    assert ndatautils.miezefitter.Reduction is ndatautils.miezefitter.dreduction.Reduction
+    assert "masks" in dir(ndatautils)
+    assert set(ndatautils.__all__) <= set(dir(ndatautils))
+    assert {"sharedstore", "pipeline", "cli"} <= set(ndatautils.__all__)
+    with pytest.raises(AttributeError):
+        ndatautils.not_a_module
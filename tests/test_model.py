@@ -0,0 +1,63 @@
+""" pytest checks of the batched fit engine in ndatautils.miezefitter.model """
+import numpy as np
+import pytest
+
+from ndatautils.miezefitter.model import (Model, exponential_decay, exponential_decay_jacobian, exponential_decay_model,
+                                          numerical_jacobian, sine_jacobian, stretched_exponential_model)
+from ndatautils.utils import sine
+
+TAU = np.linspace(0.05, 3.0, 12)
+
+#-----------------------------------------------------------------------
+
+def test_analytic_jacobians_match_numerical():
+    x = np.arange(16.0)
+    params = [np.array([[3.0], [5.0]]), np.array([[0.4], [0.4]]), np.array([[1.0], [6.0]]), np.array([[10.0], [2.0]])]
+    np.testing.assert_allclose(sine_jacobian(x, *params), numerical_jacobian(sine, x, *params), atol=1e-5)
+    np.testing.assert_allclose(exponential_decay_jacobian(TAU, *params[:2]),
+                               numerical_jacobian(exponential_decay, TAU, *params[:2]), atol=1e-6)
+
+def test_batch_of_decays_with_errors():
+    rng = np.random.default_rng(5)
+    taus = rng.uniform(0.3, 2.0, size=(40, 3))
+    errs = 0.01 * np.ones_like(TAU)
+    data = exponential_decay(TAU, 0.8, taus[..., None]) + rng.normal(0.0, errs, size=taus.shape + TAU.shape)
+
+    result = exponential_decay_model().fit(TAU, data, {"amp" : 1.0, "tau" : 1.0}, weights=1 / errs)
+    assert result["params"]["tau"].shape == (40, 3)
+    assert result["success"].all()
+    pulls = (result["params"]["tau"] - taus) / result["stderr"]["tau"]
+    assert np.abs(pulls).max() < 5
+    assert 0.5 < np.std(pulls) < 1.5
+    assert result["covar"].shape == (40, 3, 2, 2)
+
+def test_matches_lmfit_for_single_decay():
+    lmfit = pytest.importorskip("lmfit")
+    rng = np.random.default_rng(6)
+    data = exponential_decay(TAU, 0.9, 0.7) + rng.normal(0.0, 0.02, size=TAU.shape)
+    reference = lmfit.Model(exponential_decay).fit(data, x=TAU, amp=1.0, tau=1.0, weights=np.full_like(TAU, 50.0))
+
+    result = exponential_decay_model().fit(TAU, data, {"amp" : 1.0, "tau" : 1.0}, weights=50.0)
+    for key in ("amp", "tau"):
+        assert result["params"][key] == pytest.approx(reference.params[key].value, rel=1e-6)
+        assert result["stderr"][key] == pytest.approx(reference.params[key].stderr, rel=1e-3)
+    assert result["redchi"] == pytest.approx(reference.redchi, rel=1e-6)
+
+def test_fixed_parameters_and_per_dataset_bounds():
+    data = np.stack([exponential_decay(TAU, 1.0, 0.5), exponential_decay(TAU, 1.0, 2.0)])
+    model = stretched_exponential_model()
+    result = model.fit(TAU, data, {"amp" : 1.0, "tau" : 1.0}, fixed={"beta" : 1.0},
+                       bounds={"tau" : (np.array([1e-3, 1e-3]), np.array([np.inf, 1.5]))})
+    np.testing.assert_allclose(result["params"]["beta"], 1.0)
+    np.testing.assert_allclose(result["params"]["tau"], [0.5, 1.5], rtol=1e-5)
+    assert np.isnan(result["stderr"]["beta"]).all()
+    assert np.isnan(result["covar"][:, 2]).all()
+
+def test_convergence_mask_and_validation():
+    data = np.stack([exponential_decay(TAU, 1.0, 0.5), exponential_decay(TAU, 1.0, 40.0)])
+    model = Model("decay", exponential_decay, ["amp", "tau"])
+    result = model.fit(TAU, data, {"amp" : 1.0, "tau" : 0.5}, max_iter=3)
+    assert result["converged"].tolist() == [True, False]
+
+    with pytest.raises(ValueError):
+        model.fit(TAU, data, {"amp" : 1.0})
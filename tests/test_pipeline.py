@@ -0,0 +1,108 @@
+""" pytest checks of the streaming reduction in ndatautils.pipeline """
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from ndatautils.masks import Sector_Mask
+from ndatautils.miezefitter.dreduction import ReductionStructure
+from ndatautils.pipeline import load_stage, parallel_map, prefetch, reduce_scan, scan_fnums
+
+#-----------------------------------------------------------------------
+
+class FakeScanLoader:
+    """ stand-in for an ASCIILoader of a '.dat' scan file """
+
+    def read_out_data(self, fnum):
+        self.fnums = [fnum + 1, fnum + 2, fnum + 3]
+
+    def fnums_from_structured_array(self):
+        return self.fnums
+
+#-----------------------------------------------------------------------
+
+def test_scan_records_match_reduction_structure(fake_loader):
+    roi = {"lrbt" : [62, 79, 52, 69]}
+    records = list(reduce_scan(fake_loader(), scan_fnums(FakeScanLoader(), 0), roi=roi, backend="linear",
+                               load_workers=2, fit_workers=2))
+    structure = ReductionStructure(fake_loader(), 1, 2, 3, backend="linear")
+    structure.analyze("simple_fit", roi, {})
+
+    assert [record["fnum"] for record in records] == [1, 2, 3]
+    np.testing.assert_allclose([record["tau_M"] for record in records], structure.params_dict["tau_M"])
+    np.testing.assert_array_equal([record["contrast"] for record in records], structure.contrast)
+    np.testing.assert_array_equal([record["weighted_mean_contrast"] for record in records],
+                                  structure.weighted_mean_contrast)
+
+def test_scan_with_mask_and_bootstrap(loader, fake_loader):
+    mask = Sector_Mask(128, (70, 60), 0, 6, (0, 360), "MIRA")
+    masked = next(reduce_scan(loader, [1], roi={"pre_mask" : mask}, param_keys={"temperature" : "T"}))
+    assert masked["T"] == 4.0
+    assert masked["contrast"][0] == pytest.approx(0.6, abs=0.02)
+    assert loader.reads == [1]
+
+    boot = next(reduce_scan(fake_loader(), [1], red_method="bootstrap", red_params={"steps" : 40, "seed" : 1}))
+    assert boot["contrast"][0] == pytest.approx(0.6, abs=0.02)
+
+def test_prefetch_is_bounded_and_stops():
+    produced = []
+    def source():
+        for idx in range(100):
+            produced.append(idx)
+            yield idx
+
+    threads = threading.active_count()
+    stream = prefetch(source(), depth=3)
+    assert next(stream) == 0
+    time.sleep(0.2)
+    assert len(produced) <= 5
+    stream.close()
+    assert threading.active_count() == threads
+    assert len(produced) <= 6
+
+def test_prefetch_raises_upstream_errors():
+    def source():
+        yield 1
+        raise RuntimeError("broken file")
+    stream = prefetch(source())
+    assert next(stream) == 1
+    with pytest.raises(RuntimeError, match="broken file"):
+        next(stream)
+
+def test_parallel_map_keeps_order_and_bounds_submissions():
+    consumed = []
+    def source():
+        for idx in range(20):
+            consumed.append(idx)
+            yield idx
+    def slow_square(idx):
+        time.sleep(0.02 * (idx % 3))
+        return idx * idx
+
+    results = parallel_map(slow_square, source(), workers=3, depth=4)
+    assert next(results) == 0
+    assert len(consumed) <= 5
+    assert list(results) == [idx * idx for idx in range(1, 20)]
+
+def test_load_stage_reads_ahead_with_prefetch_loader(loader):
+    threads = threading.active_count()
+    stream = load_stage(iter([1, 2, 3, 4]), loader, backend="linear", depth=2)
+    first = next(stream)
+    assert first.filespecifier == 1 and first.fileloader.stats["misses"] == 0
+    assert threading.active_count() == threads + 1
+    assert [redobj.filespecifier for redobj in stream] == [2, 3, 4]
+    assert loader.reads == [1, 2, 3, 4]
+    assert first.fileloader.stats["hits"] + first.fileloader.stats["waits"] == 4
+    assert threading.active_count() == threads
+
+def test_mean_foils_follow_the_foil_selection(fake_loader):
+    six_foils = next(reduce_scan(fake_loader(foils=(0, 1, 2, 3, 4, 5)), [1], roi={"lrbt" : [62, 79, 52, 69]}, backend="linear"))
+    weights = six_foils["contrast_err"]**-2
+    assert six_foils["weighted_mean_contrast"] == pytest.approx((six_foils["contrast"] * weights).sum() / weights.sum())
+
+    loader = fake_loader(foils=(5, 6, 7))
+    loader.instrumentloader.set_Loader_settings(mean_foils=(7, 5))
+    selected = next(reduce_scan(loader, [1], roi={"lrbt" : [62, 79, 52, 69]}, backend="linear"))
+    weights = selected["contrast_err"][[0, 2]]**-2
+    assert selected["weighted_mean_contrast"] == pytest.approx((selected["contrast"][[0, 2]] * weights).sum() / weights.sum())
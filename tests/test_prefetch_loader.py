@@ -0,0 +1,155 @@
+""" pytest checks of ndatautils.fileloader.PrefetchLoader """
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from ndatautils.fileloader import PrefetchLoader
+from ndatautils.miezefitter.dreduction import ReductionStructure
+
+#-----------------------------------------------------------------------
+
+@pytest.fixture
+def slow_loader(fake_loader):
+    class SlowLoader(fake_loader):
+        """ FakeLoader with a read latency, recording the reading threads """
+
+        def __init__(self, delay=0.05, fail=(), **kwargs):
+            super().__init__(**kwargs)
+            self.delay = delay
+            self.fail = fail
+            self.threads = []
+
+        def read_out_data(self, fnum):
+            time.sleep(self.delay)
+            self.threads.append(threading.current_thread().name)
+            if fnum in self.fail:
+                raise IOError("cannot read {}".format(fnum))
+            super().read_out_data(fnum)
+
+    return SlowLoader
+
+@pytest.fixture
+def flaky_loader(fake_loader):
+    class FlakyLoader(fake_loader):
+        """ FakeLoader whose first read fails once release is set """
+
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.release = threading.Event()
+            self.failed = []
+
+        def read_out_data(self, fnum):
+            if not self.failed:
+                self.failed.append(fnum)
+                self.release.wait()
+                raise IOError("cannot read {}".format(fnum))
+            super().read_out_data(fnum)
+
+    return FlakyLoader
+
+def wait_for(condition, timeout=5.0):
+    start = time.perf_counter()
+    while not condition() and time.perf_counter() - start < timeout:
+        time.sleep(0.01)
+    return condition()
+
+#-----------------------------------------------------------------------
+
+def test_sequential_reads_are_prefetched(slow_loader, mieze_cube):
+    loader = slow_loader()
+    with PrefetchLoader(loader, [1, 2, 3, 4], depth=2) as prefetcher:
+        for fnum in (1, 2, 3, 4):
+            prefetcher.read_out_data(fnum)
+            np.testing.assert_array_equal(prefetcher.datadict["rawdata"], mieze_cube(fnum))
+            time.sleep(0.08)
+        stats = prefetcher.stats
+    assert stats["hits"] + stats["waits"] == 4 and stats["misses"] == 0
+    assert stats["hits"] >= 3
+    assert loader.reads == [1, 2, 3, 4]
+    assert threading.current_thread().name not in loader.threads
+
+def test_memory_limit_bounds_depth(slow_loader, mieze_cube):
+    loader = slow_loader(delay=0.0)
+    nbytes = mieze_cube(1).nbytes
+    with PrefetchLoader(loader, range(1, 9), depth=5, max_bytes=int(1.5 * nbytes)) as prefetcher:
+        time.sleep(0.3)
+        assert loader.reads == [1]
+        prefetcher.read_out_data(1)
+        time.sleep(0.3)
+        assert loader.reads == [1, 2]
+
+        prefetcher.max_bytes = 10 * nbytes
+        prefetcher.read_out_data(2)
+        assert wait_for(lambda: len(loader.reads) == 7)
+        time.sleep(0.2)
+        assert loader.reads == [1, 2, 3, 4, 5, 6, 7]
+
+def test_out_of_order_requests_and_errors(slow_loader):
+    loader = slow_loader(delay=0.0, fail=(3,))
+    with PrefetchLoader(loader, [1, 2, 3, 4], depth=4) as prefetcher:
+        assert wait_for(lambda: prefetcher.stats["prefetched"] == 3)
+        prefetcher.read_out_data(2)
+        assert prefetcher.stats["discarded"] == 1
+        prefetcher.read_out_data(9)
+        assert prefetcher.stats["misses"] == 1
+        assert prefetcher.datadict["metadata"]["Miscellaneous"]["echotime_value"][0] == pytest.approx(0.9)
+        with pytest.raises(IOError):
+            prefetcher.read_out_data(3)
+        prefetcher.read_out_data(4)
+        assert prefetcher.stats["hits"] == 2
+
+def test_failed_read_is_repeated_while_waiting(flaky_loader, mieze_cube):
+    loader = flaky_loader()
+    with PrefetchLoader(loader, [1, 2], depth=2) as prefetcher:
+        assert wait_for(lambda: prefetcher._loading == 1)
+        timer = threading.Timer(0.1, loader.release.set)
+        timer.start()
+        prefetcher.read_out_data(1)
+        timer.join()
+        np.testing.assert_array_equal(prefetcher.datadict["rawdata"], mieze_cube(1))
+        assert prefetcher.stats["waits"] == 1 and prefetcher.stats["misses"] == 1
+        assert loader.failed == [1]
+
+def test_close_while_waiting_reads_directly(slow_loader, mieze_cube):
+    loader = slow_loader(delay=0.2)
+    prefetcher = PrefetchLoader(loader, [1, 2], depth=2)
+    assert wait_for(lambda: prefetcher._loading == 1)
+    timer = threading.Timer(0.05, prefetcher.close)
+    timer.start()
+    prefetcher.read_out_data(1)
+    timer.join()
+    np.testing.assert_array_equal(prefetcher.datadict["rawdata"], mieze_cube(1))
+    assert prefetcher.stats["waits"] == 1 and prefetcher.stats["misses"] == 1
+    assert len(prefetcher._ready) == 0 and prefetcher._ready_bytes == 0
+
+def test_structure_with_prefetch_matches_serial(slow_loader, fake_loader):
+    red_params = {"lrbt" : [62, 79, 52, 69]}
+    loader = slow_loader(delay=0.02)
+    streaming = ReductionStructure(loader, 1, 2, 3, backend="linear", retain_data=False, prefetch=2)
+    streaming.analyze("simple_fit", red_params, {})
+    serial = ReductionStructure(fake_loader(), 1, 2, 3, backend="linear")
+    serial.analyze("simple_fit", red_params, {})
+
+    np.testing.assert_array_equal(streaming.contrast, serial.contrast)
+    assert streaming.fileloader.stats["misses"] == 0
+    assert loader.reads == [1, 2, 3]
+
+def test_structure_close_stops_prefetch_thread(slow_loader):
+    threads = threading.active_count()
+    with ReductionStructure(slow_loader(delay=0.0), 1, 2, backend="linear", retain_data=False, prefetch=2) as structure:
+        structure.analyze("simple_fit", {"lrbt" : [62, 79, 52, 69]}, {})
+        assert threading.active_count() == threads + 1
+    assert threading.active_count() == threads
+    structure.red_list[0].require_data()
+    assert structure.fileloader.stats["misses"] == 1
+
+def test_structure_reads_ahead_only_while_reducing(slow_loader):
+    loader = slow_loader(delay=0.02)
+    with ReductionStructure(loader, 1, 2, 3, backend="linear", prefetch=2) as structure:
+        time.sleep(0.1)
+        assert loader.reads == []
+        structure.analyze("simple_fit", {"lrbt" : [62, 79, 52, 69]}, {})
+        assert loader.reads == [1, 2, 3] and structure.fileloader.stats["misses"] == 0
+        assert all(redobj.rawdata is not None for redobj in structure.red_list)
@@ -0,0 +1,91 @@
+""" pytest checks of the opt-in instrumentation in ndatautils.profiling """
+import json
+import os
+
+import numpy as np
+import pytest
+
+from ndatautils import profiling
+from ndatautils.datapath import DataPath
+from ndatautils.fileloader import CascadeLoader
+from ndatautils.masks import Square_Mask
+from ndatautils.miezefitter.dreduction import Reduction
+
+#-----------------------------------------------------------------------
+
+@profiling.timed
+def square(value):
+    return value**2
+
+@profiling.timed("user.allocate")
+def allocate(nbytes):
+    return bytearray(nbytes)
+
+def write_tof(root, fnum, proposal=1):
+    """ writes a small-valued (8, 16, 128, 128) int32 cube followed by a metadata section """
+    fpath = DataPath("RESEDA", proposal, root, ".tof")(fnum)
+    os.makedirs(os.path.dirname(fpath), exist_ok=True)
+    cube = np.random.default_rng(fnum).integers(0, 10, size=(8, 16, 128, 128)).astype(np.int32)
+    with open(fpath, "wb") as wfile:
+        wfile.write(cube.tobytes())
+        wfile.write(b"\n### Miscellaneous\nechotime : 0.5 ns\n")
+    return fpath, cube
+
+#-----------------------------------------------------------------------
+
+def test_disabled_records_nothing():
+    assert not profiling.is_enabled()
+    assert square(3) == 9
+    with profiling.stage("unused") as current:
+        current.add_bytes(10)
+    assert profiling.get_stats() is None
+
+def test_user_stages_nest_and_export(tmp_path):
+    with profiling.profile(memory=True) as stats:
+        with profiling.stage("outer", nbytes=5) as current:
+            current.add_bytes(7)
+            for value in range(3):
+                square(value)
+            allocate(2**20)
+    assert not profiling.is_enabled()
+
+    assert stats["outer"]["calls"] == 1 and stats["outer"]["bytes_read"] == 12
+    assert stats["square"]["calls"] == 3
+    assert stats["outer"]["wall_time"] >= stats["square"]["wall_time"]
+    assert stats["user.allocate"]["peak_memory"] >= 2**20
+    assert stats["outer"]["peak_memory"] >= stats["user.allocate"]["peak_memory"]
+    assert list(stats.query("user.*")) == ["user.allocate"]
+
+    fpath = str(tmp_path / "profile.json")
+    text = stats.to_json(fpath)
+    assert json.loads(text)["stages"]["square"]["calls"] == 3
+    restored = profiling.ProfileStats.from_json(fpath)
+    assert restored["outer"] == stats["outer"]
+
+def test_loader_and_reduction_stages(tmp_path, loader):
+    fpath, cube = write_tof(str(tmp_path), 3)
+    cascade = CascadeLoader(DataPath("RESEDA", 1, str(tmp_path), ".tof"))
+    with profiling.profile() as stats:
+        cascade.read_out_data(3)
+        red = Reduction(loader, 1, backend="linear")
+        red.run_reduction("simple_fit", pre_mask=Square_Mask(128, "MIRA", 62, 17, 52, 17))
+    np.testing.assert_array_equal(cascade.datadict["rawdata"], cube)
+    assert cascade.datadict["metadata"]["Miscellaneous"]["echotime"] == (0.5, "ns")
+
+    size = os.path.getsize(fpath)
+    assert stats["CascadeLoader._meta_data"]["bytes_read"] == size
+    assert stats["CascadeLoader._raw_data"]["bytes_read"] == size // 4 * 4
+    assert stats["DataPath.gen_path"]["calls"] == 2
+    assert stats["Reduction.prepare_fit_data"]["calls"] == 1
+    assert stats["Reduction.mask_sums"]["calls"] == 1
+    assert stats["Reduction.prepare_fit_data"]["peak_memory"] is None
+
+def test_fit_stages_are_recorded(loader):
+    red = Reduction(loader, 1, backend="linear")
+    with profiling.profile() as stats:
+        red.run_reduction("simple_fit", lrbt=[62, 79, 52, 69])
+        red.run_reduction("bootstrap", steps=20, chunk_size=10, seed=0)
+    assert stats["Reduction.fit_preped_data"]["calls"] == 1
+    assert stats["dreduction.batch_sine_fit"]["calls"] >= 2
+    assert 0 < stats["dreduction.batch_sine_fit"]["wall_time"] <= stats["Reduction.run_bootstrap_fit"]["wall_time"] + \
+        stats["Reduction.fit_preped_data"]["wall_time"]
@@ -0,0 +1,310 @@
+""" pytest checks of ndatautils.miezefitter.dreduction on synthetic MIEZE data """
+import os
+
+import numpy as np
+import pytest
+
+from ndatautils.masks import Sector_Mask, Square_Mask, mask_matrix
+from ndatautils.miezefitter.dreduction import Reduction, ReductionStructure, load_results
+from ndatautils.miezefitter.resultcache import ResultCache
+
+CONTRAST = 0.6   # contrast and phase of the cubes served by the conftest loader
+PHASE = 1.3
+
+#-----------------------------------------------------------------------
+
+def test_simple_fit_recovers_contrast(loader):
+    red = Reduction(loader, 1)
+    red.run_reduction("simple_fit", lrbt=[62, 79, 52, 69])
+    assert sorted(red.fit_dict) == [0, 1, 2, 3]
+    for result in red.fit_dict.values():
+        assert result["contrast"] == pytest.approx(CONTRAST, abs=5 * result["contrast_err"])
+        assert 0 < result["contrast_err"] < 0.05
+
+def test_structure_weighted_mean(loader):
+    structure = ReductionStructure(loader, 1, 2)
+    structure.analyze("simple_fit", {"lrbt" : [62, 79, 52, 69]}, {})
+    assert structure.contrast.shape == (2, 4)
+    weights = structure.contrast_err[:, (0, 2, 3)]**-2
+    np.testing.assert_allclose(structure.weighted_mean_contrast,
+                               (structure.contrast[:, (0, 2, 3)] * weights).sum(axis=1) / weights.sum(axis=1))
+    np.testing.assert_allclose(structure.weighted_mean_contrast_err, weights.sum(axis=1)**-0.5)
+
+@pytest.mark.parametrize("backend", ["linear", "native"])
+def test_batched_backend_matches_lmfit(loader, backend):
+    lmfit_red = Reduction(loader, 1)
+    linear_red = Reduction(loader, 1, backend=backend)
+    for red in (lmfit_red, linear_red):
+        red.run_reduction("simple_fit", lrbt=[62, 79, 52, 69])
+    for foil in lmfit_red.relevant_foils:
+        for key in ("contrast", "contrast_err", "phase", "chisqr"):
+            assert linear_red.fit_dict[foil][key] == pytest.approx(lmfit_red.fit_dict[foil][key], rel=1e-3)
+
+def test_pixel_maps(loader):
+    red = Reduction(loader, 1)
+    red.run_reduction("pixel_maps")
+    assert red.map_dict["contrast"].shape == (4, 128, 128)
+    beam = np.s_[:, 58:63, 68:73]
+    np.testing.assert_allclose(red.map_dict["contrast"][beam], CONTRAST, atol=0.1)
+    np.testing.assert_allclose(red.map_dict["phase"][beam], PHASE, atol=0.2)
+
+    red.run_reduction("pixel_maps", tile_size=8)
+    tiled = red.map_dict
+    assert tiled["contrast"].shape == (4, 128, 128)
+    assert np.all(tiled["contrast"][:, 56:64, 64:72] == tiled["contrast"][:, 56:57, 64:65])
+    tile_sum = red.rawdata[0, :, 56:64, 64:72].sum(axis=(1, 2))
+    assert tiled["mean"][0, 56, 64] == pytest.approx(tile_sum.mean(), rel=0.05)
+
+def test_roi_sums_follow_slice_semantics(loader):
+    red = Reduction(loader, 1)
+    rng = np.random.default_rng(4)
+    lrbts = rng.integers(-140, 140, size=(200, 4))
+    lrbts[:50] = np.sort(rng.integers(0, 129, size=(50, 4)), axis=1)[:, [0, 3, 1, 2]]
+    sums = red.roi_sums(lrbts)
+    assert sums.shape == (200, 4, 16)
+    for (left, right, bottom, top), roi_sum in zip(lrbts, sums):
+        np.testing.assert_array_equal(roi_sum, red.rawdata[:, :, bottom:top, left:right].sum(axis=(2, 3)))
+
+    red.prepare_fit_data(lbwh=[60, 50, 10, 12])
+    np.testing.assert_array_equal(red.preped_data, red.rawdata[:, :, 50:62, 60:70].sum(axis=(2, 3)))
+
+@pytest.mark.parametrize("backend", ["linear", "lmfit"])
+def test_bootstrap_reproducible_and_parallel(loader, backend):
+    red = Reduction(loader, 1, backend=backend)
+    red.run_reduction("bootstrap", steps=60, chunk_size=16, seed=7)
+    serial = red.fit_dict[0]["bootstrap"]
+    red.run_reduction("bootstrap", steps=60, chunk_size=16, seed=7, workers=3)
+    parallel = red.fit_dict[0]["bootstrap"]
+
+    assert serial["contrast"] == parallel["contrast"]
+    assert serial["lrbt"] == parallel["lrbt"]
+    assert serial["contrast"] == pytest.approx(CONTRAST, abs=0.01)
+
+    red.run_reduction("bootstrap", steps=60, chunk_size=16, seed=8)
+    assert red.fit_dict[0]["bootstrap"]["contrast"] != serial["contrast"]
+
+def test_adaptive_bootstrap_stops_early(loader, monkeypatch):
+    red = Reduction(loader, 1, backend="linear")
+    summed = []
+    roi_sums = red.roi_sums
+    monkeypatch.setattr(red, "roi_sums", lambda lrbts: summed.append(len(lrbts)) or roi_sums(lrbts))
+    red.run_reduction("bootstrap", steps=2000, chunk_size=50, seed=3, rel_precision=5e-5, min_steps=200)
+    adaptive = red.fit_dict[0]["bootstrap"]
+    assert adaptive["converged"]
+    assert 200 <= adaptive["steps"] < 2000 and adaptive["steps"] % 50 == 0
+    assert adaptive["max_steps"] == 2000
+    assert adaptive["rel_precision"] <= 5e-5
+    assert adaptive["contrast"] == pytest.approx(CONTRAST, abs=0.01)
+    assert sum(summed[:-1]) == adaptive["steps"]
+
+    red.run_reduction("bootstrap", steps=2000, chunk_size=50, seed=3, rel_precision=5e-5, min_steps=200, workers=4)
+    assert red.fit_dict[0]["bootstrap"]["steps"] == adaptive["steps"]
+    assert red.fit_dict[0]["bootstrap"]["contrast"] == adaptive["contrast"]
+
+    red.run_reduction("bootstrap", steps=2000, chunk_size=50, seed=3)
+    assert not red.fit_dict[0]["bootstrap"]["converged"]
+    assert red.fit_dict[0]["bootstrap"]["rel_precision"] < adaptive["rel_precision"]
+
+def test_foil_selection_keeps_single_native_buffer(loader, fake_loader, mieze_cube):
+    red = Reduction(loader, 1)
+    assert red.rawdata.dtype == np.int32
+    assert red.rawdata.shape == (4, 16, 128, 128)
+    assert "rawdata" not in loader.datadict
+    np.testing.assert_array_equal(red.rawdata, mieze_cube(1)[[0, 1, 2, 3]])
+
+    all_foils = Reduction(fake_loader(foils=tuple(range(8))), 1)
+    assert all_foils.rawdata.shape == (8, 16, 128, 128)
+
+def test_structure_parallel_matches_serial(loader, fake_loader):
+    red_params = {"lrbt" : [62, 79, 52, 69]}
+    serial = ReductionStructure(loader, 1, 2, 3, backend="linear")
+    serial.analyze("simple_fit", red_params, {})
+    parallel = ReductionStructure(fake_loader(), 1, 2, 3, backend="linear", workers=2)
+    assert all(redobj.rawdata is None for redobj in parallel.red_list)
+    parallel.analyze("simple_fit", red_params, {})
+
+    np.testing.assert_array_equal(parallel.contrast, serial.contrast)
+    np.testing.assert_array_equal(parallel.weighted_mean_contrast, serial.weighted_mean_contrast)
+    np.testing.assert_allclose(parallel.params_dict["tau_M"], [0.1, 0.2, 0.3])
+
+def test_streaming_structure_releases_raw_data(loader, fake_loader):
+    red_params = {"lrbt" : [62, 79, 52, 69]}
+    streaming = ReductionStructure(loader, 1, 2, backend="linear", retain_data=False)
+    assert all(redobj.rawdata is None for redobj in streaming.red_list)
+    streaming.analyze("simple_fit", red_params, {"temperature" : "T"})
+    assert all(redobj.rawdata is None and redobj.integral_image is None for redobj in streaming.red_list)
+    assert all(redobj.fit_dict is not None for redobj in streaming.red_list)
+    assert streaming.red_list[1].metadata == {"Miscellaneous" : {"echotime_value" : (0.2, "ns")},
+                                              "Sample" : {"temperature" : (4.0, "K")}}
+    assert streaming.params_dict["T"] == 4.0 and loader.reads == [1, 2]
+
+    retained = ReductionStructure(fake_loader(), 1, 2, backend="linear")
+    retained.analyze("simple_fit", red_params, {"temperature" : "T"})
+    np.testing.assert_array_equal(streaming.contrast, retained.contrast)
+    assert "name" in retained.red_list[1].metadata["Sample"]
+
+    redobj = streaming.red_list[0]
+    redobj.prepare_fit_data(lrbt=[62, 79, 52, 69])
+    assert redobj.rawdata is not None
+
+def test_params_collected_without_second_read(loader, fake_loader):
+    structure = ReductionStructure(loader, 1, 2, 3, backend="linear", retain_data=False)
+    structure.analyze("simple_fit", {"lrbt" : [62, 79, 52, 69]}, {"temperature" : "T", "name" : "sample", "missing" : "m"})
+    assert loader.reads == [1, 2, 3]
+    np.testing.assert_allclose(structure.params_dict["tau_M"], [0.1, 0.2, 0.3])
+    assert structure.params_dict["T"] == 4.0
+    assert structure.params_dict["sample"] == 0.0
+    assert "m" not in structure.params_dict
+
+    lazy = ReductionStructure(fake_loader(), 4, 5, workers=2)
+    assert lazy.get_params(echotime_value="tau_M")["tau_M"] == pytest.approx([0.4, 0.5])
+
+@pytest.mark.parametrize("fname", ["results.txt", "results.npz", "results.npy"])
+def test_result_export_roundtrip(loader, tmp_path, fname):
+    structure = ReductionStructure(loader, 1, 2, backend="linear")
+    structure.analyze("simple_fit", {"lrbt" : [62, 79, 52, 69]}, {"temperature" : "T"})
+    fpath = str(tmp_path / fname)
+    structure.to_file(fpath)
+    structure.to_file(fpath, append=True)
+
+    table = load_results(fpath)
+    assert table.dtype.names[:4] == ("T", "tau_M", "C weighted av.", "C weighted av. err")
+    assert table.dtype.names[-2:] == ("C foil 4", "C err foil 4")
+    assert len(table) == 4
+    atol = 1e-14 if fname.endswith(".txt") else 0.0
+    np.testing.assert_allclose(table["tau_M"], [0.1, 0.2, 0.1, 0.2], atol=atol)
+    np.testing.assert_allclose(table["T"], 4.0)
+    np.testing.assert_allclose(table["C err foil 3"][:2], structure.contrast_err[:, 2], atol=atol)
+    np.testing.assert_allclose(table["C weighted av."][2:], structure.weighted_mean_contrast, atol=atol)
+
+def test_result_export_text_layout(loader, tmp_path):
+    structure = ReductionStructure(loader, 1, backend="linear")
+    structure.analyze("simple_fit", {"lrbt" : [62, 79, 52, 69]}, {})
+    fpath = tmp_path / "results.dat"
+    structure.to_file(str(fpath))
+    header, row = fpath.read_text().splitlines()
+    assert header.startswith("### tau_M           , C weighted av.      , C weighted av. err  , C foil 1")
+    assert row.startswith(f"{0.1:<20.15f}, ")
+
+    structure.params_dict["T"] = 4.0
+    with pytest.raises(ValueError):
+        structure.to_file(str(fpath), append=True)
+
+def test_superimposed_fit_shares_contrast(loader):
+    red = Reduction(loader, 1)
+    red.run_reduction("superimposed_fitting", lrbt=[62, 79, 52, 69])
+    joint = red.fit_dict
+    assert len({result["contrast"] for result in joint.values()}) == 1
+    assert joint[0]["contrast"] == pytest.approx(CONTRAST, abs=5 * joint[0]["contrast_err"])
+    for result in joint.values():
+        assert result["success"] and result["phase"] == pytest.approx(PHASE, abs=0.05)
+
+    red.run_reduction("simple_fit", lrbt=[62, 79, 52, 69])
+    single_errs = np.array([result["contrast_err"] for result in red.fit_dict.values()])
+    assert joint[0]["contrast_err"] < single_errs.min()
+    assert joint[0]["contrast_err"] == pytest.approx((single_errs**-2).sum()**-0.5, rel=0.25)
+
+def test_superimposed_structure_batches_files(loader, fake_loader):
+    red_params = {"lrbt" : [62, 79, 52, 69]}
+    structure = ReductionStructure(loader, 1, 2, 3, retain_data=False)
+    structure.analyze("superimposed_fitting", red_params, {})
+    assert all(redobj.rawdata is None for redobj in structure.red_list)
+    np.testing.assert_array_equal(structure.weighted_mean_contrast, structure.contrast[:, 0])
+    np.testing.assert_array_equal(structure.weighted_mean_contrast_err, structure.contrast_err[:, 0])
+
+    for fnum, redobj in zip((1, 2, 3), structure.red_list):
+        single = Reduction(fake_loader(), fnum)
+        single.run_reduction("superimposed_fitting", **red_params)
+        for foil in single.relevant_foils:
+            for key in ("contrast", "contrast_err", "phase"):
+                assert redobj.fit_dict[foil][key] == pytest.approx(single.fit_dict[foil][key], rel=1e-8)
+
+def test_mask_sums_match_direct_sums(loader):
+    red = Reduction(loader, 1)
+    sectors = [Sector_Mask(128, (70, 60), r_i, r_i + 6, (a, a + 90), "MIRA") for r_i in (0, 4) for a in (0, 180)]
+    square = Square_Mask(128, "MIRA", 55, 10, 60, 12)
+    weighted = np.random.default_rng(2).random((128, 128))
+
+    for mask in sectors + [square]:
+        sums = red.mask_sums(mask)
+        assert sums.dtype.kind == "i"
+        np.testing.assert_array_equal(sums, (red.rawdata * mask.getMask()).sum(axis=(2, 3)))
+    np.testing.assert_allclose(red.mask_sums(weighted), (red.rawdata * weighted).sum(axis=(2, 3)))
+
+    stacked = red.mask_sums(mask_matrix(sectors))
+    assert stacked.shape == (4, 4, 16)
+    np.testing.assert_allclose(stacked, [red.mask_sums(mask) for mask in sectors])
+    np.testing.assert_allclose(red.mask_sums(np.stack([m.getMask() for m in sectors])), stacked)
+
+def test_simple_fit_with_mask(loader):
+    red = Reduction(loader, 1, backend="linear")
+    rect = np.zeros((128, 128), dtype=bool)
+    rect[52:69, 62:79] = True
+    red.run_reduction("simple_fit", pre_mask=rect)
+    masked = red.fit_dict
+    red.run_reduction("simple_fit", lrbt=[62, 79, 52, 69])
+    assert masked[0]["contrast"] == red.fit_dict[0]["contrast"]
+
+    red.run_reduction("simple_fit", pre_mask=Sector_Mask(128, (70, 60), 0, 6, (0, 360), "MIRA"))
+    assert red.fit_dict[0]["contrast"] == pytest.approx(CONTRAST, abs=0.02)
+    with pytest.raises(ValueError):
+        red.prepare_fit_data(lrbt=[62, 79, 52, 69], pre_mask=rect)
+
+@pytest.fixture
+def scan_files(tmp_path):
+    """ empty stand-in files of a scan, such that the cache can identify them by path """
+    def path(fnum):
+        fpath = tmp_path / "{:08d}.tof".format(fnum)
+        if not fpath.exists():
+            fpath.write_bytes(b"%d" % fnum)
+        return str(fpath)
+    return path
+
+def test_cache_only_fits_new_files(tmp_path, scan_files, fake_loader):
+    red_params = {"lrbt" : [62, 79, 52, 69]}
+    cache = ResultCache(str(tmp_path / "cache"))
+    first = ReductionStructure(fake_loader(datapath=scan_files), 1, 2, 3, backend="linear", cache=cache)
+    first.analyze("simple_fit", red_params, {})
+    assert first.fileloader.reads == [1, 2, 3]
+
+    loader = fake_loader(datapath=scan_files)
+    second = ReductionStructure(loader, 1, 2, 3, 4, backend="linear", cache=str(tmp_path / "cache"))
+    second.analyze("simple_fit", red_params, {})
+    assert loader.reads == [4]
+    np.testing.assert_array_equal(second.contrast[:3], first.contrast)
+    np.testing.assert_allclose(second.params_dict["tau_M"], [0.1, 0.2, 0.3, 0.4])
+
+    loader.reads.clear()
+    second.analyze("simple_fit", {"lrbt" : [61, 79, 52, 69]}, {})
+    assert loader.reads == [1, 2, 3]
+    second.analyze("superimposed_fitting", red_params, {})
+    hits = second.cache.hits
+    second.analyze("superimposed_fitting", red_params, {})
+    assert second.cache.hits == hits + 4
+    assert second.red_list[2].fit_dict[1]["superimposed"]
+
+def test_cache_key_respects_file_and_seed(tmp_path, scan_files, fake_loader):
+    cache = ResultCache(str(tmp_path / "cache"))
+    red = Reduction(fake_loader(datapath=scan_files), 1, backend="linear", cache=cache)
+    key = red.cache_key("bootstrap", {"steps" : 20, "seed" : 1, "workers" : 1})
+    assert key == red.cache_key("bootstrap", {"steps" : 20, "seed" : 1, "workers" : 4})
+    assert key != red.cache_key("bootstrap", {"steps" : 20, "seed" : 2})
+    assert red.cache_key("bootstrap", {"steps" : 20}) is None
+    assert red.cache_key("bootstrap", {"steps" : 20, "seed" : np.random.default_rng(1)}) is None
+
+    os.utime(scan_files(1), ns=(0, 0))
+    assert red.cache_key("bootstrap", {"steps" : 20, "seed" : 1}) != key
+
+    nopath = Reduction(fake_loader(), 1, load=False)
+    assert nopath.cache_key("simple_fit", {}, load=False) is None
+    assert nopath.cache_key("simple_fit", {}) == Reduction(fake_loader(), 1).cache_key("simple_fit", {})
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_size=3000)
+    for idx in range(3):
+        cache.put("k{}".format(idx), np.zeros(100))
+        os.utime(os.path.join(cache.directory, "k{}.pkl".format(idx)), ns=(idx * 10**9, idx * 10**9))
+    assert cache.get("k0") is not None
+    cache.put("k3", np.zeros(100))
+    assert cache.size() <= 3000
+    assert cache.get("k1") is None and cache.get("k0") is not None and cache.get("k3") is not None
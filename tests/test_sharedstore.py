@@ -0,0 +1,96 @@
+""" pytest checks of the shared-memory detector cubes in ndatautils.sharedstore """
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pytest
+
+from ndatautils.datapath import DataPath
+from ndatautils.fileloader import CascadeLoader
+from ndatautils.instrumentloader import RESEDALoader
+from ndatautils.miezefitter.dreduction import Reduction, ReductionStructure
+from ndatautils.sharedstore import SharedArrayStore, attach, detach
+from ndatautils.synthetic import write_scan
+
+FOILS = (0, 1, 2, 3)
+LRBT = [58, 71, 56, 73]
+
+#-----------------------------------------------------------------------
+
+def block_sum(handle):
+    cube = attach(handle)
+    try:
+        return int(cube.sum(dtype=np.int64))
+    finally:
+        del cube
+        detach(handle)
+
+def crash(handle):
+    attach(handle)
+    os._exit(1)
+
+def shm_blocks(prefix):
+    return [name for name in os.listdir("/dev/shm") if name.startswith(prefix)] if os.path.isdir("/dev/shm") else []
+
+@pytest.fixture(scope="module")
+def scan_root(tmp_path_factory):
+    root = str(tmp_path_factory.mktemp("shared"))
+    write_scan(root, 14891, 1, [1, 2, 3], contrast=[0.7, 0.5, 0.3])
+    return root
+
+def loader(root):
+    return CascadeLoader(DataPath("RESEDA", 14891, root, ".tof"), RESEDALoader("TOF", foils=FOILS))
+
+#-----------------------------------------------------------------------
+
+def test_read_rawdata_into_matches_loader(scan_root):
+    fileloader = loader(scan_root)
+    fileloader.read_out_data(2)
+    expected = fileloader.datadict["rawdata"]
+    with SharedArrayStore() as store:
+        handle, cube = store.load_cube(fileloader, 2)
+        np.testing.assert_array_equal(cube, expected)
+        handle, cube = store.load_cube(fileloader, 2, foils=(1, 3))
+        np.testing.assert_array_equal(cube, expected[[1, 3]])
+        assert len(store) == 2 and store.nbytes == 10 * 16 * 128 * 128 * 4
+        del cube
+
+def test_workers_attach_and_crash_cleanup():
+    with SharedArrayStore() as store:
+        handle, array = store.from_array(np.arange(1000, dtype=np.int32))
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            assert pool.submit(block_sum, handle).result() == 499500
+        with pytest.raises(BrokenProcessPool):
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                pool.submit(crash, handle).result()
+        array[0] = 7
+        assert attach(handle)[0] == 7
+        detach(handle)
+        del array
+    assert len(store) == 0
+    assert shm_blocks(store.prefix) == []
+
+def test_pickled_reduction_carries_handle(scan_root):
+    with SharedArrayStore() as store:
+        redobj = Reduction(loader(scan_root), 1, backend="linear", load=False)
+        redobj.load_shared(store)
+        payload = pickle.dumps(redobj)
+        assert len(payload) < redobj.rawdata.nbytes // 100
+        clone = pickle.loads(payload)
+        np.testing.assert_array_equal(clone.rawdata, redobj.rawdata)
+        clone.release_data()
+        redobj.release_data()
+
+def test_shared_structure_matches_serial(scan_root):
+    serial = ReductionStructure(loader(scan_root), 1, 2, 3, backend="linear")
+    serial.analyze("simple_fit", {"lrbt" : LRBT}, {"T_value" : "T"})
+    done = []
+    shared = ReductionStructure(loader(scan_root), 1, 2, 3, backend="linear", workers=2, shared_memory=True,
+                                progress=lambda count, total: done.append(count))
+    shared.analyze("simple_fit", {"lrbt" : LRBT}, {"T_value" : "T"})
+    np.testing.assert_allclose(shared.weighted_mean_contrast, serial.weighted_mean_contrast)
+    np.testing.assert_allclose(shared.params_dict["T"], serial.params_dict["T"])
+    assert done[-1] == 3
+    assert all(redobj.rawdata is None and redobj.shared is None for redobj in shared.red_list)
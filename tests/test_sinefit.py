@@ -0,0 +1,50 @@
+""" pytest checks of the closed-form sine fit in ndatautils.miezefitter.sinefit """
+import numpy as np
+import pytest
+
+from ndatautils.miezefitter.dreduction import create_model
+from ndatautils.miezefitter.sinefit import fit_sine_linear, split_results
+from ndatautils.utils import sine
+
+X = np.arange(16)
+OMEGA = 2 * np.pi / 16
+
+#-----------------------------------------------------------------------
+
+def test_exact_sine_recovered_for_batch():
+    amps = np.array([[10.0, 50.0], [5.0, 80.0]])
+    phis = np.array([[0.3, 2.0], [4.0, 6.1]])
+    offsets = np.array([[100.0, 120.0], [40.0, 200.0]])
+    data = sine(X, amps[..., None], OMEGA, phis[..., None], offsets[..., None])
+
+    result = fit_sine_linear(X, data, np.ones_like(data))
+    assert result["contrast"].shape == (2, 2)
+    np.testing.assert_allclose(result["raw_fit_vals"]["A"], amps)
+    np.testing.assert_allclose(result["phase"], phis)
+    np.testing.assert_allclose(result["contrast"], amps / offsets)
+    np.testing.assert_allclose(result["chisqr"], 0.0, atol=1e-16)
+    assert result["success"].all()
+
+def test_matches_lmfit_backend():
+    rng = np.random.default_rng(3)
+    data = rng.poisson(sine(X, 300.0, OMEGA, np.array([[0.5], [3.0], [5.5]]), 1000.0)).astype(float)
+    weights = np.sqrt(data)**-1
+
+    batched = split_results(fit_sine_linear(X, data, weights))
+    model = create_model(sine, "lmfit")
+    for resdict, preped, weight in zip(batched, data, weights):
+        reference = model.fit(x=X, data=preped, weights=weight, A=250.0, phi=resdict["phase"], y0=900.0)
+        assert resdict["raw_fit_vals"]["A"] == pytest.approx(reference.params["A"].value, rel=1e-6)
+        assert resdict["phase"] == pytest.approx(reference.params["phi"].value, rel=1e-6)
+        assert resdict["raw_fit_errs"]["A"] == pytest.approx(reference.params["A"].stderr, rel=1e-3)
+        assert resdict["phase_err"] == pytest.approx(reference.params["phi"].stderr, rel=1e-3)
+        assert resdict["chisqr"] == pytest.approx(reference.chisqr, rel=1e-6)
+        assert resdict["redchi"] == pytest.approx(reference.redchi, rel=1e-6)
+
+def test_degenerate_data_flagged():
+    data = np.zeros((2, 16))
+    data[1] = 50.0 + 10 * np.sin(OMEGA * X)
+    result = fit_sine_linear(X, data, np.sqrt(data)**-1)
+    np.testing.assert_array_equal(result["success"], [False, True])
+    assert np.isnan(result["contrast"][0])
+    assert result["contrast"][1] == pytest.approx(0.2)
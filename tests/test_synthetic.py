@@ -0,0 +1,45 @@
+""" pytest checks of the synthetic NICOS/CASCADE files in ndatautils.synthetic """
+import numpy as np
+
+from ndatautils.datapath import CustomDataPath, DataPath
+from ndatautils.fileloader import ASCIILoader, CascadeLoader
+from ndatautils.instrumentloader import RESEDALoader
+from ndatautils.miezefitter.dreduction import ReductionStructure
+from ndatautils.synthetic import mieze_counts, write_cascade_file, write_scan
+
+FOILS = (0, 1, 2, 3)
+
+#-----------------------------------------------------------------------
+
+def test_scan_roundtrip_recovers_contrast(tmp_path):
+    root = str(tmp_path)
+    contrasts = [0.7, 0.5, 0.3]
+    scan = write_scan(root, 14891, 4408, [11, 12, 13], echotimes=[0.1, 0.5, 1.0], contrast=contrasts)
+
+    scanloader = ASCIILoader(DataPath("RESEDA", 14891, root, ".dat"), RESEDALoader("DAT"))
+    scanloader.read_out_data(4408)
+    assert scanloader.fnums_from_structured_array() == scan["fnums"]
+    np.testing.assert_allclose(scanloader.datadict["rawdata"]["echotime"], [0.1, 0.5, 1.0])
+
+    fileloader = CascadeLoader(DataPath("RESEDA", 14891, root, ".tof"), RESEDALoader("TOF", foils=FOILS))
+    structure = ReductionStructure(fileloader, *scan["fnums"], backend="linear")
+    structure.analyze("simple_fit", {"lrbt" : [58, 71, 56, 73]}, {"T_value" : "T"})
+    np.testing.assert_allclose(structure.weighted_mean_contrast, contrasts,
+                               atol=5 * structure.weighted_mean_contrast_err.max())
+    np.testing.assert_allclose(structure.params_dict["tau_M"], [0.1, 0.5, 1.0])
+
+def test_same_seed_same_counts(tmp_path):
+    first = write_scan(str(tmp_path / "a"), 1, 1, [1, 2], seed=5)
+    second = write_scan(str(tmp_path / "b"), 1, 1, [1, 2], seed=5)
+    for path_a, path_b in zip(first["paths"], second["paths"]):
+        assert open(path_a, "rb").read() == open(path_b, "rb").read()
+    assert open(first["paths"][0], "rb").read() != open(first["paths"][1], "rb").read()
+
+def test_undecodable_first_line(tmp_path):
+    """ the metadata parser skips binary lines, also before the first decodable line """
+    counts = mieze_counts(seed=1, nfoils=1, ntbins=1)[0, 0]
+    counts[0, 0] = 0xFF
+    fpath = str(tmp_path / "00000001.pad")
+    write_cascade_file(fpath, counts, {"Miscellaneous" : {"echotime_value" : (0.5, "ns")}})
+    loader = CascadeLoader(CustomDataPath(fpath))
+    assert loader._meta_data(fpath) == {"Miscellaneous" : {"echotime_value" : (0.5, "ns")}}
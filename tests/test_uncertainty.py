@@ -0,0 +1,60 @@
+""" pytest checks of ndatautils.uncertainty.UncertainArray """
+import numpy as np
+import pytest
+
+from ndatautils.uncertainty import UncertainArray
+from ndatautils.utils import uncertainty_propagation_mult_div
+
+#-----------------------------------------------------------------------
+
+def test_arithmetic_propagation():
+    a = UncertainArray([10.0, 20.0], error=[1.0, 2.0])
+    b = UncertainArray([50.0, 40.0], error=[2.0, 2.0])
+
+    np.testing.assert_allclose((a + b).error, np.hypot(a.error, b.error))
+    np.testing.assert_allclose((a - b).value, [-40.0, -20.0])
+    np.testing.assert_allclose((a - b).error, np.hypot(a.error, b.error))
+    np.testing.assert_allclose((a * b).error, (a * b).value * np.hypot(a.error / a.value, b.error / b.value))
+    np.testing.assert_allclose((a / b).value, [0.2, 0.5])
+    np.testing.assert_allclose((a / b).error, [0.2 * np.hypot(0.1, 0.04), 0.5 * np.hypot(0.1, 0.05)])
+    np.testing.assert_allclose((-a).error, a.error)
+    np.testing.assert_allclose((a ** 2).error, 2 * a.value * a.error)
+    np.testing.assert_allclose(np.sqrt(a).error, 0.5 * a.error / np.sqrt(a.value))
+
+def test_exact_operands_and_broadcasting():
+    a = UncertainArray(np.ones((3, 2)), error=0.1)
+    scaled = 2.0 * a / np.array([1.0, 4.0])
+    assert isinstance(scaled, UncertainArray)
+    np.testing.assert_allclose(scaled.value, np.tile([2.0, 0.5], (3, 1)))
+    np.testing.assert_allclose(scaled.error, np.tile([0.2, 0.05], (3, 1)))
+
+def test_sum_and_weighted_mean():
+    vals = UncertainArray([[1.0, 2.0, np.nan], [3.0, 3.0, 5.0]], error=[[1.0, 1.0, 1.0], [1.0, 2.0, np.nan]])
+    np.testing.assert_allclose(vals[1, :2].sum().error, np.sqrt(5.0))
+    np.testing.assert_allclose(np.sum(vals[1, :2]).value, 6.0)
+
+    mean = vals.weighted_mean(axis=1)
+    np.testing.assert_allclose(mean.value, [1.5, 3.0])
+    np.testing.assert_allclose(mean.error, [np.sqrt(0.5), np.sqrt(0.8)])
+
+def test_weighted_mean_without_valid_entries():
+    mean = UncertainArray([np.nan, np.nan], error=[1.0, 1.0]).weighted_mean()
+    assert np.isnan(mean.value) and np.isnan(mean.error)
+
+def test_error_and_variance_exclusive():
+    with pytest.raises(ValueError):
+        UncertainArray(1.0, error=1.0, variance=1.0)
+
+#-----------------------------------------------------------------------
+
+def test_mult_div_example():
+    comb, comb_err = uncertainty_propagation_mult_div((1, 0.1, False), (2, 0.2, True))
+    assert comb == pytest.approx(0.5)
+    assert comb_err == pytest.approx(0.07071067811865477)
+
+def test_mult_div_does_not_alias_inputs():
+    values = np.array([2.0, 4.0])
+    comb, comb_err = uncertainty_propagation_mult_div((values, 0.1 * values, False), (2.0, 0.0, True))
+    np.testing.assert_allclose(values, [2.0, 4.0])
+    np.testing.assert_allclose(comb, [1.0, 2.0])
+    np.testing.assert_allclose(comb_err, [0.1, 0.2])
@@ -0,0 +1,75 @@
+""" pytest checks of ndatautils.utils.StreamingHistogram """
+import numpy as np
+import pytest
+
+from ndatautils.utils import StreamingHistogram, quickplotHistogram
+
+#-----------------------------------------------------------------------
+
+def test_fixed_edges_match_numpy():
+    rng = np.random.default_rng(1)
+    data = rng.poisson(20.0, size=(8, 16, 32))
+    edges = np.linspace(5, 35, 31)
+
+    hist = StreamingHistogram(bins=edges)
+    for chunk in data:
+        hist.add(chunk)
+
+    counts, _ = np.histogram(data, bins=edges)
+    np.testing.assert_array_equal(hist.counts, counts)
+    assert hist.underflow == np.count_nonzero(data < 5)
+    assert hist.overflow == np.count_nonzero(data > 35)
+    assert hist.total == data.size
+
+def test_adaptive_range_grows_without_losing_counts():
+    hist = StreamingHistogram(range=(0.0, 8.0), nbins=8)
+    hist.add(np.arange(8) + 0.5)
+    hist.add([20.0, -3.0])
+
+    assert hist.total == 10
+    np.testing.assert_allclose(hist.edges[[0, -1]], (-32.0, 32.0))
+    np.testing.assert_array_equal(hist.counts, [0, 0, 0, 1, 8, 0, 1, 0])
+
+def test_adaptive_range_from_first_chunk():
+    hist = StreamingHistogram(nbins=4)
+    hist.add([1.0, 2.0, 3.0, 5.0])
+    np.testing.assert_allclose(hist.edges, [1.0, 2.0, 3.0, 4.0, 5.0])
+    np.testing.assert_array_equal(hist.counts, [1, 1, 1, 1])
+
+def test_merge_partial_histograms():
+    rng = np.random.default_rng(2)
+    chunks = [rng.normal(loc, 1.0, 1000) for loc in (0.0, 5.0, -7.0)]
+
+    partials = [StreamingHistogram(range=(-1.0, 1.0), nbins=16).add(chunk) for chunk in chunks]
+    merged = partials[0] + partials[1] + partials[2]
+    serial = StreamingHistogram(range=(-1.0, 1.0), nbins=16)
+    for chunk in chunks:
+        serial.add(chunk)
+
+    np.testing.assert_allclose(merged.edges, serial.edges)
+    np.testing.assert_array_equal(merged.counts, serial.counts)
+    assert partials[0].total == 1000
+
+def test_merge_requires_identical_fixed_edges():
+    with pytest.raises(ValueError):
+        StreamingHistogram(bins=[0, 1, 2]).merge(StreamingHistogram(bins=[0, 1, 3]))
+
+def test_empty_adaptive_histogram_has_no_bins():
+    hist = StreamingHistogram(nbins=4)
+    with pytest.raises(ValueError, match="no bins"):
+        hist.to_numpy()
+    with pytest.raises(ValueError, match="no bins"):
+        quickplotHistogram(hist)
+    counts, edges = StreamingHistogram(range=(0.0, 4.0), nbins=4).to_numpy()
+    assert counts.sum() == 0 and len(edges) == 5
+
+def test_infinite_values_go_to_under_and_overflow():
+    hist = StreamingHistogram(nbins=8)
+    hist.add([1.0, np.inf, np.nan])
+    hist.add([-np.inf, 2.0], weights=[2.0, 1.0])
+    assert (hist.underflow, hist.overflow, hist.counts.sum()) == (2.0, 1, 2.0)
+    assert np.all(np.isfinite(hist.edges))
+
+    fixed = StreamingHistogram(bins=np.linspace(0, 4, 5))
+    fixed.add([-np.inf, 1.0, np.inf])
+    assert (fixed.underflow, fixed.overflow, fixed.total) == (1, 1, 3)